@@ -13,4 +13,7 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ChatBot.settings')
 
+# Route chat through the async views (no thread held per conversation)
+os.environ.setdefault('ASYNC_CHAT', 'true')
+
 application = get_asgi_application()
@@ -39,6 +39,8 @@ INSTALLED_APPS = [
 # Middleware
 # ==================================================
 MIDDLEWARE = [
+    # First, so Server-Timing's total covers the whole stack
+    "chatbotapp.middleware.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -153,13 +155,196 @@ LOGIN_URL = "/accounts/login/"
 LOGIN_REDIRECT_URL = "/"
 LOGOUT_REDIRECT_URL = "/accounts/login/"
 
+# ==================================================
+# Logging
+# ==================================================
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {
+            "class": "logging.StreamHandler",
+        },
+    },
+    "loggers": {
+        "chatbotapp": {
+            "handlers": ["console"],
+            "level": os.getenv("CHATBOT_LOG_LEVEL", "INFO"),
+        },
+    },
+}
+
 # ==================================================
 # Default primary key field
 # ==================================================
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# ==================================================
+# 🧠 RAG vector store
+# ==================================================
+# Segments are shared by every worker through the page cache.
+# Set VECTOR_STORE_DIR="" to keep vectors in process memory only
+# (then uploads indexed by `process_ingestion_jobs` aren't visible to
+# the web workers).
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR",
+                             str(BASE_DIR / "vector_store"))
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float32")
+# "int8" or "pq" keeps only compressed codes in RAM and rescores the
+# best VECTOR_STORE_RESCORE candidates against the vectors on disk.
+# The PQ codebook is trained by the ingestion worker (or
+# `manage.py train_codebook`); web workers only load it.
+VECTOR_STORE_QUANTIZATION = os.getenv("VECTOR_STORE_QUANTIZATION", "none")
+VECTOR_STORE_RESCORE = int(os.getenv("VECTOR_STORE_RESCORE", "200"))
+# "ivf" adds an approximate index (a float32 copy of every vector per
+# process) for searches over at least ANN_MIN_ROWS rows (one large
+# document or several); `manage.py build_ann_index` trains and saves it.
+# ANN_NPROBE lists of ANN_NLIST are scanned per query (more → better
+# recall, slower).
+VECTOR_STORE_ANN = os.getenv("VECTOR_STORE_ANN", "")
+ANN_NLIST = int(os.getenv("ANN_NLIST", "1024"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "32"))
+ANN_MIN_ROWS = int(os.getenv("ANN_MIN_ROWS", "20000"))
+# Train inline once ANN_NLIST * 40 rows are indexed; blocks searches in
+# that process while k-means runs, so only for single-process setups
+ANN_AUTO_TRAIN = os.getenv("ANN_AUTO_TRAIN", "false").lower() == "true"
+
+# Embedding cache: in-memory LRU (entries) + sqlite tier shared by workers.
+# Set EMBEDDING_CACHE_PATH="" to disable the on-disk tier.
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH",
+                                 str(BASE_DIR / "embedding_cache.sqlite3"))
+
+# Shared embedding worker (`manage.py run_embedding_worker`).
+# Leave EMBEDDING_WORKER_SOCKET empty to load the model in every process.
+EMBEDDING_WORKER_SOCKET = os.getenv("EMBEDDING_WORKER_SOCKET", "")
+EMBEDDING_WORKER_MAX_BATCH_SIZE = int(
+    os.getenv("EMBEDDING_WORKER_MAX_BATCH_SIZE", "64"))
+EMBEDDING_WORKER_MAX_WAIT_MS = float(
+    os.getenv("EMBEDDING_WORKER_MAX_WAIT_MS", "5"))
+
+# ==================================================
+# 🗄 Caches
+# ==================================================
+# LLM replies are cached for LLM_RESPONSE_CACHE_TTL seconds; LocMem
+# evicts once MAX_ENTRIES is reached. Point LLM_CACHE_BACKEND /
+# LLM_CACHE_LOCATION at a shared backend (e.g. Redis or the DB cache) to
+# share hits across workers. Set LLM_RESPONSE_CACHE_TTL=0 to disable.
+LLM_RESPONSE_CACHE_TTL = int(os.getenv("LLM_RESPONSE_CACHE_TTL", "3600"))
+LLM_RESPONSE_CACHE_ALIAS = "llm_responses" if LLM_RESPONSE_CACHE_TTL else ""
+# Turns of recent history in a reply's cache key: chat turns, and turns
+# with document context (0: same question + same chunks hits across
+# conversations)
+LLM_CACHE_HISTORY_TURNS = int(os.getenv("LLM_CACHE_HISTORY_TURNS", "2"))
+LLM_CACHE_DOCUMENT_HISTORY_TURNS = int(
+    os.getenv("LLM_CACHE_DOCUMENT_HISTORY_TURNS", "0"))
+# Per-conversation document alias index: point ALIAS_CACHE_BACKEND /
+# ALIAS_CACHE_LOCATION at a shared backend so an invalidation in one
+# worker reaches all of them; with LocMem, entries of other workers
+# expire after ALIAS_INDEX_TTL seconds
+ALIAS_INDEX_TTL = int(os.getenv("ALIAS_INDEX_TTL", "300"))
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "document_aliases": {
+        "BACKEND": os.getenv("ALIAS_CACHE_BACKEND",
+                             "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("ALIAS_CACHE_LOCATION", "document-aliases"),
+        "TIMEOUT": ALIAS_INDEX_TTL,
+    },
+    "llm_responses": {
+        "BACKEND": os.getenv("LLM_CACHE_BACKEND",
+                             "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("LLM_CACHE_LOCATION", "llm-responses"),
+        "TIMEOUT": LLM_RESPONSE_CACHE_TTL or None,
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2000")),
+        },
+    },
+}
+
+# ==================================================
+# ⚡ Async chat (ASGI)
+# ==================================================
+# ChatBot/asgi.py turns this on, so uvicorn workers serve the async chat
+# views while gunicorn's sync WSGI workers keep the sync ones.
+ASYNC_CHAT = os.getenv("ASYNC_CHAT", "false").lower() == "true"
+
+# Threads used by async views for query embedding + vector search
+RETRIEVAL_THREADS = int(os.getenv("RETRIEVAL_THREADS", "4"))
+
+# ==================================================
+# 🔍 Retrieval
+# ==================================================
+# "hybrid" fuses dense and BM25 rankings (reciprocal rank fusion);
+# "dense" uses embeddings only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Time allowed per query for the BM25 stage (0 = no limit)
+HYBRID_LEXICAL_BUDGET_MS = int(os.getenv("HYBRID_LEXICAL_BUDGET_MS", "50"))
+# Threads searching the documents of a multi-document question
+# ("compare the first and second document") in parallel
+RETRIEVAL_FANOUT_THREADS = int(os.getenv("RETRIEVAL_FANOUT_THREADS", "4"))
+
+# Optional cross-encoder rerank: the best RERANK_CANDIDATES retrieved
+# chunks are rescored in one batch and only RERANK_TOP_N reach the
+# prompt. Scoring is limited to what fits RERANK_BUDGET_MS (0 = no
+# limit), else the retrieval order is kept. Until the model has been
+# timed once, a budgeted query scores only a few candidates.
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "4"))
+RERANK_BUDGET_MS = int(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+
+# Chunks whose estimated (MinHash) Jaccard similarity to one of the same
+# user's stored chunks reaches the threshold are aliased, not re-embedded
+CHUNK_DEDUP_ENABLED = os.getenv("CHUNK_DEDUP_ENABLED", "true").lower() == "true"
+CHUNK_DEDUP_THRESHOLD = float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.9"))
+
+# ==================================================
+# 🧾 Prompt assembly
+# ==================================================
+# Input-token budget per LLM call, filled by priority:
+# question → best document chunks → most recent history
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+
+# Rolling conversation summary: every SUMMARY_EVERY_TURNS turns, older
+# turns are folded into Conversation.summary in the background and only
+# the last SUMMARY_KEEP_RECENT_TURNS stay verbatim (0 disables).
+SUMMARY_EVERY_TURNS = int(os.getenv("SUMMARY_EVERY_TURNS", "4"))
+SUMMARY_KEEP_RECENT_TURNS = int(os.getenv("SUMMARY_KEEP_RECENT_TURNS", "2"))
+
+# ==================================================
+# 📜 Pagination
+# ==================================================
+# Messages / sidebar conversations rendered per page; older ones are
+# loaded on scroll through keyset-paginated JSON endpoints
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "50"))
+CONVERSATION_PAGE_SIZE = int(os.getenv("CONVERSATION_PAGE_SIZE", "30"))
+
 # ==================================================
 # 🔑 AI API Keys (DO NOT hardcode)
 # ==================================================
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+# ==================================================
+# 🤖 LLM backend
+# ==================================================
+# "groq" calls the Groq API (or any compatible server at LLM_BASE_URL);
+# "fake" calls the local stand-in from `manage.py run_fake_llm`, for
+# load tests without API keys or quota
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "")
+FAKE_LLM_URL = os.getenv("FAKE_LLM_URL", "http://127.0.0.1:8765")
+
+# ==================================================
+# 📈 Observability
+# ==================================================
+# Per-stage durations in the Server-Timing header (browser dev tools)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() == "true"
+# /metrics/ (Prometheus text) requires "Authorization: Bearer <token>"
+# when set, a staff login otherwise. Metrics are per worker process.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
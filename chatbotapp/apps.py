@@ -3,3 +3,10 @@ from django.apps import AppConfig
 class ChatbotappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatbotapp'
+
+    def ready(self):
+        from .document_aliases import connect_signals
+        connect_signals()
+
+        from .ingestion import connect_signals as connect_ingestion_signals
+        connect_ingestion_signals()
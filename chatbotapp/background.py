@@ -0,0 +1,28 @@
+"""
+Small in-process thread pool for fire-and-forget work that must not
+delay the response (e.g. conversation summaries).
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="background")
+
+
+def run_in_background(func, *args, **kwargs):
+
+    def task():
+        try:
+            return func(*args, **kwargs)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Background task %s failed", func.__name__)
+            return None
+        finally:
+            # Connections are per thread; don't leak this worker's
+            connections.close_all()
+
+    return _executor.submit(task)
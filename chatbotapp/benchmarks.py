@@ -0,0 +1,519 @@
+"""
+Reproducible benchmarks of the RAG and chat hot paths.
+
+Every input is generated from a fixed seed: synthetic prose, chunk
+corpora of a given size (clustered embeddings, see quantization_report)
+and multi-hundred-page PDF / DOCX files. Each stage reports latency
+percentiles, throughput and peak traced memory; `manage.py
+run_benchmarks` writes them as JSON so runs on two commits can be
+diffed (--baseline).
+
+Timed iterations run without tracemalloc (it slows Python code down
+several times); peak memory comes from one extra, traced iteration.
+"""
+
+import io
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+# ==================================================
+# 📝 Synthetic inputs
+# ==================================================
+_SYLLABLES = ("al", "ba", "cor", "de", "en", "fi", "gra", "hu", "in", "jo",
+              "ka", "lo", "man", "ne", "or", "pi", "qua", "ro", "sen", "ta",
+              "ul", "ve", "wi", "xo", "yu", "zen")
+
+
+def vocabulary(size=5000, seed=0):
+    random_state = np.random.RandomState(seed)
+    words = set()
+    while len(words) < size:
+        count = random_state.randint(1, 5)
+        words.add("".join(random_state.choice(_SYLLABLES, count)))
+    return sorted(words)
+
+
+class TextGenerator:
+    """
+    Deterministic prose: Zipf-distributed words, sentences of 6–24 words
+    and paragraphs of 3–7 sentences.
+    """
+
+    def __init__(self, seed=0, vocabulary_size=5000):
+        self.words = np.array(vocabulary(vocabulary_size, seed))
+        self.random_state = np.random.RandomState(seed)
+        ranks = np.arange(1, len(self.words) + 1)
+        self.weights = (1.0 / ranks) / (1.0 / ranks).sum()
+
+    def sentence(self):
+        count = self.random_state.randint(6, 25)
+        words = self.random_state.choice(self.words, count, p=self.weights)
+        return " ".join(words).capitalize() + "."
+
+    def paragraph(self):
+        return " ".join(self.sentence()
+                        for _ in range(self.random_state.randint(3, 8)))
+
+    def words_text(self, count):
+        return " ".join(
+            self.random_state.choice(self.words, count, p=self.weights))
+
+    def pages(self, count, paragraphs_per_page=6):
+        return [
+            "\n".join(self.paragraph() for _ in range(paragraphs_per_page))
+            for _ in range(count)
+        ]
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def build_pdf(pages, line_width=90, lines_per_page=60):
+    """
+    Minimal PDF (one Helvetica text block per page) with the given page
+    texts, wrapped at line_width characters.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, once the page ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for text in pages:
+        lines = []
+        for paragraph in text.split("\n"):
+            while paragraph:
+                cut = paragraph.rfind(" ", 0, line_width)
+                if len(paragraph) <= line_width or cut <= 0:
+                    cut = min(len(paragraph), line_width)
+                lines.append(paragraph[:cut])
+                paragraph = paragraph[cut:].lstrip()
+        lines = lines[:lines_per_page]
+        stream = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(
+            f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream = stream.encode("latin-1", errors="replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" %
+                       (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" %
+            (len(objects)))
+        page_ids.append(len(objects))
+    objects[1] = (b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(
+        b"%d 0 R" % page_id for page_id in page_ids), len(page_ids)))
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                 % (len(objects) + 1, xref))
+    return output.getvalue()
+
+
+def build_docx(pages):
+    from docx import Document as DocxDocument
+
+    document = DocxDocument()
+    for text in pages:
+        for paragraph in text.split("\n"):
+            document.add_paragraph(paragraph)
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+
+def build_llm_reply(generator, paragraphs=8):
+    """
+    Markdown-heavy reply of the kind clean_llm_output strips.
+    """
+    parts = []
+    for index in range(paragraphs):
+        parts.append(f"## Section {index + 1}")
+        parts.append(f"**{generator.sentence()}** {generator.paragraph()}")
+        parts.extend(f"- *{generator.sentence()}*" for _ in range(3))
+        parts.append(f"| {generator.words_text(3)} | {generator.words_text(3)} |")
+        parts.append("<br>")
+    return "\n".join(parts)
+
+
+# ==================================================
+# ⏱ Measurement
+# ==================================================
+def measure(stage, func, iterations, items=1, unit="ops", warmup=1,
+            **labels):
+    """
+    Run func `iterations` times (after `warmup` untimed runs) and return
+    a result row. `items` is the work done per call, for throughput.
+    """
+    for _ in range(warmup):
+        func()
+
+    timings = np.empty(iterations)
+    for index in range(iterations):
+        started = time.perf_counter()
+        func()
+        timings[index] = time.perf_counter() - started
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {"stage": stage}
+    result.update(labels)
+    result.update({
+        "iterations": iterations,
+        "p50_ms": round(float(np.percentile(timings, 50)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(timings, 99)) * 1000, 3),
+        "mean_ms": round(float(timings.mean()) * 1000, 3),
+        "throughput": round(items / float(timings.mean()), 2),
+        "unit": f"{unit}/s",
+        "peak_mib": round(peak / 2**20, 2),
+    })
+    return result
+
+
+class Cycle:
+    """
+    Calls func with the next input on every call (distinct queries per
+    iteration, so caches don't flatter the numbers).
+    """
+
+    def __init__(self, func, inputs):
+        self.func = func
+        self.inputs = inputs
+        self.position = 0
+
+    def __call__(self):
+        value = self.inputs[self.position % len(self.inputs)]
+        self.position += 1
+        return self.func(value)
+
+
+# ==================================================
+# 🧪 Stages
+# ==================================================
+def bench_chunking(pages, iterations):
+    from chatbotapp.rag.chunker import iter_spans
+
+    chunks = sum(1 for _ in iter_spans(pages))
+    characters = sum(len(page) for page in pages)
+    return [
+        measure("chunk_text",
+                lambda: sum(1 for _ in iter_spans(pages)),
+                iterations,
+                items=characters / 1e6,
+                unit="Mchars",
+                pages=len(pages),
+                chunks=chunks)
+    ]
+
+
+def bench_loading(pages, iterations):
+    from chatbotapp.rag.loader import load_document
+
+    results = []
+    for kind, data in (("pdf", build_pdf(pages)), ("docx", build_docx(pages))):
+        results.append(
+            measure(f"load_document_{kind}",
+                    lambda: load_document(
+                        SimpleUploadedFile(f"bench.{kind}", data)),
+                    iterations,
+                    items=len(pages),
+                    unit="pages",
+                    pages=len(pages),
+                    bytes=len(data)))
+    return results
+
+
+def bench_cleaning(generator, iterations):
+    from chatbotapp.text_cleaner import StreamingCleaner, clean_llm_output
+
+    replies = [build_llm_reply(generator) for _ in range(20)]
+
+    def stream(reply):
+        cleaner = StreamingCleaner()
+        for start in range(0, len(reply), 12):
+            cleaner.feed(reply[start:start + 12])
+        return cleaner.flush()
+
+    return [
+        measure("clean_llm_output",
+                Cycle(clean_llm_output, replies),
+                iterations,
+                unit="replies"),
+        measure("streaming_cleaner",
+                Cycle(stream, replies),
+                iterations,
+                unit="replies"),
+    ]
+
+
+def build_corpus_store(size, generator, seed=0):
+    """
+    In-memory store of `size` synthetic chunks over 10 documents of one
+    user, with clustered embeddings.
+    """
+    from chatbotapp.management.commands.quantization_report import \
+        synthetic_vectors
+    from chatbotapp.rag.vectorstore import SimpleVectorStore
+
+    store = SimpleVectorStore()
+    vectors = synthetic_vectors(size, seed=seed)
+    per_document = -(-size // 10)
+    for document_id, start in enumerate(range(0, size, per_document),
+                                        start=1):
+        end = min(start + per_document, size)
+        for batch in range(start, end, 1024):
+            batch_end = min(batch + 1024, end)
+            store.add_texts(
+                [generator.words_text(120) for _ in range(batch, batch_end)],
+                document_id=document_id,
+                user_id=1,
+                embeddings=vectors[batch:batch_end])
+    return store
+
+
+@contextmanager
+def isolated_embedding_cache(texts=()):
+    """
+    Swap the process embedding cache for a fresh in-memory one (no
+    sqlite tier), pre-filled with `texts`, so vectors cached by earlier
+    runs can't flatter the numbers.
+    """
+    from chatbotapp.rag import embeddings
+    from chatbotapp.rag.embedding_cache import EmbeddingCache
+
+    cache = EmbeddingCache(embeddings.EMBEDDING_MODEL_NAME,
+                           dim=embeddings.EMBEDDING_DIM,
+                           max_entries=max(len(texts), 1))
+    if texts:
+        cache.embed(list(texts), embeddings.encode_texts)
+    previous, embeddings._cache = embeddings._cache, cache
+    try:
+        yield cache
+    finally:
+        embeddings._cache = previous
+
+
+def bench_retrieval(size, generator, iterations, top_k=8):
+    """
+    BM25 indexing, query embedding, and dense and hybrid search over
+    `size` chunks.
+
+    embed_query times the model itself (encode_texts, no cache); the
+    searches run with this run's query vectors already cached, so they
+    time retrieval alone.
+    """
+    from chatbotapp.rag.embeddings import encode_texts
+    from chatbotapp.rag.lexical import LexicalPostings
+
+    store = build_corpus_store(size, generator)
+
+    # add_texts already indexed the partitions; time a rebuild
+    started = time.perf_counter()
+    for partition in store.user_partitions(1):
+        LexicalPostings().add(
+            partition.text(row) for row in range(len(partition)))
+    index_seconds = time.perf_counter() - started
+
+    queries = [generator.words_text(8) for _ in range(iterations * 3 + 3)]
+    results = [{
+        "stage": "bm25_index",
+        "chunks": size,
+        "iterations": 1,
+        "mean_ms": round(index_seconds * 1000, 3),
+        "throughput": round(size / index_seconds, 2),
+        "unit": "chunks/s",
+    }]
+    results.append(
+        measure("embed_query",
+                Cycle(lambda query: encode_texts([query]), queries),
+                iterations,
+                unit="queries",
+                chunks=size))
+    with isolated_embedding_cache(queries):
+        for scope, kwargs in (("document", {"document_id": 1}),
+                              ("user", {"user_id": 1})):
+            results.append(
+                measure("similarity_search",
+                        Cycle(lambda query: store.similarity_search(
+                            query, top_k, **kwargs), queries),
+                        iterations,
+                        unit="queries",
+                        chunks=size,
+                        scope=scope))
+            results.append(
+                measure("hybrid_search",
+                        Cycle(lambda query: store.hybrid_search(
+                            query, top_k, **kwargs), queries),
+                        iterations,
+                        unit="queries",
+                        chunks=size,
+                        scope=scope))
+    return results
+
+
+def bench_views(iterations, messages=200):
+    """
+    GET of the chat page and the messages page endpoint, on a
+    throwaway test database seeded with one long conversation.
+    """
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import (setup_test_environment,
+                                   teardown_test_environment)
+    from django.urls import reverse
+
+    from chatbotapp.models import ChatMessage, Conversation
+
+    setup_test_environment()
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        user = User.objects.create_user("bench", password="bench")
+        conversation = Conversation.objects.create(user=user, title="Bench")
+        generator = TextGenerator(seed=1)
+        ChatMessage.objects.bulk_create(
+            ChatMessage(conversation=conversation,
+                        user=user,
+                        message_type="text",
+                        user_message=generator.sentence(),
+                        bot_reply=generator.paragraph())
+            for _ in range(messages))
+
+        client = Client()
+        client.force_login(user)
+        home_url = reverse("conversation", args=[conversation.id])
+        page_url = reverse("conversation_messages", args=[conversation.id])
+        return [
+            measure("home_view",
+                    lambda: client.get(home_url),
+                    iterations,
+                    unit="requests",
+                    messages=messages),
+            measure("conversation_messages_view",
+                    lambda: client.get(page_url),
+                    iterations,
+                    unit="requests",
+                    messages=messages),
+        ]
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+# ==================================================
+# 📋 Report
+# ==================================================
+STAGES = ("chunking", "loading", "cleaning", "retrieval", "views")
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                cwd=settings.BASE_DIR,
+                                capture_output=True,
+                                text=True,
+                                timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "retrieval_mode": getattr(settings, "RETRIEVAL_MODE", ""),
+        "vector_store_ann": getattr(settings, "VECTOR_STORE_ANN", ""),
+    }
+
+
+def run(stages=STAGES, sizes=(1000, 10000, 100000), pages=300,
+        iterations=50, seed=0, log=print):
+    """
+    Run the selected stages and return the JSON-serializable report.
+    """
+    generator = TextGenerator(seed=seed)
+    document_pages = generator.pages(pages)
+    results = []
+
+    def record(rows):
+        for row in rows:
+            log(format_row(row))
+        results.extend(rows)
+
+    if "chunking" in stages:
+        record(bench_chunking(document_pages, max(3, iterations // 10)))
+    if "loading" in stages:
+        record(bench_loading(document_pages, 3))
+    if "cleaning" in stages:
+        record(bench_cleaning(generator, iterations))
+    if "retrieval" in stages:
+        for size in sizes:
+            record(bench_retrieval(size, TextGenerator(seed=seed + size),
+                                   iterations))
+    if "views" in stages:
+        record(bench_views(iterations))
+
+    report = {"environment": environment(), "results": results}
+    report["environment"]["max_rss_mib"] = round(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return report
+
+
+def result_key(row):
+    labels = sorted((key, value) for key, value in row.items()
+                    if key not in ("iterations", "p50_ms", "p99_ms",
+                                   "mean_ms", "throughput", "unit",
+                                   "peak_mib", "bytes"))
+    return tuple(labels)
+
+
+def format_row(row, baseline=None):
+    labels = " ".join(f"{key}={value}" for key, value in row.items()
+                      if key not in ("stage", "iterations", "p50_ms",
+                                     "p99_ms", "mean_ms", "throughput",
+                                     "unit", "peak_mib"))
+    line = f"{row['stage']:<28} {labels:<32}"
+    if "p50_ms" in row:
+        line += (f" p50 {row['p50_ms']:9.2f} ms  p99 {row['p99_ms']:9.2f} ms"
+                 f"  peak {row['peak_mib']:7.2f} MiB")
+    line += f"  {row['throughput']:.1f} {row['unit']}"
+    if baseline is not None and baseline.get("mean_ms"):
+        line += f"  ({row['mean_ms'] / baseline['mean_ms']:.2f}x baseline)"
+    return line
+
+
+def compare(report, baseline):
+    """
+    Lines of the report annotated with the ratio to a baseline report.
+    """
+    previous = {result_key(row): row for row in baseline["results"]}
+    return [
+        format_row(row, previous.get(result_key(row)))
+        for row in report["results"]
+    ]
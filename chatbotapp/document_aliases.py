@@ -0,0 +1,276 @@
+"""
+Per-conversation document alias index.
+
+Maps phrases in a chat message ("second document", a filename or a
+significant filename token) to the document(s) it refers to; "compare
+the first and second document", "the first document and the third
+document" or "both documents" name several. The aliases of
+a conversation are built when a document is uploaded and kept in the
+"document_aliases" cache (ALIAS_INDEX_TTL seconds), so resolving the
+target document on a chat turn costs no DB queries.
+
+Entries are invalidated whenever the conversation's document messages
+change, and are stamped with the conversation's active document: an
+upload makes every worker rebuild its entry on the next turn, even when
+the cache is per process.
+
+All aliases are matched in one Aho-Corasick pass over the message.
+"""
+
+from collections import deque
+from functools import lru_cache
+from itertools import permutations
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save, pre_delete
+
+from .models import ChatMessage, Document
+
+ORDINALS = ("first", "second", "third", "fourth")
+
+# Filename tokens shorter than this are too ambiguous to match on
+MIN_TOKEN_LENGTH = 5
+
+# Lower ranks win: ordinals first, then documents in upload order.
+# Coordinated ordinals ("first and second document", value: the tuple of
+# indexes) and "both/all documents" name several documents.
+_ORDINAL_RANK = 0
+_DOCUMENT_RANK = 1
+_COORDINATED_RANK = 2
+_ALL_DOCUMENTS_RANK = 3
+
+# Matched with a leading space, so "small documents" doesn't count
+ALL_DOCUMENTS_PHRASES = (" both document", " both the document",
+                         " both files", " all document", " all the document",
+                         " all of the document", " all my document",
+                         " all files")
+
+
+def _cache_key(conversation_id):
+    return f"doc-aliases:{conversation_id}"
+
+
+def _cache():
+    return caches["document_aliases"]
+
+
+def filename_alias(file_name):
+    filename = file_name.lower().split("/")[-1]
+    return filename.replace(".pdf", "").replace(".docx", "").replace("_", " ")
+
+
+class AliasMatcher:
+    """
+    Aho-Corasick automaton over (pattern, value) pairs; `match` returns
+    the smallest value among all patterns occurring in the text.
+    """
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._best = [None]
+
+        patterns = list(patterns)
+        for pattern, value in patterns:
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._best.append(None)
+                state = next_state
+            self._best[state] = _smaller(self._best[state], value)
+
+        # Breadth-first: fold each state's fail-chain output into its own
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                self._best[next_state] = _smaller(self._best[next_state],
+                                                  self._best[fail])
+                queue.append(next_state)
+
+        # Every value per state (fail-chain outputs included), for
+        # match_all; built lazily since most messages only need match
+        self._outputs = None
+        self._patterns = patterns
+
+    def match(self, text):
+        best = self._best[0]
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            best = _smaller(best, self._best[state])
+        return best
+
+    def match_all(self, text):
+        """
+        Set of values of every pattern occurring in the text.
+        """
+        if self._outputs is None:
+            self._outputs = self._build_outputs()
+
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            found.update(self._outputs[state])
+        return found
+
+    def _build_outputs(self):
+        outputs = [set() for _ in self._goto]
+        for pattern, value in self._patterns:
+            state = 0
+            for char in pattern:
+                state = self._goto[state][char]
+            outputs[state].add(value)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            outputs[state] |= outputs[self._fail[state]]
+            queue.extend(self._goto[state].values())
+        return [frozenset(values) for values in outputs]
+
+
+def _smaller(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+def coordinated_ordinals(count):
+    """
+    ("first and the second document", (0, 1)), ... for every list of two
+    or more of the first `count` ordinals; a bare ordinal outside such a
+    list ("the first point in the second document") names no document.
+    """
+    for size in range(2, count + 1):
+        for indexes in permutations(range(count), size):
+            words = [ORDINALS[index] for index in indexes]
+            head = ", ".join(words[:-1])
+            for joiner in (" and ", " and the ", ", and ", " & "):
+                yield f"{head}{joiner}{words[-1]} document", tuple(
+                    sorted(indexes))
+
+
+@lru_cache(maxsize=512)
+def _matcher(aliases):
+    """
+    Compiled automaton for a conversation's aliases (shared per process).
+    """
+    ordinals = ORDINALS[:len(aliases)]
+    patterns = []
+    for index, word in enumerate(ordinals):
+        patterns.append((f"{word} document", (_ORDINAL_RANK, index)))
+    for phrase, indexes in coordinated_ordinals(len(ordinals)):
+        patterns.append((phrase, (_COORDINATED_RANK, indexes)))
+    for phrase in ALL_DOCUMENTS_PHRASES:
+        patterns.append((phrase, (_ALL_DOCUMENTS_RANK, 0)))
+
+    for index, (_, name) in enumerate(aliases):
+        patterns.append((name, (_DOCUMENT_RANK, index)))
+        for token in set(name.split()):
+            if len(token) >= MIN_TOKEN_LENGTH:
+                patterns.append((token, (_DOCUMENT_RANK, index)))
+
+    return AliasMatcher(patterns)
+
+
+# ==================================================
+# 🗂️ Index build / invalidation
+# ==================================================
+def build_alias_index(conversation_id, version=None):
+    """
+    (document_id, filename alias) for each document of the conversation,
+    in upload order; cached until the conversation's documents change.
+
+    version: the conversation's active_document_id, checked on reads.
+    """
+    aliases = tuple(
+        (document_id, filename_alias(file_name))
+        for document_id, file_name in ChatMessage.objects.filter(
+            conversation_id=conversation_id,
+            message_type="document",
+            document__isnull=False).order_by("created_at").values_list(
+                "document_id", "document__file"))
+    _cache().set(_cache_key(conversation_id), (version, aliases),
+                 timeout=getattr(settings, "ALIAS_INDEX_TTL", 300))
+    return aliases
+
+
+def get_alias_index(conversation_id, version=None):
+    entry = _cache().get(_cache_key(conversation_id))
+    if entry is None or entry[0] != version:
+        return build_alias_index(conversation_id, version)
+    return entry[1]
+
+
+def invalidate_alias_index(conversation_id):
+    _cache().delete(_cache_key(conversation_id))
+
+
+def resolve_document_aliases(conversation_id, user_msg, version=None):
+    """
+    Document ids referred to by the message, in upload order (empty if
+    none).
+
+    Several documents are named by a coordinated list ("the first and
+    second document"), by several "<ordinal> document" phrases, or by
+    "both/all documents"; otherwise the best single match wins, ordinals
+    before filenames.
+    """
+    aliases = get_alias_index(conversation_id, version)
+    if not aliases:
+        return []
+
+    found = _matcher(aliases).match_all(" " + user_msg.lower())
+    if not found:
+        return []
+    if any(rank == _ALL_DOCUMENTS_RANK for rank, _ in found):
+        return [document_id for document_id, _ in aliases]
+
+    indexes = set()
+    for rank, value in found:
+        if rank == _COORDINATED_RANK:
+            indexes.update(value)
+        elif rank == _ORDINAL_RANK:
+            indexes.add(value)
+    if len(indexes) < 2:
+        indexes = {min(found)[1]}
+    return [aliases[index][0] for index in sorted(indexes)]
+
+
+def _chat_message_changed(sender, instance, **kwargs):
+    if instance.message_type == "document":
+        invalidate_alias_index(instance.conversation_id)
+
+
+def _document_changed(sender, instance, **kwargs):
+    for conversation_id in ChatMessage.objects.filter(
+            document_id=instance.id).values_list("conversation_id",
+                                                 flat=True):
+        invalidate_alias_index(conversation_id)
+
+
+def connect_signals():
+    post_save.connect(_chat_message_changed, sender=ChatMessage)
+    post_delete.connect(_chat_message_changed, sender=ChatMessage)
+    post_save.connect(_document_changed, sender=Document)
+    # Before the delete, while messages still point at the document
+    pre_delete.connect(_document_changed, sender=Document)
@@ -0,0 +1,223 @@
+"""
+Local stand-in for the Groq chat-completions API.
+
+Speaks the OpenAI-compatible protocol the Groq client uses
+(POST <base>/openai/v1/chat/completions, JSON or server-sent events),
+with configurable time to first token, token rate and injected errors,
+so the chat views can be load-tested without the real API. Point the
+app at it with LLM_BACKEND=fake (and FAKE_LLM_URL).
+
+Replies are deterministic for a given prompt and seed.
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_WORDS = ("the", "document", "describes", "a", "plan", "for", "growth",
+          "with", "clear", "steps", "and", "measured", "results", "across",
+          "each", "team", "while", "costs", "remain", "under", "control",
+          "in", "every", "quarter", "of", "year")
+
+
+@dataclass
+class FakeLLMOptions:
+    latency_ms: float = 200.0  # before the first token
+    tokens_per_second: float = 200.0
+    reply_tokens: int = 120
+    error_rate: float = 0.0
+    error_status: int = 500
+    seed: int = 0
+
+
+def fake_reply(prompt, tokens, seed=0):
+    """
+    Deterministic reply tokens (words with their trailing space).
+    """
+    digest = hashlib.sha256(f"{seed}\0{prompt}".encode("utf-8")).digest()
+    generator = random.Random(digest)
+    words = [generator.choice(_WORDS) for _ in range(tokens)]
+    words[0] = words[0].capitalize()
+    return [word + ("." if (index + 1) % 12 == 0 else "") + " "
+            for index, word in enumerate(words)]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.stats())
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON"}})
+            return
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        options = self.server.options
+        if self.server.should_fail():
+            self._send_json(options.error_status, {
+                "error": {
+                    "message": "Injected failure",
+                    "type": "fake_error",
+                }
+            })
+            return
+
+        prompt = "\n".join(
+            str(message.get("content", ""))
+            for message in body.get("messages", ()))
+        tokens = fake_reply(prompt,
+                            min(options.reply_tokens,
+                                body.get("max_tokens") or options.reply_tokens),
+                            options.seed)
+        model = body.get("model", "fake")
+
+        time.sleep(options.latency_ms / 1000)
+        if body.get("stream"):
+            self._stream(model, prompt, tokens)
+        else:
+            time.sleep(len(tokens) / options.tokens_per_second)
+            self._send_json(200, _completion(model, prompt, tokens))
+
+    def _stream(self, model, prompt, tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        interval = 1.0 / self.server.options.tokens_per_second
+        try:
+            for index, token in enumerate(tokens):
+                delta = {"content": token}
+                if index == 0:
+                    delta["role"] = "assistant"
+                self._event(_chunk(completion_id, model, delta, None))
+                time.sleep(interval)
+            # Groq reports usage in x_groq on the last chunk
+            last = _chunk(completion_id, model, {}, "stop")
+            last["x_groq"] = {
+                "id": completion_id,
+                "usage": _usage(prompt, tokens),
+            }
+            self._event(last)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _event(self, payload):
+        self.wfile.write(b"data: " + json.dumps(payload).encode("utf-8") +
+                         b"\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _chunk(completion_id, model, delta, finish_reason):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "delta": delta,
+            "finish_reason": finish_reason,
+        }],
+    }
+
+
+def _usage(prompt, tokens):
+    prompt_tokens = len(prompt.split())
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(tokens),
+        "total_tokens": prompt_tokens + len(tokens),
+    }
+
+
+def _completion(model, prompt, tokens):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {
+                "role": "assistant",
+                "content": "".join(tokens),
+            },
+            "finish_reason": "stop",
+        }],
+        "usage": _usage(prompt, tokens),
+    }
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, options=None):
+        super().__init__(address, FakeLLMHandler)
+        self.options = options or FakeLLMOptions()
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(self.options.seed)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def should_fail(self):
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.options.error_rate
+            self.errors += failed
+            return failed
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors}
+
+
+def start_fake_llm_server(host="127.0.0.1", port=0, options=None):
+    """
+    Serve on a daemon thread; returns the server (see .url, .shutdown()).
+    """
+    server = FakeLLMServer((host, port), options)
+    thread = threading.Thread(target=server.serve_forever,
+                              name="fake-llm",
+                              daemon=True)
+    thread.start()
+    return server
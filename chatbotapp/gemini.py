@@ -1,26 +1,97 @@
 import os
-from groq import Groq
+import time
+from django.conf import settings
+from groq import AsyncGroq, Groq
+
+from . import llm_cache, metrics
+from .timing import timed
 
 MODEL_NAME = "openai/gpt-oss-120b"
+TEMPERATURE = 0.4
+MAX_TOKENS = 1200
 
 _client = None
+_async_client = None
+
+
+def client_options():
+    """
+    Groq client arguments for the configured LLM_BACKEND:
+    "groq" (the real API, or LLM_BASE_URL) or "fake" (the local
+    stand-in server at FAKE_LLM_URL, see fake_llm.py).
+    """
+    backend = getattr(settings, "LLM_BACKEND", "groq")
+    if backend == "fake":
+        return {
+            "api_key": "fake",
+            "base_url": getattr(settings, "FAKE_LLM_URL",
+                                "http://127.0.0.1:8765"),
+        }
+    if backend != "groq":
+        raise ValueError(f"Unknown LLM backend: {backend}")
+
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise RuntimeError("GROQ_API_KEY not found in environment")
+    options = {"api_key": api_key}
+    if getattr(settings, "LLM_BASE_URL", ""):
+        options["base_url"] = settings.LLM_BASE_URL
+    return options
 
 
 def get_client():
     global _client
     if _client is None:
-        api_key = os.getenv("GROQ_API_KEY")
-        if not api_key:
-            raise RuntimeError("GROQ_API_KEY not found in environment")
-        _client = Groq(api_key=api_key)
+        _client = Groq(**client_options())
     return _client
 
 
-def get_ai_reply(message, history_text="", document_text=""):
-    client = get_client()  # ✅ ALWAYS get a valid client
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncGroq(**client_options())
+    return _async_client
+
+
+def reset_clients():
+    """
+    Drop the cached clients, e.g. after switching LLM_BACKEND.
+    """
+    global _client, _async_client
+    _client = _async_client = None
+
+
+def chunk_usage(chunk):
+    """
+    Token usage of a stream chunk: Groq reports it in x_groq on the
+    last chunk, OpenAI-compatible servers in usage.
+    """
+    usage = getattr(chunk, "usage", None)
+    if usage is None:
+        usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+    return usage
+
+
+def record_usage(usage, purpose="reply"):
+    """
+    Count the prompt / completion tokens of one LLM call.
+    """
+    if usage is None:
+        return
+    labels = {"purpose": purpose}
+    metrics.increment("llm_prompt_tokens_total",
+                      usage.prompt_tokens or 0,
+                      labels=labels,
+                      help_text="Prompt tokens sent to the LLM")
+    metrics.increment("llm_completion_tokens_total",
+                      usage.completion_tokens or 0,
+                      labels=labels,
+                      help_text="Completion tokens generated by the LLM")
+
 
+def build_prompt(message, history_text="", document_text=""):
     if document_text.strip():
-        prompt = f"""
+        return f"""
 You are a helpful AI assistant.
 
 DOCUMENT CONTENT:
@@ -37,8 +108,7 @@ Rules:
 - Otherwise use chat history
 - Be concise and clear
 """
-    else:
-        prompt = f"""
+    return f"""
 You are a helpful AI assistant.
 
 CHAT HISTORY:
@@ -53,14 +123,190 @@ Rules:
 - Answer naturally
 """
 
-    response = client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=[{
-            "role": "user",
-            "content": prompt
-        }],
-        temperature=0.4,
-        max_tokens=1200,
-    )
+
+def _cache_key(message, history_text, document_text):
+    # Document questions are answered from the retrieved context, so they
+    # can hit across conversations; chat keys on the latest turns
+    if document_text:
+        history_turns = getattr(settings, "LLM_CACHE_DOCUMENT_HISTORY_TURNS",
+                                0)
+    else:
+        history_turns = getattr(settings, "LLM_CACHE_HISTORY_TURNS", 2)
+    return llm_cache.response_cache_key(MODEL_NAME,
+                                        message,
+                                        history_text=history_text,
+                                        document_text=document_text,
+                                        history_turns=history_turns,
+                                        temperature=TEMPERATURE,
+                                        max_tokens=MAX_TOKENS)
+
+
+def get_ai_reply(message, history_text="", document_text="", use_cache=True):
+    """
+    Identical requests (same model, prompt, document context and recent
+    history, see _cache_key) are answered from the response cache unless
+    use_cache is False.
+    """
+    cache_key = _cache_key(message, history_text, document_text)
+    if use_cache:
+        cached = llm_cache.get_reply(cache_key)
+        if cached is not None:
+            return cached
+
+    client = get_client()  # ✅ ALWAYS get a valid client
+
+    prompt = build_prompt(message, history_text, document_text)
+
+    with timed("llm"):
+        response = client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=[{
+                "role": "user",
+                "content": prompt
+            }],
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS,
+        )
+    record_usage(response.usage)
+
+    reply = response.choices[0].message.content.strip()
+    if use_cache:
+        llm_cache.set_reply(cache_key, reply)
+    return reply
+
+
+def summarize_conversation(previous_summary, turns_text):
+    """
+    Fold new chat turns into the running conversation summary.
+    """
+    client = get_client()
+
+    prompt = f"""
+Update the running summary of a conversation between a user and an AI
+assistant.
+
+CURRENT SUMMARY:
+{previous_summary or "(none)"}
+
+NEW TURNS:
+{turns_text}
+
+Rules:
+- Keep every fact, name, number and preference the user stated
+- Keep decisions and answers the assistant gave that may be referred to later
+- Drop small talk and repetition
+- Plain text, at most 200 words
+"""
+
+    with timed("llm_summary"):
+        response = client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=[{
+                "role": "user",
+                "content": prompt
+            }],
+            temperature=0.2,
+            max_tokens=400,
+        )
+    record_usage(response.usage, purpose="summary")
 
     return response.choices[0].message.content.strip()
+
+
+def stream_ai_reply(message, history_text="", document_text="",
+                    use_cache=True):
+    """
+    Yield the reply as raw text deltas while Groq generates it
+    (a cached reply is yielded in one piece).
+
+    Time to first token is recorded in the
+    llm_time_to_first_token_seconds histogram.
+    """
+    cache_key = _cache_key(message, history_text, document_text)
+    if use_cache:
+        cached = llm_cache.get_reply(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    client = get_client()
+
+    prompt = build_prompt(message, history_text, document_text)
+
+    started = time.perf_counter()
+    with timed("llm"):
+        stream = client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=[{
+                "role": "user",
+                "content": prompt
+            }],
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS,
+            stream=True,
+        )
+
+        parts = []
+        for chunk in stream:
+            record_usage(chunk_usage(chunk))
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if not parts:
+                metrics.observe("llm_time_to_first_token_seconds",
+                                time.perf_counter() - started)
+            parts.append(delta)
+            yield delta
+
+    if use_cache:
+        llm_cache.set_reply(cache_key, "".join(parts).strip())
+
+
+async def astream_ai_reply(message, history_text="", document_text="",
+                           use_cache=True):
+    """
+    Async version of stream_ai_reply for the ASGI chat path; no thread
+    is held while waiting on Groq.
+    """
+    cache_key = _cache_key(message, history_text, document_text)
+    if use_cache:
+        cached = await llm_cache.aget_reply(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    client = get_async_client()
+
+    prompt = build_prompt(message, history_text, document_text)
+
+    started = time.perf_counter()
+    with timed("llm"):
+        stream = await client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=[{
+                "role": "user",
+                "content": prompt
+            }],
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS,
+            stream=True,
+        )
+
+        parts = []
+        async for chunk in stream:
+            record_usage(chunk_usage(chunk))
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if not parts:
+                metrics.observe("llm_time_to_first_token_seconds",
+                                time.perf_counter() - started)
+            parts.append(delta)
+            yield delta
+
+    if use_cache:
+        await llm_cache.aset_reply(cache_key, "".join(parts).strip())
@@ -0,0 +1,184 @@
+"""
+DB-backed document ingestion queue.
+
+Uploads only enqueue an IngestionJob; `manage.py process_ingestion_jobs`
+claims jobs and indexes them in the background.
+"""
+
+import time
+
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.utils import timezone
+
+from chatbotapp.rag.rag_pipeline import ingest_document
+from chatbotapp.rag.vectorstore import GLOBAL_VECTOR_STORE
+from . import metrics
+from .models import Document, IngestionJob
+
+# Chunks indexed per second of a job
+THROUGHPUT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+def enqueue_document(document):
+    return IngestionJob.objects.create(document=document)
+
+
+def claim_next_job():
+    """
+    Atomically move the oldest queued job to "running".
+
+    The conditional UPDATE makes the claim safe across any number of
+    worker processes without relying on SELECT ... FOR UPDATE.
+    """
+    while True:
+        job = (IngestionJob.objects.filter(
+            status="queued").order_by("created_at").first())
+        if job is None:
+            return None
+
+        claimed = IngestionJob.objects.filter(
+            id=job.id, status="queued").update(status="running",
+                                               started_at=timezone.now(),
+                                               attempts=F("attempts") + 1)
+        if claimed:
+            return IngestionJob.objects.select_related(
+                "document__user").get(id=job.id)
+
+
+def requeue_stale_jobs(max_age, max_attempts=3):
+    """
+    Recover jobs left "running" by a crashed worker: drop the chunks they
+    already published, then queue them again, or fail them once they
+    have been claimed max_attempts times.
+
+    Returns (requeued, failed).
+    """
+    cutoff = timezone.now() - max_age
+    requeued = failed = 0
+    for job in IngestionJob.objects.filter(status="running",
+                                           started_at__lt=cutoff):
+        running = IngestionJob.objects.filter(id=job.id, status="running")
+        if job.attempts < max_attempts:
+            updated = running.update(status="queued",
+                                     started_at=None,
+                                     pages_processed=0,
+                                     chunks_indexed=0)
+            requeued += updated
+        else:
+            updated = running.update(
+                status="failed",
+                error="Worker stopped before the job finished",
+                finished_at=timezone.now())
+            failed += updated
+        if updated:
+            discard_partial_document(job.document_id)
+    return requeued, failed
+
+
+def discard_partial_document(document_id):
+    """
+    Remove the chunks an unfinished job published (ingest_document makes
+    every batch searchable as soon as it is indexed).
+    """
+    try:
+        GLOBAL_VECTOR_STORE.delete_document(document_id)
+    except Exception as exc:  # pylint: disable=broad-except
+        print(f"❌ Could not remove partial document {document_id}: {exc}")
+
+
+def run_job(job):
+    document = job.document
+    pages = 0
+
+    def progress(pages_processed, chunks_indexed):
+        nonlocal pages
+        pages = pages_processed
+        IngestionJob.objects.filter(id=job.id).update(
+            pages_processed=pages_processed, chunks_indexed=chunks_indexed)
+
+    started = time.perf_counter()
+    try:
+        with document.file.open("rb") as uploaded_file:
+            indexed = ingest_document(user=document.user,
+                                      uploaded_file=uploaded_file,
+                                      document_id=document.id,
+                                      progress=progress)
+        if not indexed:
+            raise ValueError("No text extracted")
+    except Exception as exc:  # pylint: disable=broad-except
+        discard_partial_document(document.id)
+        IngestionJob.objects.filter(id=job.id).update(
+            status="failed", error=str(exc), finished_at=timezone.now())
+        print(f"❌ Ingestion failed for document {document.id}: {exc}")
+        record_job("failed", time.perf_counter() - started)
+        return False
+
+    record_job("done", time.perf_counter() - started, pages, indexed)
+    IngestionJob.objects.filter(id=job.id).update(status="done",
+                                                  finished_at=timezone.now())
+    train_store_indexes()
+    return True
+
+
+def train_store_indexes():
+    """
+    Train the vector store's PQ codebook once enough rows are stored.
+    Done here, off the query path: web processes only load it.
+    """
+    train_codebook = getattr(GLOBAL_VECTOR_STORE, "train_codebook", None)
+    if train_codebook is None:
+        return
+    try:
+        if train_codebook():
+            print("🧮 Trained the PQ codebook")
+    except Exception as exc:  # pylint: disable=broad-except
+        print(f"❌ Codebook training failed: {exc}")
+
+
+def record_job(status, seconds, pages=0, chunks=0):
+    """
+    Ingest metrics: jobs by outcome, job duration, pages / chunks
+    indexed and chunks per second.
+    """
+    metrics.increment("ingest_jobs_total",
+                      labels={"status": status},
+                      help_text="Ingestion jobs finished, by outcome")
+    metrics.observe("ingest_job_seconds",
+                    seconds,
+                    help_text="Seconds to index one document")
+    if not chunks:
+        return
+    metrics.increment("ingest_pages_total", pages,
+                      help_text="Pages extracted by ingestion jobs")
+    metrics.increment("ingest_chunks_total", chunks,
+                      help_text="Chunks indexed by ingestion jobs")
+    metrics.histogram("ingest_chunks_per_second",
+                      "Indexing throughput of one job",
+                      buckets=THROUGHPUT_BUCKETS).observe(chunks / seconds)
+
+
+def drain_queue(stop_when_empty=False, poll_interval=2.0):
+    """
+    Worker loop: claim and run jobs until the queue is empty
+    (stop_when_empty) or forever.
+    """
+    processed = 0
+    while True:
+        job = claim_next_job()
+        if job is None:
+            if stop_when_empty:
+                return processed
+            time.sleep(poll_interval)
+            continue
+
+        run_job(job)
+        processed += 1
+
+
+def _document_deleted(sender, instance, **kwargs):
+    GLOBAL_VECTOR_STORE.delete_document(instance.id)
+
+
+def connect_signals():
+    post_delete.connect(_document_deleted, sender=Document)
@@ -0,0 +1,104 @@
+"""
+Response cache for LLM calls.
+
+Entries are keyed by model, generation parameters, the normalized user
+prompt and fingerprints of the document context and of the last few
+history turns (the whole history only grows, so keying on it would
+never hit), and live in the Django cache named by
+LLM_RESPONSE_CACHE_ALIAS (TTL and size-bounded eviction come from that
+backend's TIMEOUT / MAX_ENTRIES).
+"""
+
+import hashlib
+import re
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+_WHITESPACE = re.compile(r"\s+")
+# Start of a turn in a rendered history (see summaries.format_turn)
+_TURN_START = re.compile(r"^User: ", re.MULTILINE)
+
+
+def normalize_prompt(text):
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def fingerprint(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def recent_history(history_text, turns):
+    """
+    The last `turns` turns of a rendered history; older turns and the
+    rolling summary are left out unless there are no more turns than that.
+    """
+    if not history_text or turns <= 0:
+        return ""
+    starts = [match.start() for match in _TURN_START.finditer(history_text)]
+    if len(starts) <= turns:
+        return history_text
+    return history_text[starts[-turns]:]
+
+
+def response_cache_key(model, message, history_text="", document_text="",
+                       history_turns=None, **params):
+    """
+    Document context is fingerprinted by content, so a document re-indexed
+    with more chunks (or a different document) gets a new key.
+
+    history_turns: only the last this many turns of history_text are part
+    of the key (None: all of it).
+    """
+    if history_turns is not None:
+        history_text = recent_history(history_text, history_turns)
+    parts = [
+        model,
+        repr(sorted(params.items())),
+        normalize_prompt(message),
+        fingerprint(document_text),
+        fingerprint(history_text),
+    ]
+    digest = hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+    return f"llm-reply:{digest}"
+
+
+def _cache():
+    alias = getattr(settings, "LLM_RESPONSE_CACHE_ALIAS", "")
+    return caches[alias] if alias else None
+
+
+def get_reply(key):
+    cache = _cache()
+    if cache is None:
+        return None
+    reply = cache.get(key)
+    metrics.increment("llm_cache_hits_total" if reply is not None else
+                      "llm_cache_misses_total")
+    return reply
+
+
+def set_reply(key, reply):
+    cache = _cache()
+    if cache is not None and reply:
+        cache.set(key, reply)
+
+
+async def aget_reply(key):
+    cache = _cache()
+    if cache is None:
+        return None
+    reply = await cache.aget(key)
+    metrics.increment("llm_cache_hits_total" if reply is not None else
+                      "llm_cache_misses_total")
+    return reply
+
+
+async def aset_reply(key, reply):
+    cache = _cache()
+    if cache is not None and reply:
+        await cache.aset(key, reply)
@@ -0,0 +1,215 @@
+"""
+End-to-end load test of the chat app.
+
+Virtual users log in, open the chat page, upload a generated document
+and chat, concurrently, through the full Django stack (middleware,
+views, ORM, LLM client). Each request's latency, status and DB query
+count are recorded; `manage.py load_test` prints requests/sec, latency
+percentiles and queries per request for each endpoint.
+
+Runs on a throwaway test database and media directory, normally
+against the fake LLM server (fake_llm.py) so no API quota is spent.
+The vector store must be in memory (VECTOR_STORE_DIR=""): test
+document ids would otherwise overwrite real documents' vectors.
+"""
+
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+
+from .benchmarks import TextGenerator, build_docx
+from .models import Conversation
+
+LOAD_TEST_PASSWORD = "load-test-password"
+
+
+class QueryCounter:
+    """
+    connection.execute_wrapper that counts this thread's queries.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Recorder:
+
+    def __init__(self):
+        self.samples = []  # (endpoint, seconds, status, queries)
+        self._lock = threading.Lock()
+
+    def request(self, endpoint, send):
+        """
+        Time send() (a Client call) including its streamed body, and
+        count the queries it ran.
+        """
+        counter = QueryCounter()
+        started = time.perf_counter()
+        status = 0
+        try:
+            with connection.execute_wrapper(counter):
+                response = send()
+                status = response.status_code
+                if response.streaming:
+                    body = b"".join(response.streaming_content)
+                    if b"event: error" in body:
+                        status = 502
+        except Exception:  # pylint: disable=broad-except
+            status = 599
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.samples.append((endpoint, elapsed, status, counter.count))
+        return status
+
+    def summary(self, wall_seconds):
+        endpoints = {}
+        for endpoint, seconds, status, queries in self.samples:
+            entry = endpoints.setdefault(endpoint, ([], [], []))
+            entry[0].append(seconds)
+            entry[1].append(status)
+            entry[2].append(queries)
+
+        rows = []
+        for endpoint, (seconds, statuses, queries) in endpoints.items():
+            seconds = np.array(seconds) * 1000
+            rows.append({
+                "endpoint": endpoint,
+                "requests": len(seconds),
+                "errors": sum(1 for status in statuses if status >= 400),
+                "p50_ms": round(float(np.percentile(seconds, 50)), 2),
+                "p95_ms": round(float(np.percentile(seconds, 95)), 2),
+                "p99_ms": round(float(np.percentile(seconds, 99)), 2),
+                "queries_mean": round(float(np.mean(queries)), 2),
+                "queries_max": int(np.max(queries)),
+            })
+        return {
+            "requests": len(self.samples),
+            "errors": sum(row["errors"] for row in rows),
+            "wall_seconds": round(wall_seconds, 2),
+            "requests_per_second": round(len(self.samples) / wall_seconds, 2),
+            "endpoints": rows,
+        }
+
+
+def run_user(recorder, username, turns, upload, stream, seed):
+    generator = TextGenerator(seed=seed)
+    client = Client()
+    try:
+        recorder.request(
+            "login",
+            lambda: client.post(reverse("login"), {
+                "username": username,
+                "password": LOAD_TEST_PASSWORD,
+            }))
+        recorder.request("home", lambda: client.get(reverse("home")))
+        conversation_id = Conversation.objects.filter(
+            user__username=username).values_list("id", flat=True).first()
+        chat_url = reverse("conversation", args=[conversation_id])
+
+        if upload:
+            document = build_docx(generator.pages(upload))
+            recorder.request(
+                "upload", lambda: client.post(
+                    chat_url, {
+                        "document": SimpleUploadedFile(
+                            f"report-{username}.docx", document)
+                    }))
+
+        stream_url = reverse("chat_stream", args=[conversation_id])
+        for _ in range(turns):
+            message = generator.sentence()
+            if stream:
+                recorder.request(
+                    "chat_stream",
+                    lambda: client.post(stream_url, {"message": message}))
+            else:
+                recorder.request(
+                    "chat", lambda: client.post(chat_url, {"message": message}))
+    finally:
+        connections.close_all()
+
+
+def run(users=20, turns=5, concurrency=8, upload_pages=5, stream=True,
+        ingest=False, seed=0):
+    """
+    Create `users` accounts on a test database and run them with
+    `concurrency` threads. Returns the summary dict.
+    """
+    setup_test_environment()
+    settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ["testserver"]
+
+    old_name = connection.settings_dict["NAME"]
+    if connection.vendor == "sqlite":
+        # A file (not the shared in-memory DB) so threads can write
+        # concurrently, waiting on sqlite's lock like separate workers
+        connection.settings_dict["TEST"]["NAME"] = tempfile.mktemp(
+            prefix="chatbot-load-", suffix=".sqlite3")
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    # Uploads go to a scratch MEDIA_ROOT, not next to the real documents
+    media_root = tempfile.TemporaryDirectory(prefix="chatbot-load-media-")
+    media_settings = override_settings(MEDIA_ROOT=media_root.name)
+    media_settings.enable()
+    try:
+        usernames = [f"load-{index}" for index in range(users)]
+        for username in usernames:
+            User.objects.create_user(username, password=LOAD_TEST_PASSWORD)
+
+        stop = threading.Event()
+        ingester = None
+        if ingest:
+            ingester = threading.Thread(target=_ingest_until,
+                                        args=(stop, ),
+                                        daemon=True)
+            ingester.start()
+
+        recorder = Recorder()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(run_user, recorder, username, turns,
+                            upload_pages, stream, seed + index)
+                for index, username in enumerate(usernames)
+            ]
+            for future in futures:
+                future.result()
+        wall_seconds = time.perf_counter() - started
+
+        stop.set()
+        if ingester is not None:
+            ingester.join()
+        return recorder.summary(wall_seconds)
+    finally:
+        connections.close_all()
+        media_settings.disable()
+        media_root.cleanup()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def _ingest_until(stop):
+    from .ingestion import claim_next_job, run_job
+
+    try:
+        while not stop.is_set():
+            job = claim_next_job()
+            if job is None:
+                time.sleep(0.2)
+                continue
+            run_job(job)
+    finally:
+        connections.close_all()
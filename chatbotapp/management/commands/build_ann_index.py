@@ -0,0 +1,83 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbotapp.rag.ann import IVFIndex
+from chatbotapp.rag.vectorstore import GLOBAL_VECTOR_STORE, normalize_rows
+
+from .quantization_report import synthetic_vectors
+
+
+def recall_and_latency(index, vectors, queries, k, nprobe):
+    """
+    recall@k against exact search and mean milliseconds per query.
+    """
+    exact = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+    hits, started = 0, time.perf_counter()
+    for query, truth in zip(queries, exact):
+        found = [row for _, row, _ in index.search(query, k, nprobe=nprobe)]
+        hits += len(np.intersect1d(found, truth))
+    elapsed = time.perf_counter() - started
+    return hits / (len(queries) * k), 1000 * elapsed / len(queries)
+
+
+class Command(BaseCommand):
+    help = "Train and save the IVF index of the vector store (or benchmark it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--queries", type=int, default=100)
+        parser.add_argument("--nprobe",
+                            type=int,
+                            nargs="*",
+                            default=[],
+                            help="nprobe values to report recall for")
+        parser.add_argument("--synthetic",
+                            type=int,
+                            default=0,
+                            help="Benchmark on N synthetic vectors instead "
+                            "of building the store's index")
+        parser.add_argument("--nlist", type=int, default=1024)
+
+    def handle(self, *args, **options):
+        if options["synthetic"]:
+            vectors = synthetic_vectors(options["synthetic"])
+            index = IVFIndex(vectors.shape[1], nlist=options["nlist"])
+            index.add(vectors, document_id=0, first_row=0, user_id=0)
+        else:
+            index = GLOBAL_VECTOR_STORE.ann
+            if index is None:
+                raise CommandError("Set VECTOR_STORE_ANN=ivf first")
+
+        started = time.perf_counter()
+        index.train()
+        self.stdout.write(f"🧭 Trained {index.nlist} lists on {len(index)} "
+                          f"vectors in {time.perf_counter() - started:.1f}s")
+
+        if not options["synthetic"] and hasattr(GLOBAL_VECTOR_STORE,
+                                                "save_ann"):
+            GLOBAL_VECTOR_STORE.save_ann()
+            self.stdout.write("💾 Saved the index next to the segments")
+
+        # Recall is measured on the synthetic set only (one flat "document")
+        if not options["synthetic"] or not options["nprobe"]:
+            return
+
+        # Queries: stored vectors nudged off their exact position
+        random_state = np.random.RandomState(1)
+        picked = random_state.choice(len(vectors),
+                                     min(options["queries"], len(vectors)),
+                                     replace=False)
+        queries = normalize_rows(vectors[picked] + 0.05 * random_state.randn(
+            len(picked), vectors.shape[1]))
+
+        k = options["k"]
+        recall, ms = recall_and_latency(index, vectors, queries, k,
+                                        index.nlist)
+        self.stdout.write(f"   exact:   recall@{k} {recall:.3f}  "
+                          f"{ms:6.2f} ms/query")
+        for nprobe in options["nprobe"]:
+            recall, ms = recall_and_latency(index, vectors, queries, k, nprobe)
+            self.stdout.write(f"{nprobe:>8}: recall@{k} {recall:.3f}  "
+                              f"{ms:6.2f} ms/query")
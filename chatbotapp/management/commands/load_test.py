@@ -0,0 +1,98 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbotapp import gemini
+from chatbotapp.fake_llm import FakeLLMOptions, start_fake_llm_server
+from chatbotapp.loadtest import run
+
+
+class Command(BaseCommand):
+    help = ("Drive concurrent users (login, upload, chat) through the app "
+            "on a test database and report throughput and latency")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--turns",
+                            type=int,
+                            default=5,
+                            help="Chat messages per user")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--upload-pages",
+                            type=int,
+                            default=5,
+                            help="Pages of the DOCX each user uploads "
+                            "(0 to skip uploads)")
+        parser.add_argument("--no-stream",
+                            action="store_true",
+                            help="Chat through the form POST instead of "
+                            "the streaming endpoint")
+        parser.add_argument("--ingest",
+                            action="store_true",
+                            help="Index uploads in a background thread "
+                            "while the users chat")
+        parser.add_argument("--fake-llm",
+                            action="store_true",
+                            help="Answer from an in-process fake LLM server")
+        parser.add_argument("--llm-latency-ms", type=float, default=200)
+        parser.add_argument("--llm-tokens-per-second",
+                            type=float,
+                            default=200)
+        parser.add_argument("--llm-error-rate", type=float, default=0.0)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output",
+                            default="",
+                            help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        if getattr(settings, "VECTOR_STORE_DIR", ""):
+            # Test documents reuse real document ids
+            raise CommandError("Run with VECTOR_STORE_DIR= so the test "
+                               "documents are indexed in memory")
+
+        server = None
+        if options["fake_llm"]:
+            server = start_fake_llm_server(options=FakeLLMOptions(
+                latency_ms=options["llm_latency_ms"],
+                tokens_per_second=options["llm_tokens_per_second"],
+                error_rate=options["llm_error_rate"],
+                seed=options["seed"]))
+            settings.LLM_BACKEND = "fake"
+            settings.FAKE_LLM_URL = server.url
+            gemini.reset_clients()
+            self.stdout.write(f"🤖 Fake LLM on {server.url}")
+
+        self.stdout.write(f"🚦 {options['users']} users x {options['turns']} "
+                          f"turns, {options['concurrency']} at a time")
+        try:
+            report = run(users=options["users"],
+                         turns=options["turns"],
+                         concurrency=options["concurrency"],
+                         upload_pages=options["upload_pages"],
+                         stream=not options["no_stream"],
+                         ingest=options["ingest"],
+                         seed=options["seed"])
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        self.stdout.write(
+            f"\n{report['requests']} requests in {report['wall_seconds']}s: "
+            f"{report['requests_per_second']} req/s, "
+            f"{report['errors']} errors")
+        self.stdout.write(f"{'endpoint':<12} {'n':>5} {'err':>4} "
+                          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+                          f"{'queries':>8} {'max':>4}")
+        for row in report["endpoints"]:
+            self.stdout.write(
+                f"{row['endpoint']:<12} {row['requests']:>5} "
+                f"{row['errors']:>4} {row['p50_ms']:>9.1f} "
+                f"{row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} "
+                f"{row['queries_mean']:>8.1f} {row['queries_max']:>4}")
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as handle:
+                json.dump(report, handle, indent=2)
+            self.stdout.write(f"💾 Wrote {options['output']}")
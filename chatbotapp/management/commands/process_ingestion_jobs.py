@@ -0,0 +1,72 @@
+import multiprocessing
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from chatbotapp.ingestion import drain_queue, requeue_stale_jobs
+from chatbotapp.metrics import start_metrics_server
+
+
+def _worker(options, index=0):
+    if options["metrics_port"]:
+        # One port per worker process, each with its own registry
+        start_metrics_server(options["metrics_port"] + index)
+    drain_queue(stop_when_empty=options["once"],
+                poll_interval=options["poll_interval"])
+
+
+class Command(BaseCommand):
+    help = "Index queued document uploads in the background"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers",
+                            type=int,
+                            default=1,
+                            help="Number of worker processes")
+        parser.add_argument("--once",
+                            action="store_true",
+                            help="Exit when the queue is empty")
+        parser.add_argument("--poll-interval",
+                            type=float,
+                            default=2.0,
+                            help="Seconds to wait when the queue is empty")
+        parser.add_argument(
+            "--stale-after",
+            type=float,
+            default=1800,
+            help="Requeue jobs left running longer than this many seconds")
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=3,
+            help="Fail a stale job instead once it was claimed this often")
+        parser.add_argument("--metrics-port",
+                            type=int,
+                            default=0,
+                            help="Serve Prometheus metrics on this port "
+                            "(worker N on port + N)")
+
+    def handle(self, *args, **options):
+        requeued, failed = requeue_stale_jobs(
+            timedelta(seconds=options["stale_after"]),
+            max_attempts=options["max_attempts"])
+        if requeued:
+            self.stdout.write(f"🔁 Requeued {requeued} stale job(s)")
+        if failed:
+            self.stdout.write(f"⚠️ Marked {failed} stale job(s) as failed")
+
+        if options["workers"] <= 1:
+            _worker(options)
+            return
+
+        # Children must open their own DB connections
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=_worker, args=(options, index))
+            for index in range(options["workers"])
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
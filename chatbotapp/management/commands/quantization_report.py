@@ -0,0 +1,92 @@
+import json
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbotapp.rag.embeddings import EMBEDDING_DIM
+from chatbotapp.rag.quantization import evaluate
+from chatbotapp.rag.vectorstore import GLOBAL_VECTOR_STORE, normalize_rows
+
+
+def stored_vectors(limit):
+    partitions = GLOBAL_VECTOR_STORE.user_partitions(None)
+    blocks = []
+    for partition in partitions:
+        if hasattr(partition, "segments"):
+            blocks.extend(segment.embeddings for segment in partition.segments)
+        else:
+            blocks.append(partition.embeddings)
+    if not blocks:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    return np.concatenate([np.asarray(block, dtype=np.float32)
+                           for block in blocks])[:limit]
+
+
+def synthetic_vectors(rows, seed=0):
+    """
+    Clustered unit vectors (topics plus noise), closer to real embeddings
+    than uniform noise.
+    """
+    random_state = np.random.RandomState(seed)
+    topics = random_state.randn(max(rows // 50, 1), EMBEDDING_DIM)
+    labels = random_state.randint(len(topics), size=rows)
+    return normalize_rows(topics[labels] +
+                          0.6 * random_state.randn(rows, EMBEDDING_DIM))
+
+
+class Command(BaseCommand):
+    help = "Report memory and recall@k of int8 / PQ embedding storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--rescore",
+                            type=int,
+                            default=settings.VECTOR_STORE_RESCORE)
+        parser.add_argument("--limit",
+                            type=int,
+                            default=200_000,
+                            help="Maximum stored vectors to evaluate")
+        parser.add_argument("--synthetic",
+                            type=int,
+                            default=0,
+                            help="Use N synthetic vectors instead of the store")
+        parser.add_argument("--json", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["synthetic"]:
+            vectors = synthetic_vectors(options["synthetic"])
+        else:
+            vectors = stored_vectors(options["limit"])
+        if len(vectors) <= options["k"]:
+            raise CommandError(
+                "Not enough vectors; ingest documents or pass --synthetic N")
+
+        # Queries: stored vectors nudged off their exact position
+        random_state = np.random.RandomState(1)
+        picked = random_state.choice(len(vectors),
+                                     min(options["queries"], len(vectors)),
+                                     replace=False)
+        queries = normalize_rows(vectors[picked] + 0.05 * random_state.randn(
+            len(picked), vectors.shape[1]))
+
+        report = evaluate(vectors,
+                          queries,
+                          top_k=options["k"],
+                          rescore=options["rescore"])
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        k = options["k"]
+        self.stdout.write(f"📊 {report['rows']} vectors, {len(queries)} "
+                          f"queries, rescoring {options['rescore']}")
+        for mode in ("float32", "int8", "pq"):
+            result = report[mode]
+            line = (f"{mode:>8}: {result['bytes'] / 2**20:8.2f} MiB  "
+                    f"recall@{k} {result['recall']:.3f}")
+            if "recall_codes_only" in result:
+                line += f" (codes only {result['recall_codes_only']:.3f})"
+            self.stdout.write(line)
@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbotapp.benchmarks import STAGES, compare, run
+
+
+class Command(BaseCommand):
+    help = "Benchmark the RAG and chat hot paths and write JSON results"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stages",
+                            nargs="*",
+                            choices=STAGES,
+                            default=list(STAGES))
+        parser.add_argument("--sizes",
+                            type=int,
+                            nargs="*",
+                            default=[1000, 10000, 100000],
+                            help="Corpus sizes (chunks) for retrieval")
+        parser.add_argument("--pages",
+                            type=int,
+                            default=300,
+                            help="Pages of the generated PDF / DOCX")
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output",
+                            default="",
+                            help="Write the JSON report to this file")
+        parser.add_argument("--baseline",
+                            default="",
+                            help="JSON report of an earlier run to compare to")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["baseline"]:
+            try:
+                with open(options["baseline"], encoding="utf-8") as handle:
+                    baseline = json.load(handle)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Can't read baseline: {exc}") from exc
+
+        report = run(stages=options["stages"],
+                     sizes=options["sizes"],
+                     pages=options["pages"],
+                     iterations=options["iterations"],
+                     seed=options["seed"],
+                     log=self.stdout.write)
+
+        if baseline is not None:
+            self.stdout.write(f"\n📊 Against {options['baseline']}")
+            for line in compare(report, baseline):
+                self.stdout.write(line)
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as handle:
+                json.dump(report, handle, indent=2)
+            self.stdout.write(f"💾 Wrote {options['output']}")
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
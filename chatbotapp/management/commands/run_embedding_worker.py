@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbotapp.rag.embedding_worker import EmbeddingWorkerServer
+from chatbotapp.rag.embeddings import EMBEDDING_MODEL_NAME, encode_locally, get_model
+
+
+class Command(BaseCommand):
+    help = "Serve embeddings to all web workers over a Unix socket"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket",
+                            default=settings.EMBEDDING_WORKER_SOCKET,
+                            help="Unix socket path to listen on")
+        parser.add_argument("--max-batch-size",
+                            type=int,
+                            default=settings.EMBEDDING_WORKER_MAX_BATCH_SIZE)
+        parser.add_argument("--max-wait-ms",
+                            type=float,
+                            default=settings.EMBEDDING_WORKER_MAX_WAIT_MS)
+
+    def handle(self, *args, **options):
+        socket_path = options["socket"]
+        if not socket_path:
+            raise CommandError(
+                "Set EMBEDDING_WORKER_SOCKET or pass --socket")
+
+        # Load the model before accepting connections
+        get_model()
+
+        server = EmbeddingWorkerServer(
+            socket_path,
+            encode=encode_locally,
+            max_batch_size=options["max_batch_size"],
+            max_wait=options["max_wait_ms"] / 1000,
+        )
+        self.stdout.write(
+            f"✅ Embedding worker ({EMBEDDING_MODEL_NAME}) listening on "
+            f"{socket_path}")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from chatbotapp.fake_llm import FakeLLMOptions, FakeLLMServer
+
+
+class Command(BaseCommand):
+    help = "Serve a local stand-in for the Groq chat-completions API"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency-ms",
+                            type=float,
+                            default=200,
+                            help="Delay before the first token")
+        parser.add_argument("--tokens-per-second", type=float, default=200)
+        parser.add_argument("--reply-tokens", type=int, default=120)
+        parser.add_argument("--error-rate",
+                            type=float,
+                            default=0.0,
+                            help="Fraction of requests answered with an error")
+        parser.add_argument("--error-status",
+                            type=int,
+                            default=500,
+                            help="HTTP status of injected errors (e.g. 429)")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        server = FakeLLMServer(
+            (options["host"], options["port"]),
+            FakeLLMOptions(latency_ms=options["latency_ms"],
+                           tokens_per_second=options["tokens_per_second"],
+                           reply_tokens=options["reply_tokens"],
+                           error_rate=options["error_rate"],
+                           error_status=options["error_status"],
+                           seed=options["seed"]))
+        self.stdout.write(f"🤖 Fake LLM listening on {server.url} "
+                          f"(LLM_BACKEND=fake FAKE_LLM_URL={server.url})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbotapp.rag.quantization import PQ_TRAIN_ROWS
+from chatbotapp.rag.vectorstore import GLOBAL_VECTOR_STORE
+
+
+class Command(BaseCommand):
+    help = "Train and save the PQ codebook of the vector store"
+
+    def handle(self, *args, **options):
+        codec = getattr(GLOBAL_VECTOR_STORE, "codec", None)
+        if codec is None or codec.mode != "pq":
+            raise CommandError("Set VECTOR_STORE_QUANTIZATION=pq first")
+
+        started = time.perf_counter()
+        if GLOBAL_VECTOR_STORE.train_codebook():
+            self.stdout.write(f"🧮 Trained the PQ codebook in "
+                              f"{time.perf_counter() - started:.1f}s; "
+                              f"restart web workers to re-encode")
+        elif codec.pq is not None:
+            self.stdout.write("✅ A codebook is already saved")
+        else:
+            self.stdout.write(f"⏳ Only {len(GLOBAL_VECTOR_STORE)} vectors "
+                              f"stored; training needs {PQ_TRAIN_ROWS}")
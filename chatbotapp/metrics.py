@@ -0,0 +1,193 @@
+"""
+Lightweight in-process metrics (one registry per worker process).
+
+A metric is identified by its name and optional labels
+(e.g. stage_seconds{stage="retrieve_context"}); render_prometheus()
+writes the registry in the Prometheus text format.
+"""
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; covers sub-millisecond cache hits up to slow LLM generations
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+class Histogram:
+
+    def __init__(self, name, help_text="", buckets=DEFAULT_BUCKETS,
+                 labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "buckets": self.buckets,
+                "bucket_counts": list(self.bucket_counts),
+                "count": self.count,
+                "sum": self.sum,
+            }
+
+
+_histograms = {}
+_lock = threading.Lock()
+
+
+def histogram(name, help_text="", buckets=DEFAULT_BUCKETS, labels=None):
+    key = (name, _label_key(labels))
+    with _lock:
+        metric = _histograms.get(key)
+        if metric is None:
+            metric = Histogram(name, help_text, buckets, key[1])
+            _histograms[key] = metric
+        return metric
+
+
+def observe(name, value, labels=None, help_text=""):
+    histogram(name, help_text, labels=labels).observe(value)
+
+
+def all_histograms():
+    with _lock:
+        return list(_histograms.values())
+
+
+class Counter:
+
+    def __init__(self, name, help_text="", labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def increment(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+_counters = {}
+
+
+def counter(name, help_text="", labels=None):
+    key = (name, _label_key(labels))
+    with _lock:
+        metric = _counters.get(key)
+        if metric is None:
+            metric = Counter(name, help_text, key[1])
+            _counters[key] = metric
+        return metric
+
+
+def increment(name, amount=1, labels=None, help_text=""):
+    counter(name, help_text, labels=labels).increment(amount)
+
+
+def all_counters():
+    with _lock:
+        return list(_counters.values())
+
+
+# ==================================================
+# 📈 Prometheus text format
+# ==================================================
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace(
+        '"', '\\"'))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"'
+                          for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """
+    The registry in the Prometheus text exposition format (0.0.4).
+    """
+    families = {}  # name -> (type, help, [lines])
+    for metric in sorted(all_counters(), key=lambda m: (m.name, m.labels)):
+        family = families.setdefault(metric.name, ["counter", "", []])
+        family[1] = family[1] or metric.help_text
+        family[2].append(f"{metric.name}{_format_labels(metric.labels)} "
+                         f"{metric.value}")
+
+    for metric in sorted(all_histograms(), key=lambda m: (m.name, m.labels)):
+        family = families.setdefault(metric.name, ["histogram", "", []])
+        family[1] = family[1] or metric.help_text
+        snapshot = metric.snapshot()
+        cumulative = 0
+        for bound, count in zip(snapshot["buckets"] + (float("inf"), ),
+                                snapshot["bucket_counts"]):
+            cumulative += count
+            labels = metric.labels + (("le", _format_value(bound)), )
+            family[2].append(f"{metric.name}_bucket{_format_labels(labels)} "
+                             f"{cumulative}")
+        labels = _format_labels(metric.labels)
+        family[2].append(f"{metric.name}_sum{labels} "
+                         f"{_format_value(snapshot['sum'])}")
+        family[2].append(f"{metric.name}_count{labels} {snapshot['count']}")
+
+    lines = []
+    for name, (kind, help_text, samples) in families.items():
+        if help_text:
+            lines.append(f"# HELP {name} {_escape(help_text)}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        data = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type",
+                         "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """
+    Serve render_prometheus() on a daemon thread, for processes without
+    a web view (e.g. ingestion workers).
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever,
+                     name="metrics",
+                     daemon=True).start()
+    return server
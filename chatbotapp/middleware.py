@@ -0,0 +1,82 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics, timing
+
+
+class ServerTimingMiddleware:
+    """
+    Report the stages timed during a request (see timing.py) in the
+    Server-Timing header, and observe request latency per view in
+    http_request_seconds.
+
+    Streaming responses return before their body is generated, so the
+    LLM stage of chat_stream only reaches the stage histograms.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        token = timing.start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = timing.end_request(token)
+        self.finish(request, response, timings,
+                    time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        token = timing.start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = timing.end_request(token)
+        self.finish(request, response, timings,
+                    time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def finish(request, response, timings, total):
+        match = request.resolver_match
+        metrics.observe("http_request_seconds",
+                        total,
+                        labels={
+                            "view": match.url_name if match else "unmatched",
+                            "method": request.method,
+                        },
+                        help_text="Seconds until the response (headers) "
+                        "was returned")
+
+        if getattr(settings, "SERVER_TIMING", True):
+            header = server_timing_header(timings, total)
+            if response.has_header("Server-Timing"):
+                header = f"{response['Server-Timing']}, {header}"
+            response["Server-Timing"] = header
+
+
+def server_timing_header(timings, total):
+    """
+    "stage;dur=12.3, ..., total;dur=45.6" (milliseconds); a stage that
+    ran several times is reported once with its summed duration.
+    """
+    durations = {}
+    for stage, seconds in timings:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    durations["total"] = total
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}"
+                     for stage, seconds in durations.items())
@@ -21,6 +21,53 @@ class Document(models.Model):
         return self.file.name
 
 
+# ==============================
+# ⚙️ Ingestion Job Model
+# ==============================
+class IngestionJob(models.Model):
+    """
+    Background indexing of an uploaded document
+    (drained by `manage.py process_ingestion_jobs`).
+    """
+    STATUS_CHOICES = (
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+
+    document = models.OneToOneField(
+        Document,
+        on_delete=models.CASCADE,
+        related_name="ingestion_job"
+    )
+
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default="queued"
+    )
+
+    pages_processed = models.PositiveIntegerField(default=0)
+    chunks_indexed = models.PositiveIntegerField(default=0)
+    # Times a worker claimed the job (stale jobs are requeued)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim the oldest queued job first
+            models.Index(fields=["status", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.document} ({self.status})"
+
+
 # ==============================
 # 💬 Conversation Model
 # ==============================
@@ -42,8 +89,19 @@ class Conversation(models.Model):
         related_name="active_in_conversations"
     )
 
+    # 🧠 Rolling summary of turns up to summary_until
+    # (kept up to date in the background, see summaries.py)
+    summary = models.TextField(blank=True)
+    summary_until = models.DateTimeField(null=True, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Sidebar: a user's conversations, newest first (keyset on id)
+            models.Index(fields=["user", "-created_at", "-id"]),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -95,6 +153,15 @@ class ChatMessage(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Chat page: a conversation's messages, newest first
+            models.Index(fields=["conversation", "-created_at", "-id"]),
+            # Prompt history / summaries (text) and alias index (document)
+            models.Index(fields=["conversation", "message_type",
+                                 "-created_at"]),
+        ]
+
     def __str__(self):
         if self.message_type == "document":
             return f"Document: {self.uploaded_file_name}"
@@ -0,0 +1,45 @@
+"""
+Keyset (cursor) pagination, newest first, on (created_at, id).
+
+Unlike OFFSET, each page is a single index range scan no matter how deep
+the user scrolls, and rows added while scrolling don't shift pages.
+"""
+
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+
+def encode_cursor(obj):
+    raw = f"{obj.created_at.isoformat()}|{obj.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    (created_at, id) from a cursor; raises ValueError when malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, obj_id = raw.split("|")
+        return datetime.fromisoformat(created_at), int(obj_id)
+    except (UnicodeError, TypeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def keyset_page(queryset, before=None, limit=50):
+    """
+    Returns (rows newest first, cursor for the next older page or None).
+    """
+    if before:
+        created_at, obj_id = decode_cursor(before)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at)
+            | Q(created_at=created_at, id__lt=obj_id))
+
+    rows = list(queryset.order_by("-created_at", "-id")[:limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
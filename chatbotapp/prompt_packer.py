@@ -0,0 +1,151 @@
+"""
+Token-budgeted prompt assembly.
+
+Fills PROMPT_TOKEN_BUDGET by priority: the question first, then the best
+retrieved chunks, then the most recent history turns. Whatever doesn't
+fit is truncated (if a useful amount of room is left) or dropped.
+
+Tokens are estimated from character counts (see count_tokens); no
+tokenizer dependency is needed.
+"""
+
+import logging
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Below this many tokens a truncated chunk/turn isn't worth sending
+MIN_TRUNCATED_TOKENS = 64
+
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 6000, 8000, 16000, 32000)
+
+# Token counts are estimated, not exact: ~4 characters per token for
+# English prose, which tends to overcount slightly for the gpt-oss
+# tokenizer. Leave PROMPT_TOKEN_BUDGET some headroom below the model's
+# context window to absorb the error.
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Cut text to roughly max_tokens, on a word boundary when possible.
+    """
+    if max_tokens <= 0:
+        return ""
+    limit = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > 0 else limit]
+
+
+@dataclass
+class PackedPrompt:
+    message: str
+    document_text: str
+    history_text: str
+    budget: int
+    tokens: dict = field(default_factory=dict)
+    chunks_used: int = 0
+    chunks_dropped: int = 0
+    turns_used: int = 0
+    turns_dropped: int = 0
+
+    @property
+    def total_tokens(self):
+        return sum(self.tokens.values())
+
+
+def _fit(text, remaining):
+    """
+    Return (text that fits, tokens used); text is "" when nothing fits.
+    """
+    cost = count_tokens(text)
+    if cost <= remaining:
+        return text, cost
+    if remaining >= MIN_TRUNCATED_TOKENS:
+        truncated = truncate_to_tokens(text, remaining)
+        return truncated, count_tokens(truncated)
+    return "", 0
+
+
+def pack_prompt(message, chunks, history_turns, overhead_text="",
+                budget=None):
+    """
+    Args:
+        message: the (enforced) user question, always kept
+        chunks: retrieved chunk texts, best first
+        history_turns: formatted history turns, newest first
+        overhead_text: fixed prompt template text counted against the budget
+        budget: total input tokens (defaults to PROMPT_TOKEN_BUDGET)
+    """
+    if budget is None:
+        budget = getattr(settings, "PROMPT_TOKEN_BUDGET", 6000)
+
+    packed = PackedPrompt(message="", document_text="", history_text="",
+                          budget=budget)
+
+    remaining = budget - count_tokens(overhead_text)
+    packed.tokens["template"] = budget - remaining
+
+    # 1️⃣ Question
+    question_tokens = count_tokens(message)
+    if question_tokens > remaining:
+        message = truncate_to_tokens(message, max(remaining, 0))
+        question_tokens = count_tokens(message)
+    packed.message = message
+    packed.tokens["question"] = question_tokens
+    remaining -= question_tokens
+
+    # 2️⃣ Best chunks
+    selected_chunks = []
+    document_tokens = 0
+    for chunk in chunks:
+        text, cost = _fit(chunk, remaining)
+        if not text:
+            break
+        selected_chunks.append(text)
+        document_tokens += cost
+        remaining -= cost
+    packed.document_text = "\n\n".join(selected_chunks)
+    packed.tokens["document"] = document_tokens
+    packed.chunks_used = len(selected_chunks)
+    packed.chunks_dropped = len(chunks) - len(selected_chunks)
+
+    # 3️⃣ Recent history (newest first, rendered oldest first)
+    selected_turns = []
+    history_tokens = 0
+    for turn in history_turns:
+        text, cost = _fit(turn, remaining)
+        if not text:
+            break
+        selected_turns.append(text)
+        history_tokens += cost
+        remaining -= cost
+    packed.history_text = "".join(
+        turn if turn.endswith("\n") else turn + "\n"
+        for turn in reversed(selected_turns))
+    packed.tokens["history"] = history_tokens
+    packed.turns_used = len(selected_turns)
+    packed.turns_dropped = len(history_turns) - len(selected_turns)
+
+    metrics.histogram("prompt_input_tokens",
+                      buckets=TOKEN_BUCKETS).observe(packed.total_tokens)
+    logger.info(
+        "Prompt budget %d/%d tokens (template=%d question=%d document=%d "
+        "history=%d; chunks %d used/%d dropped, turns %d used/%d dropped)",
+        packed.total_tokens, budget, packed.tokens["template"],
+        question_tokens, document_tokens, history_tokens, packed.chunks_used,
+        packed.chunks_dropped, packed.turns_used, packed.turns_dropped)
+
+    return packed
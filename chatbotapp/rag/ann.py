@@ -0,0 +1,307 @@
+# chatbotapp/rag/ann.py
+"""
+IVF (inverted file) approximate nearest-neighbour index.
+
+A k-means coarse quantizer splits the corpus into `nlist` lists; a query
+only scores the `nprobe` lists whose centroids are closest to it, so
+search cost grows with corpus_size * nprobe / nlist instead of the
+corpus size. Until the quantizer is trained (by `manage.py
+build_ann_index`, which saves the index for every process to load) the
+index is one flat list (exact search).
+
+Entries are (document_id, row) rows of the vector store, tagged with
+their user so searches can be scoped per user.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from .quantization import kmeans
+
+# k-means wants a few dozen points per centroid
+TRAIN_POINTS_PER_LIST = 40
+KMEANS_ITERATIONS = 10
+
+
+def _top_k(scores, k):
+    if len(scores) > k:
+        best = np.argpartition(scores, len(scores) - k)[-k:]
+    else:
+        best = np.arange(len(scores))
+    return best[np.argsort(scores[best])[::-1]]
+
+
+class _InvertedList:
+    """
+    Growable arrays of one list's vectors and their (document, row, user).
+    """
+
+    def __init__(self, dim, capacity=64):
+        self.dim = dim
+        self.size = 0
+        self.dead = 0
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.document_ids = np.empty(capacity, dtype=np.int64)
+        self.rows = np.empty(capacity, dtype=np.int64)
+        self.user_ids = np.empty(capacity, dtype=np.int64)
+        self.alive = np.empty(capacity, dtype=bool)
+
+    def _reserve(self, extra):
+        needed = self.size + extra
+        capacity = self.vectors.shape[0]
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+        for name in ("vectors", "document_ids", "rows", "user_ids", "alive"):
+            old = getattr(self, name)
+            grown = np.empty((capacity, ) + old.shape[1:], dtype=old.dtype)
+            grown[:self.size] = old[:self.size]
+            setattr(self, name, grown)
+
+    def append(self, vectors, document_ids, rows, user_ids):
+        count = len(vectors)
+        self._reserve(count)
+        end = self.size + count
+        self.vectors[self.size:end] = vectors
+        self.document_ids[self.size:end] = document_ids
+        self.rows[self.size:end] = rows
+        self.user_ids[self.size:end] = user_ids
+        self.alive[self.size:end] = True
+        self.size = end
+
+    def remove_document(self, document_id):
+        matches = self.alive[:self.size] & (self.document_ids[:self.size] ==
+                                            document_id)
+        removed = int(np.count_nonzero(matches))
+        if removed:
+            self.alive[:self.size][matches] = False
+            self.dead += removed
+            if self.dead * 4 > self.size:
+                self.compact()
+        return removed
+
+    def compact(self):
+        # Fresh arrays rather than in-place moves: searches holding a
+        # snapshot keep reading the old ones
+        keep = np.flatnonzero(self.alive[:self.size])
+        for name in ("vectors", "document_ids", "rows", "user_ids"):
+            setattr(self, name, getattr(self, name)[keep])
+        self.alive = np.ones(len(keep), dtype=bool)
+        self.size = len(keep)
+        self.dead = 0
+
+    def snapshot(self):
+        """
+        (size, vectors, document_ids, rows, user_ids, alive) as of now.
+
+        Appends only write past `size` and growth copies into new arrays,
+        so the snapshot stays consistent while the list changes.
+        """
+        return (self.size, self.vectors, self.document_ids, self.rows,
+                self.user_ids, self.alive)
+
+    def live(self):
+        """
+        (vectors, document_ids, rows, user_ids) of live entries.
+        """
+        keep = self.alive[:self.size]
+        return (self.vectors[:self.size][keep],
+                self.document_ids[:self.size][keep],
+                self.rows[:self.size][keep], self.user_ids[:self.size][keep])
+
+
+class IVFIndex:
+    """
+    IVF-Flat index: each list keeps full float32 copies of its vectors.
+
+    nprobe is the default number of lists scanned per query; search()
+    takes a per-query override (more lists → better recall, slower).
+    """
+
+    def __init__(self, dim, nlist=256, nprobe=16, auto_train=False):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        # Train inside add() once nlist * TRAIN_POINTS_PER_LIST rows exist.
+        # Off by default: add() runs on the query path (store refresh)
+        # and k-means would block every search while it trains.
+        self.auto_train = auto_train
+        self.centroids = None
+        self.lists = [_InvertedList(dim)]
+        # Opaque bookkeeping saved with the index (e.g. indexed segments)
+        self.metadata = {}
+        self._lock = threading.Lock()
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return sum(lst.size - lst.dead for lst in self.lists)
+
+    # -------------------------------
+    # Inserts / deletes
+    # -------------------------------
+    def add(self, vectors, document_id, first_row, user_id):
+        """
+        Insert rows first_row.. of a document (vectors L2-normalized).
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        rows = np.arange(first_row, first_row + len(vectors), dtype=np.int64)
+        document_ids = np.full(len(vectors), document_id, dtype=np.int64)
+        user_ids = np.full(len(vectors), user_id, dtype=np.int64)
+
+        with self._lock:
+            if self.trained:
+                self._assign(self.lists, self.centroids, vectors,
+                             document_ids, rows, user_ids)
+                return
+
+            self.lists[0].append(vectors, document_ids, rows, user_ids)
+            if (self.auto_train
+                    and len(self) >= self.nlist * TRAIN_POINTS_PER_LIST):
+                self._train()
+
+    @staticmethod
+    def _assign(lists, centroids, vectors, document_ids, rows, user_ids):
+        labels = (vectors @ centroids.T).argmax(axis=1)
+        for label in np.unique(labels):
+            selected = labels == label
+            lists[label].append(vectors[selected], document_ids[selected],
+                                rows[selected], user_ids[selected])
+
+    def remove_document(self, document_id):
+        with self._lock:
+            return sum(lst.remove_document(document_id) for lst in self.lists)
+
+    def train(self, seed=0):
+        """
+        Train the coarse quantizer on the current entries and redistribute
+        them into nlist lists.
+        """
+        with self._lock:
+            self._train(seed)
+
+    def _train(self, seed=0):
+        entries = [lst.live() for lst in self.lists]
+        if not sum(len(entry[0]) for entry in entries):
+            return
+        vectors, document_ids, rows, user_ids = (np.concatenate(parts)
+                                                 for parts in zip(*entries))
+        random_state = np.random.RandomState(seed)
+
+        sample = vectors
+        limit = self.nlist * TRAIN_POINTS_PER_LIST * 2
+        if len(sample) > limit:
+            sample = sample[random_state.choice(len(sample), limit,
+                                                replace=False)]
+        centroids = kmeans(sample, self.nlist, KMEANS_ITERATIONS,
+                           random_state)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids = (centroids / np.maximum(norms, 1e-12)).astype(np.float32)
+
+        # Built aside and swapped in, so searches never see half-filled lists
+        lists = [_InvertedList(self.dim) for _ in range(self.nlist)]
+        self._assign(lists, centroids, vectors, document_ids, rows, user_ids)
+        self.centroids, self.lists = centroids, lists
+
+    # -------------------------------
+    # Search
+    # -------------------------------
+    def search(self, query_vector, top_k, nprobe=None, user_id=None,
+               document_ids=None):
+        """
+        Best (document_id, row, score) triples, best first.
+
+        user_id / document_ids restrict the results to those entries.
+        """
+        with self._lock:
+            centroids, lists = self.centroids, self.lists
+            if centroids is not None:
+                nprobe = min(nprobe or self.nprobe, self.nlist)
+                probe = _top_k(centroids @ query_vector, nprobe)
+                lists = [lists[i] for i in probe]
+            snapshots = [lst.snapshot() for lst in lists]
+
+        allowed_documents = None
+        if document_ids is not None:
+            allowed_documents = np.fromiter(document_ids, dtype=np.int64)
+
+        found_scores, found_documents, found_rows = [], [], []
+        for size, vectors, list_documents, rows, users, alive in snapshots:
+            if not size or top_k <= 0:
+                continue
+            allowed = alive[:size].copy()
+            if user_id is not None:
+                allowed &= users[:size] == user_id
+            if allowed_documents is not None:
+                allowed &= np.isin(list_documents[:size], allowed_documents)
+            candidates = np.flatnonzero(allowed)
+            if not len(candidates):
+                continue
+            scores = (vectors[:size] @ query_vector)[candidates]
+            best = _top_k(scores, top_k)
+            found_scores.append(scores[best])
+            found_documents.append(list_documents[candidates[best]])
+            found_rows.append(rows[candidates[best]])
+
+        if not found_scores:
+            return []
+
+        scores = np.concatenate(found_scores)
+        documents = np.concatenate(found_documents)
+        rows = np.concatenate(found_rows)
+        order = _top_k(scores, top_k)
+        return [(int(documents[i]), int(rows[i]), float(scores[i]))
+                for i in order]
+
+    # -------------------------------
+    # Persistence
+    # -------------------------------
+    def save(self, path):
+        path = Path(path)
+        with self._lock:
+            centroids = self.centroids
+            entries = [lst.live() for lst in self.lists]
+        sizes = np.array([len(entry[0]) for entry in entries], dtype=np.int64)
+        vectors, document_ids, rows, user_ids = (np.concatenate(parts)
+                                                 for parts in zip(*entries))
+
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as handle:
+            np.savez(handle,
+                     config=np.array([self.dim, self.nlist, self.nprobe]),
+                     centroids=centroids if centroids is not None else
+                     np.empty((0, self.dim), dtype=np.float32),
+                     sizes=sizes,
+                     vectors=vectors,
+                     document_ids=document_ids,
+                     rows=rows,
+                     user_ids=user_ids,
+                     metadata=np.array(json.dumps(self.metadata)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            dim, nlist, nprobe = (int(value) for value in data["config"])
+            index = cls(dim, nlist=nlist, nprobe=nprobe)
+            if len(data["centroids"]):
+                index.centroids = data["centroids"]
+                index.lists = [_InvertedList(dim) for _ in range(nlist)]
+            index.metadata = json.loads(str(data["metadata"]))
+
+            start = 0
+            for lst, size in zip(index.lists, data["sizes"]):
+                end = start + int(size)
+                lst.append(data["vectors"][start:end],
+                           data["document_ids"][start:end],
+                           data["rows"][start:end], data["user_ids"][start:end])
+                start = end
+        return index
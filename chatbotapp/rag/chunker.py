@@ -0,0 +1,177 @@
+# chatbotapp/rag/chunker.py
+"""
+Streaming, token-aware chunker.
+
+Chunks are (start, end) character spans into the document text (pages
+joined with "\\n", as in load_document), sized in embedding-model tokens
+so nothing is silently truncated at encode time, and snapped back to a
+sentence or line boundary when one is close. Only the text from the
+current chunk start onwards is buffered.
+"""
+
+import re
+from typing import NamedTuple
+
+# all-MiniLM-L6-v2 truncates input at 256 word pieces (including the
+# [CLS]/[SEP] markers); leave headroom for the token estimate
+CHUNK_MAX_TOKENS = 200
+CHUNK_OVERLAP_TOKENS = 32
+
+# A chunk is only cut at a sentence boundary past this fraction of it
+MIN_SNAP_FRACTION = 0.5
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END = frozenset(".!?")
+
+
+class TextSpan(NamedTuple):
+    """
+    One chunk: document[start:end] (the text is carried for embedding
+    and then dropped; stores keep the span).
+    """
+    start: int
+    end: int
+    text: str
+
+
+def estimate_tokens(token):
+    """
+    Rough WordPiece count: short words are one piece, long or rare
+    words split into several, punctuation is one piece.
+    """
+    return 1 + (len(token) - 1) // 6
+
+
+def iter_spans(texts, max_tokens=CHUNK_MAX_TOKENS,
+               overlap_tokens=CHUNK_OVERLAP_TOKENS,
+               count_tokens=estimate_tokens):
+    """
+    Stream TextSpans over an iterable of texts (pages).
+
+    Consecutive chunks overlap by about overlap_tokens tokens.
+    """
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens must be smaller than max_tokens")
+
+    buffer = ""
+    base = 0  # document offset of buffer[0]
+    start = 0  # document offset of the next chunk
+    emitted_end = 0
+    first = True
+
+    for text in texts:
+        buffer += text if first else "\n" + text
+        first = False
+
+        while True:
+            span = _next_span(buffer, base, start, max_tokens,
+                              overlap_tokens, count_tokens)
+            if span is None:
+                break
+            chunk, start = span
+            emitted_end = chunk.end
+            yield chunk
+
+            # Drop text no later chunk can reach (amortized: only once
+            # most of the buffer is behind us)
+            if start - base > len(buffer) // 2:
+                buffer = buffer[start - base:]
+                base = start
+
+    # Whatever is left after the last full chunk
+    tokens = list(_TOKEN.finditer(buffer, start - base))
+    if tokens and base + tokens[-1].end() > emitted_end:
+        chunk_start = base + tokens[0].start()
+        chunk_end = base + tokens[-1].end()
+        yield TextSpan(chunk_start, chunk_end,
+                       buffer[chunk_start - base:chunk_end - base])
+
+
+def _next_span(buffer, base, start, max_tokens, overlap_tokens,
+               count_tokens):
+    """
+    (chunk, next start) if the buffer holds a full chunk from `start`,
+    else None.
+    """
+    tokens = []  # (match, cumulative tokens after it)
+    total = 0
+    for match in _TOKEN.finditer(buffer, start - base):
+        cost = count_tokens(match.group())
+        if total + cost > max_tokens and tokens:
+            break
+        total += cost
+        tokens.append((match, total))
+    else:
+        # Ran out of buffered text before filling a chunk
+        return None
+
+    # Prefer to end on a sentence or line boundary
+    last_index = len(tokens) - 1
+    cut = last_index
+    for index in range(last_index, -1, -1):
+        if tokens[index][1] < max_tokens * MIN_SNAP_FRACTION:
+            break
+        if _ends_sentence(buffer, tokens, index):
+            cut = index
+            break
+
+    chunk_start = base + tokens[0][0].start()
+    chunk_end = base + tokens[cut][0].end()
+    chunk = TextSpan(chunk_start, chunk_end,
+                     buffer[chunk_start - base:chunk_end - base])
+
+    # Back off about overlap_tokens tokens for the next chunk
+    kept = tokens[cut][1]
+    next_index = cut + 1
+    for index in range(cut, 0, -1):
+        if kept - tokens[index - 1][1] > overlap_tokens:
+            break
+        next_index = index
+    next_start = base + tokens[next_index][0].start() \
+        if next_index <= last_index else chunk_end
+    return chunk, max(next_start, chunk_start + 1)
+
+
+def _ends_sentence(buffer, tokens, index):
+    match = tokens[index][0]
+    if match.group() in _SENTENCE_END:
+        return True
+    if index + 1 < len(tokens):
+        gap = buffer[match.end():tokens[index + 1][0].start()]
+        return "\n" in gap
+    return False
+
+
+def pack_spans(texts, spans=None):
+    """
+    Store-side packing: the text covering a batch of chunks once, plus
+    each chunk's (start, end) within it.
+
+    Overlapping chunk texts share their common characters. Gaps between
+    spans (whitespace skipped by the chunker) are stored as spaces.
+    Without spans the texts are simply laid end to end.
+    """
+    if not texts:
+        return "", []
+
+    if spans is None:
+        relative, position = [], 0
+        for text in texts:
+            relative.append((position, position + len(text)))
+            position += len(text)
+        return "".join(texts), relative
+
+    base = spans[0][0]
+    covered = base
+    pieces, relative = [], []
+    for text, (start, end) in zip(texts, spans):
+        if len(text) != end - start:
+            raise ValueError("Chunk text does not match its span")
+        if start > covered:
+            pieces.append(" " * (start - covered))
+            covered = start
+        if end > covered:
+            pieces.append(text[covered - start:])
+            covered = end
+        relative.append((start - base, end - base))
+    return "".join(pieces), relative
@@ -0,0 +1,176 @@
+# chatbotapp/rag/dedup.py
+"""
+Near-duplicate chunk detection with MinHash + LSH, scoped per user.
+
+Repeated headers, disclaimers, boilerplate pages and re-uploaded
+revisions produce chunks that are almost identical to ones already in
+the store. Such a chunk isn't embedded or stored again: its document
+gets an alias to the existing (canonical) chunk instead.
+"""
+
+import re
+import threading
+import zlib
+
+import numpy as np
+
+NUM_PERMUTATIONS = 64
+# 16 bands of 4 rows: pairs above ~0.5 Jaccard become candidates, which
+# are then checked against the threshold
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+SHINGLE_WORDS = 5
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_random = np.random.RandomState(1)
+_A = _random.randint(1, 1 << 31, NUM_PERMUTATIONS).astype(np.uint64)
+_B = _random.randint(0, 1 << 31, NUM_PERMUTATIONS).astype(np.uint64)
+
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text):
+    """
+    crc32 hashes of the text's overlapping word 5-grams.
+    """
+    words = _WORD.findall(text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        grams = [" ".join(words)]
+    else:
+        grams = [
+            " ".join(words[i:i + SHINGLE_WORDS])
+            for i in range(len(words) - SHINGLE_WORDS + 1)
+        ]
+    return np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams),
+                       dtype=np.uint64,
+                       count=len(grams))
+
+
+def minhash(text):
+    """
+    MinHash signature (NUM_PERMUTATIONS uint32 values) of a text.
+    """
+    hashes = shingles(text)
+    # (a * x + b) mod p for every permutation × shingle; x, a, b < 2**32
+    # keeps the product inside uint64
+    permuted = (np.outer(_A, hashes) + _B[:, None]) % _MERSENNE_PRIME
+    return (permuted & _MAX_HASH).min(axis=1).astype(np.uint32)
+
+
+def similarity(signature_a, signature_b):
+    """
+    Estimated Jaccard similarity of two signatures.
+    """
+    return float(np.count_nonzero(signature_a == signature_b)) / len(
+        signature_a)
+
+
+class DedupIndex:
+    """
+    LSH index over the canonical chunks of one user.
+
+    Canonical chunks are referenced as (document_id, row) in the vector
+    store.
+    """
+
+    def __init__(self, threshold=0.9):
+        self.threshold = threshold
+        self.chunks_saved = 0
+        self.bytes_saved = 0
+        self._buckets = [{} for _ in range(BANDS)]
+        self._signatures = {}
+        self._indexed_rows = {}  # document_id → rows already indexed
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _band_keys(self, signature):
+        return [
+            signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()
+            for band in range(BANDS)
+        ]
+
+    def find(self, signature):
+        """
+        (document_id, row) of a canonical near-duplicate, or None.
+        """
+        best, best_score = None, self.threshold
+        seen = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            for candidate in self._buckets[band].get(key, ()):
+                if candidate in seen or candidate not in self._signatures:
+                    continue
+                seen.add(candidate)
+                score = similarity(signature, self._signatures[candidate])
+                if score >= best_score:
+                    best, best_score = candidate, score
+        return best
+
+    def add(self, ref, signature):
+        self._signatures[ref] = signature
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(key, []).append(ref)
+
+    def catch_up(self, partitions):
+        """
+        Index stored rows this index hasn't seen yet (e.g. chunks ingested
+        by another process or before a restart), and forget documents
+        that are no longer among the partitions (deleted ones).
+        """
+        with self._lock:
+            live = {partition.document_id for partition in partitions}
+            for document_id in set(self._indexed_rows) - live:
+                self._remove_document(document_id)
+
+            for partition in partitions:
+                start = self._indexed_rows.get(partition.document_id, 0)
+                for row in range(start, len(partition)):
+                    self.add((partition.document_id, row),
+                             minhash(partition.text(row)))
+                self._indexed_rows[partition.document_id] = len(partition)
+
+    def _remove_document(self, document_id):
+        # Bucket entries are dropped lazily by find()
+        rows = self._indexed_rows.pop(document_id, 0)
+        for row in range(rows):
+            self._signatures.pop((document_id, row), None)
+
+    def deduplicate(self, texts, document_id, first_row):
+        """
+        Split a batch about to be appended at first_row of document_id.
+
+        Returns (kept indices, aliases) where aliases holds the canonical
+        (document_id, row) of every dropped chunk. Kept chunks become
+        canonical themselves, so later duplicates in the same batch or
+        document map onto them.
+        """
+        kept, aliases = [], []
+        with self._lock:
+            for index, text in enumerate(texts):
+                signature = minhash(text)
+                canonical = self.find(signature)
+                if canonical is None:
+                    self.add((document_id, first_row + len(kept)), signature)
+                    kept.append(index)
+                else:
+                    aliases.append(canonical)
+                    self.chunks_saved += 1
+                    self.bytes_saved += len(text.encode("utf-8"))
+
+            self._indexed_rows[document_id] = first_row + len(kept)
+        return kept, aliases
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_dedup_index(user_id, threshold=0.9):
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is None:
+            index = DedupIndex(threshold)
+            _indexes[user_id] = index
+        return index
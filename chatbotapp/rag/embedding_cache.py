@@ -0,0 +1,175 @@
+# chatbotapp/rag/embedding_cache.py
+"""
+Content-addressed cache for chunk embeddings.
+
+Keys are sha256(model name + normalized text). Lookups go through a
+bounded in-memory LRU first, then a persistent sqlite tier shared by all
+workers; only the remaining misses are sent to the model, in one batch.
+"""
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class EmbeddingCache:
+
+    def __init__(self, model_name, dim, max_entries=10000, path=None):
+        self.model_name = model_name
+        self.dim = dim
+        self.max_entries = max_entries
+        self.path = path
+
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0
+
+        if self.path:
+            self._connection().execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+
+    # ------------------------------
+    # Keys & tiers
+    # ------------------------------
+    def key(self, text):
+        payload = f"{self.model_name}\0{normalize_text(text)}"
+        return hashlib.sha256(payload.encode("utf-8")).digest()
+
+    def _connection(self):
+        # sqlite connections can't be shared across threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _memory_get(self, key):
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+            return vector
+
+    def _memory_put(self, key, vector):
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def _disk_get_many(self, keys):
+        if not self.path or not keys:
+            return {}
+
+        found = {}
+        connection = self._connection()
+        # Stay well below sqlite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = connection.execute(
+                f"SELECT key, vector FROM embeddings "
+                f"WHERE key IN ({placeholders})", batch)
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def _disk_put_many(self, items):
+        if not self.path or not items:
+            return
+
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.astype(np.float32).tobytes())
+                 for key, vector in items])
+
+    # ------------------------------
+    # Public API
+    # ------------------------------
+    def embed(self, texts, encode):
+        """
+        Embed texts, calling encode(list_of_texts) once for the misses.
+        """
+        keys = [self.key(text) for text in texts]
+        vectors = {}
+
+        for key in keys:
+            if key not in vectors:
+                vector = self._memory_get(key)
+                if vector is not None:
+                    vectors[key] = vector
+        memory_hits = len(vectors)
+
+        pending = [key for key in dict.fromkeys(keys) if key not in vectors]
+        from_disk = self._disk_get_many(pending)
+        for key, vector in from_disk.items():
+            vectors[key] = vector
+            self._memory_put(key, vector)
+
+        # Unique texts that still need the model, in first-seen order
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+
+        if missing:
+            started = time.perf_counter()
+            encoded = np.asarray(encode(list(missing.values())),
+                                 dtype=np.float32)
+            elapsed = time.perf_counter() - started
+
+            new_items = list(zip(missing.keys(), encoded))
+            for key, vector in new_items:
+                vectors[key] = vector
+                self._memory_put(key, vector)
+            self._disk_put_many(new_items)
+        else:
+            elapsed = 0.0
+
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.disk_hits += len(from_disk)
+            self.misses += len(missing)
+            self.encode_seconds += elapsed
+
+        if not keys:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys])
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            per_text = self.encode_seconds / self.misses if self.misses else 0.0
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._lru),
+                "encode_seconds": self.encode_seconds,
+                # Model time the hits would have cost at the observed rate
+                "estimated_seconds_saved": hits * per_text,
+            }
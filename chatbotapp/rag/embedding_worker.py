@@ -0,0 +1,208 @@
+# chatbotapp/rag/embedding_worker.py
+"""
+Shared embedding worker.
+
+One process loads the sentence-transformers model and serves every web
+worker over a Unix socket. Concurrent requests are coalesced into
+micro-batches (up to max_batch_size texts, waiting at most max_wait
+seconds after the first one) so the model runs fewer, larger batches.
+
+Wire format, both directions: 4-byte big-endian length + payload.
+    request:  JSON {"texts": [...]}
+    response: JSON {"shape": [rows, dim]} followed by raw float32 rows,
+              or JSON {"error": "..."}
+"""
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+_LENGTH = struct.Struct("!I")
+
+
+def _send_frame(sock, payload):
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Embedding worker connection closed")
+        received += count
+    return bytes(buffer)
+
+
+def _recv_frame(sock):
+    (size, ) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return _recv_exact(sock, size)
+
+
+# ==================================================
+# Server side
+# ==================================================
+class _Request:
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent encode requests into batches for one model.
+    """
+
+    def __init__(self, encode, max_batch_size=64, max_wait=0.005):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.texts_encoded = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run,
+                                        name="embedding-batcher",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, texts):
+        request = _Request(texts)
+        self._queue.put(request)
+        return request.future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        size = len(batch[0].texts)
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.texts)
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for request in batch for text in request.texts]
+
+            try:
+                vectors = np.asarray(self.encode(texts), dtype=np.float32)
+            except Exception as exc:  # pylint: disable=broad-except
+                for request in batch:
+                    request.future.set_exception(exc)
+                continue
+
+            self.batches += 1
+            self.texts_encoded += len(texts)
+
+            start = 0
+            for request in batch:
+                end = start + len(request.texts)
+                request.future.set_result(vectors[start:end])
+                start = end
+
+
+class _EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        # Connections are persistent: serve requests until the client leaves
+        while True:
+            try:
+                request = json.loads(_recv_frame(self.request))
+            except (ConnectionError, OSError):
+                return
+
+            try:
+                vectors = self.server.batcher.submit(request["texts"]).result()
+            except Exception as exc:  # pylint: disable=broad-except
+                _send_frame(self.request, json.dumps({"error": str(exc)}).encode())
+                continue
+
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            header = json.dumps({"shape": list(vectors.shape)}).encode()
+            _send_frame(self.request, header)
+            _send_frame(self.request, vectors.tobytes())
+
+
+class EmbeddingWorkerServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    # Every web worker thread keeps a connection open
+    request_queue_size = 256
+
+    def __init__(self, socket_path, encode, max_batch_size=64, max_wait=0.005):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.batcher = MicroBatcher(encode,
+                                    max_batch_size=max_batch_size,
+                                    max_wait=max_wait)
+        super().__init__(socket_path, _EmbeddingRequestHandler)
+
+
+# ==================================================
+# Client side
+# ==================================================
+class EmbeddingWorkerClient:
+    """
+    Thread-safe client; keeps one persistent connection per thread.
+    """
+
+    def __init__(self, socket_path, timeout=60):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _socket(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _reset(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def _request(self, texts):
+        sock = self._socket()
+        _send_frame(sock, json.dumps({"texts": list(texts)}).encode())
+        header = json.loads(_recv_frame(sock))
+        if "error" in header:
+            raise RuntimeError(f"Embedding worker error: {header['error']}")
+        payload = _recv_frame(sock)
+        return np.frombuffer(payload, dtype=np.float32).reshape(header["shape"])
+
+    def encode(self, texts):
+        try:
+            return self._request(texts)
+        except OSError:
+            # The worker may have restarted since this connection was opened
+            self._reset()
+
+        try:
+            return self._request(texts)
+        except OSError:
+            self._reset()
+            raise
@@ -2,21 +2,101 @@
 
 from typing import List
 
+import numpy as np
+from django.conf import settings
+
+from .embedding_cache import EmbeddingCache
+from .embedding_worker import EmbeddingWorkerClient
+
 # ✅ Free, local, industry-standard embedding model
 # 384-dimensional vectors
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+
+_model = None
+_cache = None
+_worker_client = None
+
+
+def get_model():
+    """
+    Load the sentence-transformers model once per process.
+    """
+    global _model
+    if _model is None:
+        from sentence_transformers import SentenceTransformer
+        _model = SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu")
+    return _model
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache(
+            EMBEDDING_MODEL_NAME,
+            dim=EMBEDDING_DIM,
+            max_entries=getattr(settings, "EMBEDDING_CACHE_SIZE", 10000),
+            path=getattr(settings, "EMBEDDING_CACHE_PATH", "") or None,
+        )
+    return _cache
+
+
+def get_worker_client():
+    """
+    Client for the shared embedding worker, or None to encode in-process.
+    """
+    global _worker_client
+    socket_path = getattr(settings, "EMBEDDING_WORKER_SOCKET", "")
+    if not socket_path:
+        return None
+    if _worker_client is None:
+        _worker_client = EmbeddingWorkerClient(socket_path)
+    return _worker_client
+
+
+def encode_locally(texts: List[str]) -> np.ndarray:
+    """
+    Run the model in this process (no caching).
+    """
+    if not texts:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+
+    return get_model().encode(
+        texts,
+        show_progress_bar=False,
+        convert_to_numpy=True
+    ).astype(np.float32, copy=False)
+
+
+def encode_texts(texts: List[str]) -> np.ndarray:
+    """
+    Encode texts on the shared embedding worker when one is configured,
+    falling back to the in-process model if it can't be reached.
+    """
+    if not texts:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+
+    client = get_worker_client()
+    if client is not None:
+        try:
+            return client.encode(texts)
+        except OSError as exc:
+            print(f"⚠️ Embedding worker unavailable ({exc}), encoding locally")
+
+    return encode_locally(texts)
+
 
-def embed_texts(texts: List[str]) -> List[List[float]]:
+def embed_texts(texts: List[str]) -> np.ndarray:
     """
     Convert a list of texts into embedding vectors (LOCAL, FREE).
 
+    Repeated texts are served from the embedding cache; only cache
+    misses are sent to the model, in a single batch.
+
     Args:
         texts (List[str]): List of text chunks or questions
 
     Returns:
-        List[List[float]]: Embedding vectors
+        np.ndarray: float32 matrix of shape (len(texts), EMBEDDING_DIM)
     """
-    return _model.encode(
-        texts,
-        show_progress_bar=False,
-        convert_to_numpy=True
-    ).tolist()
+    return get_cache().embed(texts, encode_texts)
@@ -0,0 +1,175 @@
+# chatbotapp/rag/lexical.py
+"""
+BM25 lexical index over the chunks of each document partition.
+
+Dense embeddings blur exact strings (filenames, part numbers, quoted
+phrases); BM25 matches them exactly. Postings are compact per-term
+arrays (row ids as uint32, term frequencies as uint16) kept next to
+each partition and extended incrementally as rows are added.
+"""
+
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Rows tokenized per step while catching up, between deadline checks
+INDEX_STEP = 256
+
+# Words, plus compounds like "ab-1234", "v2.1" or "report_final"
+_TOKEN = re.compile(r"\w+(?:[-./]\w+)*")
+_PART = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    """
+    Lowercased tokens; compound tokens are also split into their parts
+    so "AB-1234" matches both "ab-1234" and "1234".
+    """
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        parts = _PART.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class LexicalPostings:
+    """
+    Inverted index of one partition: term → (rows, term frequencies).
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._lengths = array("I")
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, texts):
+        with self._lock:
+            for text in texts:
+                row = len(self._lengths)
+                counts = Counter(tokenize(text))
+                for term, frequency in counts.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = (array("I"), array("H"))
+                        self._postings[term] = postings
+                    postings[0].append(row)
+                    postings[1].append(min(frequency, 0xFFFF))
+
+                length = sum(counts.values())
+                self._lengths.append(length)
+                self.total_length += length
+
+    def document_frequency(self, term):
+        postings = self._postings.get(term)
+        return len(postings[0]) if postings else 0
+
+    def scores(self, term_idfs, average_length):
+        """
+        BM25 score of every row for the given {term: idf}.
+        """
+        with self._lock:
+            lengths = np.array(self._lengths, dtype=np.float32)
+            scores = np.zeros(len(lengths), dtype=np.float32)
+            norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths /
+                               max(average_length, 1e-9))
+
+            for term, idf in term_idfs.items():
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                rows = np.array(postings[0], dtype=np.int64)
+                frequencies = np.array(postings[1], dtype=np.float32)
+                scores[rows] += idf * frequencies * (BM25_K1 + 1) / (
+                    frequencies + norms[rows])
+
+        return scores
+
+
+def ensure_indexed(partition, deadline=None):
+    """
+    Tokenize rows added to the partition since the last call.
+
+    Returns False if the deadline passed before the index caught up (what
+    was indexed so far is kept, so later calls resume from there). At
+    least one INDEX_STEP is indexed per call, so a partition whose
+    backlog never fits the budget still catches up across queries.
+    """
+    postings = partition.lexical
+    with partition.lexical_lock:
+        total = len(partition)
+        first_step = True
+        while len(postings) < total:
+            if (deadline is not None and not first_step
+                    and time.monotonic() > deadline):
+                return False
+            first_step = False
+            start = len(postings)
+            end = min(start + INDEX_STEP, total)
+            postings.add(partition.text(row) for row in range(start, end))
+    return True
+
+
+def bm25_search(partitions, query, top_k, deadline=None):
+    """
+    Best (partition, row, score) triples, best first, with corpus
+    statistics taken over all the given partitions.
+
+    Partitions that can't be brought up to date before the deadline are
+    skipped.
+    """
+    terms = set(tokenize(query))
+    if not terms or top_k <= 0:
+        return []
+
+    indexed = [p for p in partitions if ensure_indexed(p, deadline)]
+    count = sum(len(p.lexical) for p in indexed)
+    if not count:
+        return []
+
+    average_length = sum(p.lexical.total_length for p in indexed) / count
+    term_idfs = {}
+    for term in terms:
+        frequency = sum(p.lexical.document_frequency(term) for p in indexed)
+        if frequency:
+            term_idfs[term] = float(
+                np.log(1 + (count - frequency + 0.5) / (frequency + 0.5)))
+    if not term_idfs:
+        return []
+
+    results = []
+    for partition in indexed:
+        scores = partition.lexical.scores(term_idfs, average_length)
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            continue
+        best = matched[np.argsort(scores[matched])[::-1][:top_k]]
+        results.extend((partition, int(row), float(scores[row]))
+                       for row in best)
+
+    results.sort(key=lambda result: result[2], reverse=True)
+    return results[:top_k]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse ranked lists of keys: score(key) = Σ 1 / (k + rank).
+    Returns [(key, score)] best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
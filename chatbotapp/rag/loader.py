@@ -1,38 +1,142 @@
 # chatbotapp/rag/loader.py
 
+import codecs
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, NamedTuple
+
 from PyPDF2 import PdfReader
 from docx import Document as DocxDocument
 
+# PDFs with at least this many pages are extracted on a process pool
+PARALLEL_PDF_MIN_PAGES = 200
+PDF_PAGES_PER_TASK = 16
+TXT_BLOCK_SIZE = 64 * 1024
 
-def load_document(uploaded_file):
+
+class PageText(NamedTuple):
     """
-    Load text from PDF, DOCX, or TXT
+    One streamed unit of text: a PDF page, a DOCX paragraph or a TXT block
+    (numbered from 1).
+    """
+    number: int
+    text: str
+
+
+# ==========================
+# PDF
+# ==========================
+_worker_reader = None
+
+
+def _init_pdf_worker(data):
+    global _worker_reader
+    _worker_reader = PdfReader(io.BytesIO(data))
+
+
+def _extract_pdf_pages(page_range):
+    start, end = page_range
+    return [(_worker_reader.pages[i].extract_text() or "")
+            for i in range(start, end)]
+
+
+def _iter_pdf_pages_parallel(data, page_count, workers):
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count))
+              for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+
+    # Each worker parses the PDF once; tasks are just page ranges.
+    # map() yields results in order, so page 1 is available as soon as
+    # the first range is done while later ranges are still running.
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_pdf_worker,
+                             initargs=(data, )) as pool:
+        number = 1
+        for texts in pool.map(_extract_pdf_pages, ranges):
+            for text in texts:
+                yield PageText(number, text)
+                number += 1
+
+
+def iter_pdf_pages(uploaded_file, workers=None):
+    reader = PdfReader(uploaded_file)
+    page_count = len(reader.pages)
+
+    if workers is None:
+        workers = min(os.cpu_count() or 1, 4)
+
+    if workers > 1 and page_count >= PARALLEL_PDF_MIN_PAGES:
+        uploaded_file.seek(0)
+        data = uploaded_file.read()
+        del reader
+        yield from _iter_pdf_pages_parallel(data, page_count, workers)
+        return
+
+    for number, page in enumerate(reader.pages, start=1):
+        yield PageText(number, page.extract_text() or "")
+
+
+# ==========================
+# DOCX
+# ==========================
+def iter_docx_paragraphs(uploaded_file):
+    doc = DocxDocument(uploaded_file)
+    for number, paragraph in enumerate(doc.paragraphs, start=1):
+        yield PageText(number, paragraph.text)
+
+
+# ==========================
+# TXT
+# ==========================
+def iter_txt_blocks(uploaded_file, block_size=TXT_BLOCK_SIZE):
+    """
+    Decode in fixed-size blocks; each block is cut at its last newline
+    (or space) so words are never split across blocks.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    pending = ""
+    number = 1
+
+    while True:
+        raw = uploaded_file.read(block_size)
+        pending += decoder.decode(raw or b"", final=not raw)
+        if not raw:
+            break
+
+        cut = pending.rfind("\n")
+        if cut < 0:
+            cut = pending.rfind(" ")
+        if cut >= 0:
+            yield PageText(number, pending[:cut + 1])
+            number += 1
+            pending = pending[cut + 1:]
+
+    if pending:
+        yield PageText(number, pending)
+
+
+def iter_pages(uploaded_file, workers=None) -> Iterator[PageText]:
+    """
+    Stream text from PDF, DOCX, or TXT as numbered pages/paragraphs/blocks
     """
 
     filename = uploaded_file.name.lower()
 
-    # ==========================
-    # PDF
-    # ==========================
     if filename.endswith(".pdf"):
-        reader = PdfReader(uploaded_file)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        return text.strip()
-
-    # ==========================
-    # DOCX
-    # ==========================
+        return iter_pdf_pages(uploaded_file, workers=workers)
+
     if filename.endswith(".docx"):
-        doc = DocxDocument(uploaded_file)
-        return "\n".join(p.text for p in doc.paragraphs).strip()
+        return iter_docx_paragraphs(uploaded_file)
 
-    # ==========================
-    # TXT
-    # ==========================
     elif filename.endswith(".txt"):
-        return uploaded_file.read().decode("utf-8", errors="ignore").strip()
+        return iter_txt_blocks(uploaded_file)
 
     else:
         raise ValueError("Unsupported file type")
+
+
+def load_document(uploaded_file):
+    """
+    Load text from PDF, DOCX, or TXT
+    """
+    return "\n".join(page.text for page in iter_pages(uploaded_file)).strip()
@@ -0,0 +1,291 @@
+# chatbotapp/rag/quantization.py
+"""
+Compressed embedding codes for the segment store.
+
+Full-precision vectors stay on disk (the memory-mapped segment .npy
+files); each process keeps only compact codes in RAM, scores them to
+pick candidates, and rescores the best few hundred exactly.
+
+    int8 — one signed byte per dimension plus a per-row scale (~4x smaller)
+    pq   — product quantization, one byte per 8-dim subspace (~32x
+           smaller); the codebook is trained once from stored vectors
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+# Rows converted to float32 at a time while scoring codes
+SCORE_BLOCK_ROWS = 4096
+
+PQ_SUBSPACE_DIM = 8
+PQ_CENTROIDS = 256
+PQ_TRAIN_ROWS = 4096
+PQ_TRAIN_ITERATIONS = 12
+PQ_CODEBOOK_NAME = "pq-codebook.npy"
+
+
+# ==================================================
+# int8 scalar quantization
+# ==================================================
+class Int8Codes:
+
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+
+def int8_encode(vectors):
+    """
+    Symmetric per-row quantization: row ≈ codes * scale.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return Int8Codes(codes, scales.astype(np.float32))
+
+
+def int8_scores(block, query_vector):
+    scores = np.empty(len(block), dtype=np.float32)
+    for start in range(0, len(block), SCORE_BLOCK_ROWS):
+        end = start + SCORE_BLOCK_ROWS
+        scores[start:end] = (block.codes[start:end].astype(np.float32)
+                             @ query_vector) * block.scales[start:end]
+    return scores
+
+
+# ==================================================
+# Product quantization
+# ==================================================
+class PQCodes:
+
+    def __init__(self, codes):
+        self.codes = codes
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+
+def kmeans(points, k, iterations, random_state):
+    centroids = points[random_state.choice(len(points), k,
+                                           replace=len(points) < k)].copy()
+    point_norms = (points**2).sum(axis=1, keepdims=True)
+
+    labels = np.empty(len(points), dtype=np.int64)
+    for _ in range(iterations):
+        centroid_norms = (centroids**2).sum(axis=1)
+        # Blocks of points keep the distance matrix small for large k
+        for start in range(0, len(points), SCORE_BLOCK_ROWS):
+            end = start + SCORE_BLOCK_ROWS
+            distances = (point_norms[start:end] -
+                         2 * points[start:end] @ centroids.T + centroid_norms)
+            labels[start:end] = distances.argmin(axis=1)
+
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, points)
+
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters from random points
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = points[random_state.choice(
+                len(points), len(empty))]
+
+    return centroids
+
+
+class ProductQuantizer:
+    """
+    Splits vectors into dim / 8 subspaces with 256 centroids each;
+    a vector is encoded as one centroid id (uint8) per subspace.
+    """
+
+    def __init__(self, centroids):
+        # (subspaces, PQ_CENTROIDS, PQ_SUBSPACE_DIM)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.subspaces, _, self.subspace_dim = self.centroids.shape
+
+    @classmethod
+    def train(cls, vectors, iterations=PQ_TRAIN_ITERATIONS, seed=0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dim = vectors.shape[1]
+        if dim % PQ_SUBSPACE_DIM:
+            raise ValueError(
+                f"Dimension {dim} is not a multiple of {PQ_SUBSPACE_DIM}")
+
+        random_state = np.random.RandomState(seed)
+        subspaces = dim // PQ_SUBSPACE_DIM
+        centroids = np.stack([
+            kmeans(vectors[:, s * PQ_SUBSPACE_DIM:(s + 1) * PQ_SUBSPACE_DIM],
+                   PQ_CENTROIDS, iterations, random_state)
+            for s in range(subspaces)
+        ])
+        return cls(centroids)
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for s in range(self.subspaces):
+            part = vectors[:, s * self.subspace_dim:(s + 1) *
+                           self.subspace_dim]
+            centroids = self.centroids[s]
+            distances = (-2 * part @ centroids.T +
+                         (centroids**2).sum(axis=1))
+            codes[:, s] = distances.argmin(axis=1)
+        return PQCodes(codes)
+
+    def scores(self, block, query_vector):
+        """
+        Asymmetric distance computation: the query stays exact, and each
+        row's score is a sum of per-subspace table lookups.
+        """
+        tables = np.einsum(
+            "skd,sd->sk", self.centroids,
+            query_vector.reshape(self.subspaces, self.subspace_dim))
+        columns = np.arange(self.subspaces)
+        scores = np.empty(len(block), dtype=np.float32)
+        for start in range(0, len(block), SCORE_BLOCK_ROWS):
+            codes = block.codes[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(codes)] = tables[columns, codes].sum(
+                axis=1)
+        return scores
+
+    def save(self, path):
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as handle:
+            np.save(handle, self.centroids)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path))
+
+
+# ==================================================
+# Codec used by the store
+# ==================================================
+class EmbeddingCodec:
+    """
+    Encodes segment embeddings and scores code blocks for a query.
+
+    In "pq" mode blocks are int8 until a codebook exists. It is trained
+    once PQ_TRAIN_ROWS vectors are stored, by the ingestion worker or
+    `manage.py train_codebook`, and shared through the store directory;
+    other processes only load it.
+    """
+
+    def __init__(self, mode, directory=None):
+        if mode not in ("int8", "pq"):
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        self.mode = mode
+        self.codebook_path = Path(directory) / PQ_CODEBOOK_NAME \
+            if directory else None
+        self.pq = None
+        if mode == "pq" and self.codebook_path and self.codebook_path.exists():
+            self.pq = ProductQuantizer.load(self.codebook_path)
+
+    def encode(self, vectors):
+        if self.pq is not None:
+            return self.pq.encode(vectors)
+        return int8_encode(vectors)
+
+    def scores(self, block, query_vector):
+        if isinstance(block, PQCodes):
+            return self.pq.scores(block, query_vector)
+        return int8_scores(block, query_vector)
+
+    def needs_training(self, total_rows):
+        return self.mode == "pq" and self.pq is None and \
+            total_rows >= PQ_TRAIN_ROWS
+
+    def load_codebook(self):
+        """
+        Start using a codebook saved by another process, if there is one
+        (blocks encoded before keep their int8 codes).
+        """
+        if self.mode != "pq" or self.pq is not None:
+            return False
+        if not (self.codebook_path and self.codebook_path.exists()):
+            return False
+        self.pq = ProductQuantizer.load(self.codebook_path)
+        return True
+
+    def train(self, sample):
+        """
+        Train (or load one trained meanwhile by another process) the PQ
+        codebook.
+        """
+        if self.codebook_path and self.codebook_path.exists():
+            self.pq = ProductQuantizer.load(self.codebook_path)
+            return
+        self.pq = ProductQuantizer.train(sample)
+        if self.codebook_path:
+            self.pq.save(self.codebook_path)
+
+
+# ==================================================
+# Evaluation
+# ==================================================
+def evaluate(vectors, queries, top_k=10, rescore=200, modes=("int8", "pq")):
+    """
+    Memory and recall@top_k of each mode against exact search.
+
+    vectors and queries must be L2-normalized float32 rows.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    exact = np.argsort(-(queries @ vectors.T), axis=1)[:, :top_k]
+
+    report = {
+        "rows": len(vectors),
+        "float32": {
+            "bytes": int(vectors.nbytes),
+            "recall": 1.0,
+        },
+    }
+
+    for mode in modes:
+        if mode == "pq":
+            quantizer = ProductQuantizer.train(vectors[:PQ_TRAIN_ROWS * 2])
+            block = quantizer.encode(vectors)
+            score = quantizer.scores
+            extra_bytes = quantizer.centroids.nbytes
+        else:
+            block = int8_encode(vectors)
+            score = int8_scores
+            extra_bytes = 0
+
+        approx_hits = rescored_hits = 0
+        for query, truth in zip(queries, exact):
+            approx = score(block, query)
+            candidates = np.argsort(-approx)[:max(rescore, top_k)]
+            approx_hits += len(np.intersect1d(candidates[:top_k], truth))
+
+            exact_scores = vectors[candidates] @ query
+            best = candidates[np.argsort(-exact_scores)[:top_k]]
+            rescored_hits += len(np.intersect1d(best, truth))
+
+        total = len(queries) * top_k
+        report[mode] = {
+            "bytes": int(block.nbytes + extra_bytes),
+            "recall_codes_only": approx_hits / total,
+            "recall": rescored_hits / total,
+        }
+
+    return report
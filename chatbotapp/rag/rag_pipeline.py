@@ -1,76 +1,416 @@
 # chatbotapp/rag/rag_pipeline.py
 
-from .loader import load_document
-from .vectorstore import GLOBAL_VECTOR_STORE, chunk_text
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from chatbotapp.timing import timed
+
+from .chunker import iter_spans
+from .dedup import get_dedup_index
+from .embeddings import embed_texts, get_cache
+from .loader import iter_pages
+from .reranker import get_reranker
+from .vectorstore import GLOBAL_VECTOR_STORE
+
+# Chunks are embedded and published in batches of this size, so a
+# document is searchable while the rest of it is still being indexed.
+INGEST_BATCH_SIZE = 64
+
+# Query embedding + scoring for the async chat path; numpy releases the
+# GIL during the matrix product, so a few threads go a long way.
+_retrieval_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "RETRIEVAL_THREADS", 4),
+    thread_name_prefix="retrieval")
+
+# Per-document searches of a multi-document question. Separate from
+# _retrieval_executor, whose tasks wait on these.
+_fanout_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "RETRIEVAL_FANOUT_THREADS", 4),
+    thread_name_prefix="retrieval-fanout")
 
 
 # ======================================================
 # 📄 INGEST DOCUMENT (PDF / DOCX / TXT)
 # ======================================================
-def ingest_document(user, uploaded_file, document_id):
+def ingest_document(user, uploaded_file, document_id, progress=None):
     """
-    Store document chunks with document_id embedded into text
-    (SimpleVectorStore-compatible).
+    Store document chunks in the document's own partition
+    of the vector store.
+
+    Pages are streamed from the loader, so chunking and embedding start
+    on the first page while later pages are still being extracted.
+    progress(pages_processed, chunks_indexed) is called after every
+    published batch. Returns the number of chunks indexed.
     """
 
-    text = load_document(uploaded_file)
+    filename = os.path.basename(uploaded_file.name)
+    pages_processed = 0
+    indexed = 0
+    duplicates = 0
+    duplicate_bytes = 0
 
-    if not text or not text.strip():
-        print("❌ No text extracted")
-        return
+    # Near-duplicates of this user's existing chunks are aliased to them
+    # instead of being embedded and stored again
+    dedup = None
+    if getattr(settings, "CHUNK_DEDUP_ENABLED", True):
+        dedup = get_dedup_index(
+            user.id, threshold=getattr(settings, "CHUNK_DEDUP_THRESHOLD", 0.9))
+        dedup.catch_up(GLOBAL_VECTOR_STORE.user_partitions(user.id))
 
-    chunks = chunk_text(text)
+    def page_texts():
+        nonlocal pages_processed
+        for page in iter_pages(uploaded_file):
+            pages_processed += 1
+            yield page.text
 
-    # 🔑 Embed document_id into the text itself
-    wrapped_chunks = [
-        f"[DOCUMENT_ID={document_id}]\n{chunk}"
-        for chunk in chunks
-    ]
+    def publish(batch):
+        nonlocal indexed, duplicates, duplicate_bytes
+        aliases = []
+        if dedup is not None:
+            partition = GLOBAL_VECTOR_STORE.get_partition(document_id)
+            kept, aliases = dedup.deduplicate(
+                [span.text for span in batch],
+                document_id=document_id,
+                first_row=len(partition) if partition else 0)
+            kept_set = set(kept)
+            duplicates += len(aliases)
+            duplicate_bytes += sum(
+                len(span.text.encode("utf-8"))
+                for i, span in enumerate(batch) if i not in kept_set)
+            batch = [batch[i] for i in kept]
 
-    GLOBAL_VECTOR_STORE.add_texts(
-        texts=wrapped_chunks,
-        metadata={
-            "user_id": user.id,
-            "filename": uploaded_file.name,
-        }
-    )
+        GLOBAL_VECTOR_STORE.add_texts(
+            texts=[span.text for span in batch],
+            document_id=document_id,
+            user_id=user.id,
+            metadata={
+                "filename": filename,
+            },
+            spans=[(span.start, span.end) for span in batch],
+            aliases=aliases,
+        )
+        indexed += len(batch) + len(aliases)
+        if progress:
+            progress(pages_processed=pages_processed, chunks_indexed=indexed)
+
+    batch = []
+    # Spans sized in embedding-model tokens; only the current batch's
+    # text is held in memory
+    for span in iter_spans(page_texts()):
+        batch.append(span)
+        if len(batch) >= INGEST_BATCH_SIZE:
+            publish(batch)
+            batch = []
+
+    if batch:
+        publish(batch)
+
+    if not indexed:
+        print("❌ No text extracted")
+        return 0
 
-    print(f"✅ Ingested {len(chunks)} chunks for document {document_id}")
+    cache_stats = get_cache().stats()
+    print(f"✅ Ingested {indexed} chunks from {pages_processed} pages "
+          f"for document {document_id} "
+          f"(embedding cache: {cache_stats['memory_hits']} memory hits, "
+          f"{cache_stats['disk_hits']} disk hits, "
+          f"{cache_stats['misses']} misses)")
+    if duplicates:
+        print(f"♻️ Deduplicated {duplicates} near-duplicate chunks "
+              f"({duplicate_bytes / 1024:.1f} KiB not embedded or stored)")
+
+    return indexed
 
 
 # ======================================================
-# 🔍 RETRIEVE CONTEXT (SAFE + COMPATIBLE)
+# 🔍 RETRIEVE CONTEXT
 # ======================================================
-def retrieve_context(question, document_id=None, top_k=3):
+def retrieve_hits(question, document_id=None, user_id=None, top_k=3,
+                  mode=None, rerank=None, nprobe=None):
     """
-    Retrieve chunks.
-    - If document_id is provided → only chunks from that document
-    - Else → global search (text-only chat)
+    Ranked SearchHits for a question.
+    - If document_id is provided → only that document's partition
+    - Else → every document of user_id
+
+    mode: "dense" (embeddings only) or "hybrid" (dense + BM25 fused with
+    reciprocal rank fusion); defaults to RETRIEVAL_MODE.
+    rerank: rescore RERANK_CANDIDATES candidates with the cross-encoder
+    and keep at most RERANK_TOP_N; defaults to RERANK_ENABLED.
+    nprobe: IVF lists scanned when the ANN index is used; defaults to
+    ANN_NPROBE.
     """
+    if rerank is None:
+        rerank = getattr(settings, "RERANK_ENABLED", False)
+    if not rerank:
+        return search_hits(question, document_id, user_id, top_k, mode,
+                           nprobe)
+
+    candidates = search_hits(question, document_id, user_id,
+                             max(top_k, getattr(settings, "RERANK_CANDIDATES",
+                                                50)), mode, nprobe)
+    hits, reranked = rerank_hits(question, candidates,
+                                 min(top_k, getattr(settings, "RERANK_TOP_N",
+                                                    4)))
+    return hits if reranked else candidates[:top_k]
+
 
-    results = GLOBAL_VECTOR_STORE.similarity_search(
+@timed("rerank")
+def rerank_hits(question, hits, top_k, min_hits=None):
+    """
+    (hits, reranked) from the cross-encoder within RERANK_BUDGET_MS.
+    """
+    budget_ms = getattr(settings, "RERANK_BUDGET_MS", 150)
+    return get_reranker().rerank(question,
+                                 hits,
+                                 top_k,
+                                 budget=budget_ms / 1000 if budget_ms else None,
+                                 min_hits=min_hits)
+
+
+@timed("search")
+def search_hits(question, document_id=None, user_id=None, top_k=3,
+                mode=None, nprobe=None):
+    """
+    Vector store search (dense or hybrid) without reranking.
+    """
+    mode = mode or getattr(settings, "RETRIEVAL_MODE", "hybrid")
+    nprobe = nprobe or getattr(settings, "ANN_NPROBE", None)
+
+    if mode == "hybrid":
+        budget_ms = getattr(settings, "HYBRID_LEXICAL_BUDGET_MS", 50)
+        return GLOBAL_VECTOR_STORE.hybrid_search(
+            query=question,
+            top_k=top_k,
+            document_id=document_id,
+            user_id=user_id,
+            budget=budget_ms / 1000 if budget_ms else None,
+            nprobe=nprobe,
+        )
+
+    if mode != "dense":
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+
+    return GLOBAL_VECTOR_STORE.similarity_search(
         query=question,
-        top_k=top_k * 4  # fetch more, filter later
+        top_k=top_k,
+        document_id=document_id,
+        user_id=user_id,
+        nprobe=nprobe,
     )
 
-    if not results:
+
+def normalize_scores(hits):
+    """
+    Min-max scale one ranking's scores to [0, 1], so rankings scored on
+    different scales (cosine, RRF) can be merged.
+    """
+    if not hits:
         return []
+    scores = [hit.score for hit in hits]
+    low, high = min(scores), max(scores)
+    if high - low < 1e-12:
+        return [1.0] * len(hits)
+    return [(score - low) / (high - low) for score in scores]
+
 
-    filtered = []
+def merge_document_hits(rankings, top_k, quota=None):
+    """
+    Merge per-document rankings (best first) into top_k hits.
+
+    Every document keeps its best `quota` hits (default: an equal share
+    of top_k); the remaining slots go to the best normalized scores.
+    Returns hits ordered by normalized score.
+    """
+    rankings = [ranking for ranking in rankings if ranking]
+    if not rankings or top_k <= 0:
+        return []
+    if quota is None:
+        quota = max(1, top_k // len(rankings))
 
-    for chunk in results:
-        # chunk is STRING (not object)
-        if document_id:
-            if f"[DOCUMENT_ID={document_id}]" in chunk:
-                filtered.append(chunk)
+    scored = []  # (normalized score, position in its ranking, hit)
+    for ranking in rankings:
+        scored.extend(
+            (score, position, hit) for position, (score, hit) in enumerate(
+                zip(normalize_scores(ranking), ranking)))
+
+    guaranteed = [entry for entry in scored if entry[1] < quota]
+    guaranteed.sort(key=lambda entry: (entry[1], -entry[0]))
+    selected = guaranteed[:top_k]
+    rest = sorted((entry for entry in scored if entry[1] >= quota),
+                  key=lambda entry: entry[0],
+                  reverse=True)
+    selected.extend(rest[:top_k - len(selected)])
+
+    selected.sort(key=lambda entry: entry[0], reverse=True)
+    return [hit for _, _, hit in selected]
+
+
+def pool_document_hits(document_ids, rankings):
+    """
+    Interleave per-document rankings (best first) into one list without
+    repeated chunks, and map each kept (document_id, chunk_id) to the
+    document it was searched for.
+
+    An alias hit carries its canonical chunk's document id, so a document
+    that near-duplicates another returns the other's chunks: each chunk
+    is kept once, for the document that ranks it highest.
+    """
+    pooled = []
+    searched_for = {}
+    for rank in range(max((len(ranking) for ranking in rankings), default=0)):
+        for document_id, ranking in zip(document_ids, rankings):
+            if rank >= len(ranking):
+                continue
+            hit = ranking[rank]
+            key = (hit.document_id, hit.chunk_id)
+            if key not in searched_for:
+                searched_for[key] = document_id
+                pooled.append(hit)
+    return pooled, searched_for
+
+
+def group_document_hits(document_ids, hits, searched_for):
+    by_document = {document_id: [] for document_id in document_ids}
+    for hit in hits:
+        by_document[searched_for[(hit.document_id,
+                                  hit.chunk_id)]].append(hit)
+    return list(by_document.values())
+
+
+def retrieve_document_hits(question, document_ids, user_id=None, top_k=3,
+                           mode=None, quota=None, rerank=None, nprobe=None):
+    """
+    Search several documents in parallel and merge their rankings (see
+    merge_document_hits).
+
+    Each document returns up to top_k candidates so one strong document
+    can still fill the slots the others don't need. With reranking, the
+    pooled candidates are scored in one cross-encoder pass before the
+    merge, which then keeps max(RERANK_TOP_N, one per document) hits.
+    """
+    return search_documents(question, document_ids, user_id, top_k, mode,
+                            quota, rerank, nprobe)[0]
+
+
+def search_documents(question, document_ids, user_id=None, top_k=3,
+                     mode=None, quota=None, rerank=None, nprobe=None):
+    """
+    retrieve_document_hits, plus the {(document_id, chunk_id): document
+    searched for} map of the returned hits (see pool_document_hits).
+    """
+    document_ids = list(dict.fromkeys(document_ids))
+    if len(document_ids) == 1:
+        hits = retrieve_hits(question,
+                             document_id=document_ids[0],
+                             user_id=user_id,
+                             top_k=top_k,
+                             mode=mode,
+                             rerank=rerank,
+                             nprobe=nprobe)
+        return hits, {(hit.document_id, hit.chunk_id): document_ids[0]
+                      for hit in hits}
+
+    if rerank is None:
+        rerank = getattr(settings, "RERANK_ENABLED", False)
+    per_document = top_k
+    if rerank:
+        per_document = max(
+            top_k,
+            getattr(settings, "RERANK_CANDIDATES", 50) // len(document_ids))
+
+    # Embed the query once; the per-document searches hit the cache
+    embed_texts([question])
+
+    # Each search runs in a copy of the request's context, so its stage
+    # reaches Server-Timing
+    futures = [
+        _fanout_executor.submit(contextvars.copy_context().run, search_hits,
+                                question, document_id, user_id, per_document,
+                                mode, nprobe)
+        for document_id in document_ids
+    ]
+    # Interleaved, so a budget-limited rerank scores every document's best
+    pooled, searched_for = pool_document_hits(
+        document_ids, [future.result() for future in futures])
+    rankings = group_document_hits(document_ids, pooled, searched_for)
+
+    if rerank:
+        keep = min(top_k,
+                   max(getattr(settings, "RERANK_TOP_N", 4), len(document_ids)))
+        reranked, applied = rerank_hits(question, pooled, len(pooled),
+                                        min_hits=keep)
+        if applied:
+            rankings = group_document_hits(document_ids, reranked,
+                                           searched_for)
+            top_k = keep
         else:
-            filtered.append(chunk)
+            rankings = [ranking[:top_k] for ranking in rankings]
+
+    return merge_document_hits(rankings, top_k, quota=quota), searched_for
+
+
+def document_label(document_id):
+    partition = GLOBAL_VECTOR_STORE.get_partition(document_id)
+    if partition is not None and partition.metadata.get("filename"):
+        return partition.metadata["filename"]
+    return f"Document {document_id}"
 
-        if len(filtered) >= top_k:
-            break
 
-    # Remove document markers before sending to LLM
+@timed("retrieve_context")
+def retrieve_context(question, document_id=None, user_id=None, top_k=3,
+                     mode=None, document_ids=None, nprobe=None):
+    """
+    Retrieve chunk texts (best first) to send to the LLM.
+
+    document_ids: several documents to search (e.g. for comparison
+    questions); each chunk is then labelled with its file name.
+    """
+    if not document_ids:
+        return [
+            hit.text
+            for hit in retrieve_hits(question,
+                                     document_id=document_id,
+                                     user_id=user_id,
+                                     top_k=top_k,
+                                     mode=mode,
+                                     nprobe=nprobe)
+        ]
+
+    hits, searched_for = search_documents(question,
+                                          document_ids,
+                                          user_id=user_id,
+                                          top_k=top_k,
+                                          mode=mode,
+                                          nprobe=nprobe)
+    if len(set(document_ids)) == 1:
+        return [hit.text for hit in hits]
+    # Labelled with the document searched, not an alias hit's canonical one
     return [
-        c.replace(f"[DOCUMENT_ID={document_id}]\n", "")
-        for c in filtered
+        f"[{document_label(searched_for[(hit.document_id, hit.chunk_id)])}]"
+        f"\n{hit.text}" for hit in hits
     ]
+
+
+async def aretrieve_context(question, document_id=None, user_id=None,
+                            top_k=3, mode=None, document_ids=None,
+                            nprobe=None):
+    """
+    retrieve_context on the retrieval thread pool, for async views.
+    """
+    loop = asyncio.get_running_loop()
+    # In the request's context, so its stages reach Server-Timing
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _retrieval_executor,
+        lambda: context.run(retrieve_context,
+                            question,
+                            document_id=document_id,
+                            user_id=user_id,
+                            top_k=top_k,
+                            mode=mode,
+                            document_ids=document_ids,
+                            nprobe=nprobe))
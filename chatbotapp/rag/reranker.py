@@ -0,0 +1,164 @@
+# chatbotapp/rag/reranker.py
+"""
+Cross-encoder reranking of retrieved chunks.
+
+A cross-encoder reads the question and a chunk together, so it ranks
+far better than the embedding similarity that found the candidates; it
+is only affordable on a few dozen candidates. All uncached pairs of a
+query are scored in one batched forward pass, and scores are cached by
+(query hash, document id, chunk id).
+
+Rerank time is estimated from previous passes. Under the latency budget
+only the leading candidates that fit are scored; when fewer than the
+requested chunks fit, the stage is skipped and the retrieval order is
+kept. Until a pass has been timed, a budgeted query scores at most
+FIRST_PASS_PAIRS uncached pairs.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import replace
+
+from django.conf import settings
+
+from .embedding_cache import normalize_text
+
+# Small CPU cross-encoder trained on MS MARCO passage ranking
+RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# Weight of the newest pass in the per-pair time estimate
+ESTIMATE_SMOOTHING = 0.3
+
+# Uncached pairs scored under a budget before any pass was timed
+FIRST_PASS_PAIRS = 8
+
+
+class Reranker:
+
+    def __init__(self, model_name=RERANK_MODEL_NAME, max_entries=10000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.seconds_per_pair = None
+        self.skipped = 0
+        self._model = None
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+
+    def get_model(self):
+        with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    @staticmethod
+    def query_key(query):
+        return hashlib.sha256(
+            normalize_text(query).lower().encode("utf-8")).digest()[:16]
+
+    def affordable_pairs(self, budget, min_pairs=0):
+        """
+        Uncached pairs that fit a budget (seconds), going by the time of
+        previous passes. Before the first one is measured, a small pass
+        (FIRST_PASS_PAIRS, or min_pairs if more) times the model.
+        """
+        if budget is None:
+            return None
+        if self.seconds_per_pair is None:
+            return max(FIRST_PASS_PAIRS, min_pairs)
+        return int(budget / self.seconds_per_pair)
+
+    def scores(self, query, hits, budget=None, min_hits=1):
+        """
+        Cross-encoder scores of the longest prefix of hits whose uncached
+        pairs fit the budget, or None when that prefix is shorter than
+        min_hits.
+        """
+        query_key = self.query_key(query)
+        keys = [(query_key, hit.document_id, hit.chunk_id) for hit in hits]
+
+        scores = {}
+        with self._lock:
+            for key in keys:
+                score = self._scores.get(key)
+                if score is not None:
+                    self._scores.move_to_end(key)
+                    scores[key] = score
+
+        affordable = self.affordable_pairs(budget, min_pairs=min_hits)
+        if affordable is not None:
+            uncached = 0
+            for limit, key in enumerate(keys):
+                uncached += key not in scores
+                if uncached > affordable:
+                    keys, hits = keys[:limit], hits[:limit]
+                    break
+            if len(keys) < min_hits:
+                self.skipped += 1
+                return None
+
+        missing = [(key, hit) for key, hit in zip(keys, hits)
+                   if key not in scores]
+        if missing:
+            model = self.get_model()
+            started = time.perf_counter()
+            predicted = model.predict([(query, hit.text) for _, hit in missing],
+                                      batch_size=len(missing),
+                                      show_progress_bar=False)
+            self._record(time.perf_counter() - started, len(missing))
+
+            with self._lock:
+                for (key, _), score in zip(missing, predicted):
+                    scores[key] = float(score)
+                    self._scores[key] = float(score)
+                while len(self._scores) > self.max_entries:
+                    self._scores.popitem(last=False)
+
+        return [scores[key] for key in keys]
+
+    def _record(self, seconds, pairs):
+        per_pair = seconds / pairs
+        if self.seconds_per_pair is None:
+            self.seconds_per_pair = per_pair
+        else:
+            self.seconds_per_pair += ESTIMATE_SMOOTHING * (
+                per_pair - self.seconds_per_pair)
+
+    def rerank(self, query, hits, top_k, budget=None, min_hits=None):
+        """
+        (hits, reranked): the top_k hits by cross-encoder score (as
+        SearchHit.score), or the first top_k in retrieval order when not
+        even top_k candidates could be scored within the budget.
+
+        Under a tight budget only the leading candidates are scored, as
+        long as at least min_hits (default top_k) of them fit.
+        """
+        if not hits or top_k <= 0:
+            return [], False
+
+        if min_hits is None:
+            min_hits = top_k
+        scores = self.scores(query, hits, budget,
+                             min_hits=min(min_hits, len(hits)))
+        if scores is None:
+            return list(hits[:top_k]), False
+
+        order = sorted(range(len(scores)), key=scores.__getitem__,
+                       reverse=True)[:top_k]
+        return [replace(hits[index], score=scores[index])
+                for index in order], True
+
+
+_reranker = None
+
+
+def get_reranker():
+    global _reranker
+    if _reranker is None:
+        _reranker = Reranker(
+            getattr(settings, "RERANK_MODEL", RERANK_MODEL_NAME),
+            max_entries=getattr(settings, "RERANK_CACHE_SIZE", 10000))
+    return _reranker
@@ -0,0 +1,183 @@
+# chatbotapp/rag/segments.py
+"""
+On-disk vector segments shared by every worker process.
+
+Each ingest writes one immutable segment per document:
+
+    <root>/u<user_id>/d<document_id>/<name>.npy   embeddings (float32/float16)
+    <root>/u<user_id>/d<document_id>/<name>.txt   UTF-8 source text covering the chunks
+    <root>/u<user_id>/d<document_id>/<name>.json  sidecar: chunk byte spans + metadata
+
+Overlapping chunks share their text in the .txt file; each row is a
+(start, end) byte span into it.
+
+The sidecar is renamed into place last, and its path is then appended to
+<root>/MANIFEST. Readers tail the manifest and open new segments with
+numpy.memmap, so all workers share the same page-cache copy and see new
+documents without a restart. Deleting a document appends a
+"delete:<document_id>" line; its segment files are left in place.
+"""
+
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from .chunker import pack_spans
+
+MANIFEST_NAME = "MANIFEST"
+DELETE_PREFIX = "delete:"
+SEGMENT_VERSION = 2
+
+
+def _write_atomic(path, write):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as handle:
+        write(handle)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, path)
+
+
+def _byte_spans(source, char_spans):
+    """
+    Convert character spans into UTF-8 byte spans of source, encoding
+    each stretch between consecutive span boundaries once.
+    """
+    boundaries = sorted({offset for span in char_spans for offset in span})
+    byte_offsets = {}
+    position = previous = 0
+    for offset in boundaries:
+        position += len(source[previous:offset].encode("utf-8"))
+        byte_offsets[offset] = position
+        previous = offset
+    return [[byte_offsets[start], byte_offsets[end]]
+            for start, end in char_spans]
+
+
+def write_segment(root, user_id, document_id, texts, vectors, metadata=None,
+                  dtype=np.float32, spans=None, aliases=None):
+    """
+    Persist one segment and return its sidecar path relative to root.
+
+    spans: the chunks' (start, end) character offsets in the document,
+    when known; overlapping chunks are then stored once.
+    aliases: (document_id, row) of canonical chunks this document also
+    contains (near-duplicates that weren't stored again).
+    """
+    root = Path(root)
+    segment_dir = root / f"u{user_id}" / f"d{document_id}"
+    segment_dir.mkdir(parents=True, exist_ok=True)
+
+    name = f"seg-{time.time_ns():x}-{uuid.uuid4().hex[:8]}"
+    source, relative_spans = pack_spans(texts, spans)
+    encoded = source.encode("utf-8")
+
+    vectors = np.ascontiguousarray(vectors, dtype=dtype)
+
+    _write_atomic(segment_dir / f"{name}.npy",
+                  lambda handle: np.save(handle, vectors))
+    _write_atomic(segment_dir / f"{name}.txt",
+                  lambda handle: handle.write(encoded))
+
+    sidecar = {
+        "version": SEGMENT_VERSION,
+        "user_id": user_id,
+        "document_id": document_id,
+        "rows": len(texts),
+        "dim": int(vectors.shape[1]),
+        "dtype": np.dtype(dtype).name,
+        "spans": _byte_spans(source, relative_spans),
+        "document_spans": [list(span) for span in spans] if spans else None,
+        "aliases": [list(alias) for alias in aliases or ()],
+        "metadata": metadata or {},
+    }
+    _write_atomic(segment_dir / f"{name}.json",
+                  lambda handle: handle.write(json.dumps(sidecar).encode()))
+
+    return str((segment_dir / f"{name}.json").relative_to(root))
+
+
+def append_to_manifest(root, relative_path):
+    """
+    Publish a committed segment to every reader.
+
+    A single O_APPEND write of one short line is atomic, so concurrent
+    writers in different processes never interleave entries.
+    """
+    line = (relative_path + "\n").encode("utf-8")
+    fd = os.open(Path(root) / MANIFEST_NAME,
+                 os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+class ManifestReader:
+    """
+    Incrementally reads new entries appended to the manifest.
+    """
+
+    def __init__(self, root):
+        self.path = Path(root) / MANIFEST_NAME
+        self.position = 0
+
+    def read_new(self):
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            return []
+
+        if size <= self.position:
+            return []
+
+        with open(self.path, "rb") as handle:
+            handle.seek(self.position)
+            data = handle.read(size - self.position)
+
+        # Only consume complete lines; a partial one is still being written
+        complete = data[:data.rfind(b"\n") + 1]
+        self.position += len(complete)
+        return [line for line in complete.decode("utf-8").splitlines() if line]
+
+
+class Segment:
+    """
+    Read-only, memory-mapped view of one segment.
+    """
+
+    def __init__(self, root, relative_path):
+        sidecar_path = Path(root) / relative_path
+        with open(sidecar_path, "rb") as handle:
+            sidecar = json.load(handle)
+
+        base = sidecar_path.with_suffix("")
+        self.user_id = sidecar["user_id"]
+        self.document_id = sidecar["document_id"]
+        self.metadata = sidecar.get("metadata", {})
+        self.aliases = [tuple(alias) for alias in sidecar.get("aliases", ())]
+        if "spans" in sidecar:
+            self.spans = np.asarray(sidecar["spans"],
+                                    dtype=np.int64).reshape(-1, 2)
+        else:
+            # Version 1: texts back to back, delimited by offsets
+            offsets = np.asarray(sidecar["offsets"], dtype=np.int64)
+            self.spans = np.column_stack([offsets[:-1], offsets[1:]])
+        self.embeddings = np.load(base.with_suffix(".npy"), mmap_mode="r")
+
+        text_path = base.with_suffix(".txt")
+        if len(self.spans) and self.spans[:, 1].max() > 0:
+            self._texts = np.memmap(text_path, dtype=np.uint8, mode="r")
+        else:
+            self._texts = np.empty(0, dtype=np.uint8)
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    def text(self, row):
+        start, end = self.spans[row]
+        return self._texts[start:end].tobytes().decode("utf-8")
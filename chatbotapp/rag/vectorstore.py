@@ -1,30 +1,703 @@
 # chatbotapp/rag/vectorstore.py
 
+import bisect
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .ann import IVFIndex
+from .chunker import iter_spans, pack_spans
+from .embeddings import EMBEDDING_DIM, embed_texts
+from .lexical import (LexicalPostings, bm25_search, ensure_indexed,
+                      reciprocal_rank_fusion)
+from .quantization import PQ_TRAIN_ROWS, EmbeddingCodec
+from .segments import (DELETE_PREFIX, ManifestReader, Segment,
+                       append_to_manifest, write_segment)
+
+ANN_INDEX_NAME = "ann-ivf.npz"
+
+
+def normalize_rows(vectors):
+    """
+    L2-normalize every row of a 2-D array (returns a float32 copy).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.maximum(norms, 1e-12, out=norms)
+    return vectors / norms
+
+
+def top_k_indices(scores, top_k):
+    """
+    Indices of the top_k highest scores, best first.
+
+    Uses argpartition so only the selected k rows are fully sorted.
+    """
+    n = scores.shape[0]
+    if n == 0 or top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < n:
+        candidates = np.argpartition(scores, n - top_k)[n - top_k:]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    """
+    One ranked chunk returned by a similarity search.
+    """
+    chunk_id: int
+    document_id: int
+    user_id: int
+    score: float
+    text: str
+
+
+class DocumentPartition:
+    """
+    Embeddings and chunk texts of a single document.
+
+    Rows are kept L2-normalized in one contiguous float32 matrix that
+    grows in blocks, so a query is scored with a single matrix-vector
+    product over this document only. Chunk texts are spans into the
+    source text of each appended batch, so overlaps aren't stored twice.
+    """
+
+    def __init__(self, document_id, user_id, dim=EMBEDDING_DIM,
+                 block_size=256):
+        self.document_id = document_id
+        self.user_id = user_id
+        self.dim = dim
+        self.block_size = block_size
+        self.metadata = {}
+        # (document_id, row) of near-duplicate chunks stored elsewhere
+        self.aliases = []
+        self._sources = []
+        self._spans = []  # (source index, start, end) per row
+        self.lexical = LexicalPostings()
+        self.lexical_lock = threading.Lock()
+        self._embeddings = np.empty((0, dim), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def embeddings(self):
+        return self._embeddings[:self._size]
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        capacity = self._embeddings.shape[0]
+        if needed <= capacity:
+            return
+
+        # Amortized growth: at least double, rounded up to a whole block
+        new_capacity = max(needed, capacity * 2)
+        new_capacity = -(-new_capacity // self.block_size) * self.block_size
+
+        grown = np.empty((new_capacity, self.dim), dtype=np.float32)
+        grown[:self._size] = self._embeddings[:self._size]
+        self._embeddings = grown
+
+    def append(self, texts, vectors, spans=None):
+        source, relative_spans = pack_spans(texts, spans)
+        source_index = len(self._sources)
+        self._sources.append(source)
+        self._spans.extend(
+            (source_index, start, end) for start, end in relative_spans)
+
+        self._reserve(len(texts))
+        start = self._size
+        self._embeddings[start:start + len(texts)] = vectors
+        self._size = start + len(texts)
+
+    def text(self, row):
+        source_index, start, end = self._spans[row]
+        return self._sources[source_index][start:end]
+
+    def vectors(self, rows):
+        return self.embeddings[rows]
+
+    def search(self, query_vector, top_k):
+        """
+        Return (row indices, scores) of the best top_k rows, best first.
+        """
+        scores = self.embeddings @ query_vector
+        rows = top_k_indices(scores, top_k)
+        return rows, scores[rows]
+
 
 class SimpleVectorStore:
+    """
+    In-memory dense vector store partitioned by document.
+
+    A document-scoped search only touches that document's rows; an
+    unscoped search is limited to one user's partitions.
+
+    ann: optional approximate index (ann.IVFIndex) over every row, used
+    instead of exact scoring when the searched documents (one large
+    document or several) hold at least ann_min_rows rows.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, ann=None, ann_min_rows=20000):
+        self.dim = dim
+        self.ann = ann
+        self.ann_min_rows = ann_min_rows
+        self._partitions = {}
+        self._user_documents = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(p) for p in list(self._partitions.values()))
+
+    def get_partition(self, document_id):
+        return self._partitions.get(document_id)
+
+    def user_partitions(self, user_id):
+        return self._select_partitions(None, user_id)
+
+    def _prepare_vectors(self, texts, embeddings):
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        if embeddings is None:
+            embeddings = embed_texts(texts)
+
+        vectors = normalize_rows(embeddings)
+        if vectors.shape != (len(texts), self.dim):
+            raise ValueError(
+                f"Expected embeddings of shape {(len(texts), self.dim)}, "
+                f"got {vectors.shape}")
+        return vectors
+
+    def add_texts(self, texts, document_id, user_id, metadata=None,
+                  embeddings=None, spans=None, aliases=None):
+        """
+        spans: optional (start, end) document offsets of the texts (as
+        yielded by chunker.iter_spans), so overlapping text is kept once.
+        aliases: (document_id, row) of canonical chunks (of the same user)
+        that this document contains as near-duplicates.
+        """
+        if not texts and not aliases:
+            return
+
+        vectors = self._prepare_vectors(texts, embeddings)
+
+        with self._lock:
+            partition = self._get_or_create_partition(document_id, user_id)
+            partition.metadata.update(metadata or {})
+            first_row = len(partition)
+            if texts:
+                partition.append(texts, vectors, spans=spans)
+            partition.aliases.extend(aliases or ())
+            if self.ann is not None:
+                self.ann.add(vectors, document_id, first_row, user_id)
+
+        ensure_indexed(partition)
+
+    def delete_document(self, document_id):
+        """
+        Drop a document's rows (and its entries in the ANN index).
+
+        Rows that other documents alias as near-duplicates are first
+        copied into those documents, which stored no text of their own
+        for them.
+        """
+        self._rehome_aliases(document_id)
+        with self._lock:
+            self._drop_partition(document_id)
+
+    def _rehome_aliases(self, document_id):
+        canonical = self._partitions.get(document_id)
+        if canonical is None:
+            return
+        for other_id in list(self._user_documents.get(canonical.user_id, ())):
+            partition = self._partitions.get(other_id)
+            if partition is None or partition is canonical:
+                continue
+            rows = sorted({
+                row
+                for alias_id, row in partition.aliases
+                if alias_id == document_id and row < len(canonical)
+            })
+            if not rows:
+                continue
+            self.add_texts(texts=[canonical.text(row) for row in rows],
+                           document_id=other_id,
+                           user_id=partition.user_id,
+                           embeddings=canonical.vectors(rows))
+
+    def _drop_partition(self, document_id):
+        partition = self._partitions.pop(document_id, None)
+        if partition is None:
+            return
+        documents = self._user_documents.get(partition.user_id)
+        if documents is not None:
+            documents.discard(document_id)
+        if self.ann is not None:
+            self.ann.remove_document(document_id)
+
+    def _new_partition(self, document_id, user_id):
+        return DocumentPartition(document_id, user_id, self.dim)
+
+    def _get_or_create_partition(self, document_id, user_id):
+        partition = self._partitions.get(document_id)
+        if partition is None:
+            partition = self._new_partition(document_id, user_id)
+            self._partitions[document_id] = partition
+            self._user_documents.setdefault(user_id, set()).add(document_id)
+        return partition
+
+    def _select_partitions(self, document_id, user_id):
+        if document_id is not None:
+            partition = self._partitions.get(document_id)
+            if partition is None:
+                return []
+            if user_id is not None and partition.user_id != user_id:
+                return []
+            return [partition]
+
+        if user_id is not None:
+            document_ids = list(self._user_documents.get(user_id, ()))
+            return [self._partitions[d] for d in document_ids]
+
+        return list(self._partitions.values())
+
+    def similarity_search(self, query, top_k=3, document_id=None,
+                          user_id=None, nprobe=None):
+        """
+        Return the top_k SearchHits ranked by cosine similarity.
+
+        - document_id → only that document's partition is scored
+        - user_id     → only that user's documents are scored
+        - nprobe      → IVF lists scanned when the ANN index is used
+        """
+        partitions = [
+            p for p in self._select_partitions(document_id, user_id)
+            if len(p) or p.aliases
+        ]
+        if not partitions or top_k <= 0:
+            return []
+
+        return self._dense_hits(partitions, query, top_k, nprobe)
+
+    def _use_ann(self, partitions):
+        return (self.ann is not None and self.ann.trained
+                and sum(len(p) for p in partitions) >= self.ann_min_rows)
+
+    def _dense_hits(self, partitions, query, top_k, nprobe=None):
+        query_vector = normalize_rows(embed_texts([query]))[0]
+
+        hits = []
+        if self._use_ann(partitions):
+            selected = {p.document_id: p for p in partitions}
+            for document_id, row, score in self.ann.search(
+                    query_vector, top_k, nprobe=nprobe,
+                    document_ids=selected):
+                partition = selected[document_id]
+                hits.append(
+                    SearchHit(chunk_id=row,
+                              document_id=document_id,
+                              user_id=partition.user_id,
+                              score=score,
+                              text=partition.text(row)))
+        else:
+            for partition in partitions:
+                rows, scores = partition.search(query_vector, top_k)
+                hits.extend(
+                    SearchHit(chunk_id=int(row),
+                              document_id=partition.document_id,
+                              user_id=partition.user_id,
+                              score=float(score),
+                              text=partition.text(row))
+                    for row, score in zip(rows, scores))
+
+        hits.extend(self._alias_hits(partitions, query_vector, top_k))
+
+        # A canonical chunk aliased by several selected documents (or
+        # selected itself) is returned once
+        unique = {}
+        for hit in hits:
+            unique.setdefault((hit.document_id, hit.chunk_id), hit)
+        hits = sorted(unique.values(), key=lambda hit: hit.score,
+                      reverse=True)
+        return hits[:top_k]
+
+    def _alias_hits(self, partitions, query_vector, top_k):
+        """
+        Score near-duplicate aliases against their canonical rows.
+        """
+        rows_by_document = {}
+        for partition in partitions:
+            for canonical_id, row in partition.aliases:
+                rows_by_document.setdefault(canonical_id, set()).add(row)
+
+        hits = []
+        for canonical_id, rows in rows_by_document.items():
+            canonical = self._partitions.get(canonical_id)
+            if canonical is None:
+                continue
+            rows = np.array(sorted(r for r in rows if r < len(canonical)),
+                            dtype=np.int64)
+            if not len(rows):
+                continue
+            scores = canonical.vectors(rows) @ query_vector
+            best = top_k_indices(scores, top_k)
+            hits.extend(
+                SearchHit(chunk_id=int(rows[i]),
+                          document_id=canonical.document_id,
+                          user_id=canonical.user_id,
+                          score=float(scores[i]),
+                          text=canonical.text(rows[i])) for i in best)
+        return hits
+
+    def hybrid_search(self, query, top_k=3, document_id=None, user_id=None,
+                      candidates=50, budget=None, rrf_k=60, nprobe=None):
+        """
+        Dense + BM25 candidates fused with reciprocal rank fusion.
+
+        SearchHit.score is the fused RRF score. `budget` (seconds) bounds
+        the lexical stage: partitions whose BM25 index can't catch up in
+        time are left to the dense ranking for this query.
+        """
+        partitions = [
+            p for p in self._select_partitions(document_id, user_id)
+            if len(p) or p.aliases
+        ]
+        if not partitions or top_k <= 0:
+            return []
+
+        candidates = max(candidates, top_k)
+        dense = self._dense_hits(partitions, query, candidates, nprobe)
+        # The budget is the lexical stage's own, after query embedding
+        # and dense scoring
+        deadline = time.monotonic() + budget if budget is not None else None
+        lexical = bm25_search(partitions, query, candidates, deadline)
+
+        texts = {}
+        for hit in dense:
+            texts[(hit.document_id, hit.chunk_id)] = hit
+        for partition, row, _ in lexical:
+            key = (partition.document_id, row)
+            if key not in texts:
+                texts[key] = SearchHit(chunk_id=row,
+                                       document_id=partition.document_id,
+                                       user_id=partition.user_id,
+                                       score=0.0,
+                                       text=partition.text(row))
+
+        fused = reciprocal_rank_fusion(
+            [[(hit.document_id, hit.chunk_id) for hit in dense],
+             [(partition.document_id, row) for partition, row, _ in lexical]],
+            k=rrf_k)
+
+        return [
+            SearchHit(chunk_id=hit.chunk_id,
+                      document_id=hit.document_id,
+                      user_id=hit.user_id,
+                      score=score,
+                      text=hit.text)
+            for hit, score in ((texts[key], score)
+                               for key, score in fused[:top_k])
+        ]
+
+
+class SegmentPartition:
+    """
+    A document's rows spread over one or more memory-mapped segments.
+
+    With a codec, only compressed codes are kept in RAM: they pick
+    `rescore` candidates, which are rescored against the full-precision
+    vectors on disk.
+    """
+
+    def __init__(self, document_id, user_id, codec=None, rescore=200):
+        self.document_id = document_id
+        self.user_id = user_id
+        self.codec = codec
+        self.rescore = rescore
+        self.code_blocks = []
+        self.metadata = {}
+        self.aliases = []
+        self.lexical = LexicalPostings()
+        self.lexical_lock = threading.Lock()
+        self.segments = []
+        self._starts = [0]
+
+    def __len__(self):
+        return self._starts[-1]
+
+    def add_segment(self, segment):
+        # Searches run without a lock: publish the rows before the codes
+        # that can rank them, so every candidate maps to a segment
+        codes = None
+        if self.codec is not None:
+            codes = self.codec.encode(segment.embeddings)
+        self.segments.append(segment)
+        self._starts.append(self._starts[-1] + len(segment))
+        if codes is not None:
+            self.code_blocks.append(codes)
+        self.metadata.update(segment.metadata)
+        self.aliases.extend(segment.aliases)
+
+    def text(self, row):
+        index = bisect.bisect_right(self._starts, row) - 1
+        return self.segments[index].text(row - self._starts[index])
+
+    def vectors(self, rows):
+        """
+        Full-precision rows (in the given order) from the segments.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        vectors = np.empty((len(rows), self.segments[0].embeddings.shape[1]),
+                           dtype=np.float32)
+        indexes = np.searchsorted(self._starts, rows, side="right") - 1
+        for index in np.unique(indexes):
+            selected = indexes == index
+            vectors[selected] = self.segments[index].embeddings[
+                rows[selected] - self._starts[index]]
+        return vectors
+
+    @property
+    def code_bytes(self):
+        return sum(block.nbytes for block in self.code_blocks)
+
+    def search(self, query_vector, top_k):
+        if self.codec is not None and len(self) > max(self.rescore, top_k):
+            return self._search_codes(query_vector, top_k)
+
+        segments = list(self.segments)
+        if len(segments) == 1:
+            scores = segments[0].embeddings @ query_vector
+        else:
+            scores = np.concatenate(
+                [segment.embeddings @ query_vector for segment in segments])
+        rows = top_k_indices(scores, top_k)
+        return rows, scores[rows]
+
+    def _search_codes(self, query_vector, top_k):
+        blocks = list(self.code_blocks)
+        approximate = np.concatenate(
+            [self.codec.scores(block, query_vector) for block in blocks])
+        candidates = top_k_indices(approximate, max(self.rescore, top_k))
+
+        exact = self.vectors(candidates) @ query_vector
+        best = top_k_indices(exact, top_k)
+        return candidates[best], exact[best]
+
+
+class SegmentVectorStore(SimpleVectorStore):
+    """
+    Vector store persisted as append-only segments under `directory`.
+
+    Every process that opens the same directory sees the same documents;
+    segments written by other workers are picked up on the next search.
+
+    quantization: "none", "int8" or "pq" (see quantization.py); rescore
+    is the number of candidates rescored at full precision.
+
+    The ANN index is rebuilt from the segments on startup unless one was
+    saved with save_ann(); then only newer segments are added to it.
+    """
+
+    def __init__(self, directory, dim=EMBEDDING_DIM, dtype="float32",
+                 quantization="none", rescore=200, ann=None,
+                 ann_min_rows=20000):
+        super().__init__(dim, ann=ann, ann_min_rows=ann_min_rows)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dtype = np.dtype(dtype)
+        self.rescore = rescore
+        self.codec = None
+        if quantization and quantization != "none":
+            self.codec = EmbeddingCodec(quantization, self.directory)
+        # Segments already in the ANN index
+        self._ann_segments = set()
+        if ann is not None:
+            self._ann_segments.update(ann.metadata.get("segments", ()))
+        self._manifest = ManifestReader(self.directory)
+        self.refresh()
+
+    def _new_partition(self, document_id, user_id):
+        return SegmentPartition(document_id, user_id, codec=self.codec,
+                                rescore=self.rescore)
+
+    def memory_usage(self):
+        """
+        Bytes of embedding data held in RAM (codes), or that exact search
+        scans (float vectors, memory-mapped).
+        """
+        partitions = list(self._partitions.values())
+        vector_bytes = sum(segment.embeddings.nbytes for p in partitions
+                           for segment in p.segments)
+        if self.codec is None:
+            return {"mode": "none", "vector_bytes": vector_bytes}
+        return {
+            "mode": "pq" if self.codec.pq is not None else "int8",
+            "vector_bytes": vector_bytes,
+            "code_bytes": sum(p.code_bytes for p in partitions),
+        }
+
+    def add_texts(self, texts, document_id, user_id, metadata=None,
+                  embeddings=None, spans=None, aliases=None):
+        if not texts and not aliases:
+            return
+
+        vectors = self._prepare_vectors(texts, embeddings)
+        relative_path = write_segment(self.directory,
+                                      user_id=user_id,
+                                      document_id=document_id,
+                                      texts=texts,
+                                      vectors=vectors,
+                                      metadata=metadata,
+                                      dtype=self.dtype,
+                                      spans=spans,
+                                      aliases=aliases)
+        append_to_manifest(self.directory, relative_path)
+        self.refresh()
+
+        # Other processes index these rows on their first lexical query
+        ensure_indexed(self._partitions[document_id])
+
+    def delete_document(self, document_id):
+        # Copies of aliased rows are published ahead of the deletion, so
+        # every process applies them before dropping the document
+        self.refresh()
+        self._rehome_aliases(document_id)
+        append_to_manifest(self.directory, f"{DELETE_PREFIX}{document_id}")
+        self.refresh()
+
+    def refresh(self):
+        """
+        Open segments published since the last refresh and apply
+        deletions.
+        """
+        with self._lock:
+            for entry in self._manifest.read_new():
+                if entry.startswith(DELETE_PREFIX):
+                    self._drop_partition(int(entry[len(DELETE_PREFIX):]))
+                    continue
+
+                segment = Segment(self.directory, entry)
+                partition = self._get_or_create_partition(
+                    segment.document_id, segment.user_id)
+                first_row = len(partition)
+                partition.add_segment(segment)
+                if self.ann is not None and entry not in self._ann_segments:
+                    self.ann.add(segment.embeddings, segment.document_id,
+                                 first_row, segment.user_id)
+                    self._ann_segments.add(entry)
+
+            # Training is far too slow for the query path (see
+            # train_codebook); a saved codebook is only picked up here
+            if self.codec is not None:
+                self.codec.load_codebook()
+
+    def train_codebook(self):
+        """
+        Train and save the PQ codebook once enough vectors are stored
+        (called by the ingestion worker and `manage.py train_codebook`).
+        Returns True if a codebook was trained.
+
+        This process's existing blocks keep their int8 codes; new
+        segments, and every process started later, use the codebook.
+        """
+        self.refresh()
+        if self.codec is None or not self.codec.needs_training(len(self)):
+            return False
+
+        partitions = list(self._partitions.values())
+        segments = [segment for p in partitions for segment in p.segments]
+
+        # Every step-th row, up to a few times PQ_TRAIN_ROWS
+        step = max(1, sum(len(segment) for segment in segments) //
+                   (4 * PQ_TRAIN_ROWS))
+        sample = np.concatenate([
+            np.asarray(segment.embeddings[::step], dtype=np.float32)
+            for segment in segments
+        ])
+        self.codec.train(sample)
+        return True
+
+    def _select_partitions(self, document_id, user_id):
+        self.refresh()
+        return super()._select_partitions(document_id, user_id)
+
+    def save_ann(self):
+        """
+        Persist the ANN index next to the segments, so processes started
+        later load it instead of re-inserting every row.
+        """
+        if self.ann is None:
+            return
+        self.refresh()
+        with self._lock:
+            self.ann.metadata["segments"] = sorted(self._ann_segments)
+            self.ann.save(self.directory / ANN_INDEX_NAME)
 
-    def __init__(self):
-        self.texts = []
 
-    def add_texts(self, texts, metadata=None):
-        self.texts.extend(texts)
+def build_ann_index(directory=None):
+    """
+    IVF index configured by the ANN_* settings (loaded from directory
+    when one was saved there), or None when VECTOR_STORE_ANN is unset.
+    """
+    backend = getattr(settings, "VECTOR_STORE_ANN", "")
+    if not backend:
+        return None
+    if backend != "ivf":
+        raise ValueError(f"Unknown ANN backend: {backend}")
 
-    def similarity_search(self, query, top_k=3):
-        # Fallback: return last uploaded chunks
-        return self.texts[-top_k:]
+    nprobe = getattr(settings, "ANN_NPROBE", 32)
+    auto_train = getattr(settings, "ANN_AUTO_TRAIN", False)
+    path = Path(directory) / ANN_INDEX_NAME if directory else None
+    if path is not None and path.exists():
+        index = IVFIndex.load(path)
+        index.nprobe = nprobe
+        index.auto_train = auto_train
+        return index
+    return IVFIndex(EMBEDDING_DIM,
+                    nlist=getattr(settings, "ANN_NLIST", 1024),
+                    nprobe=nprobe,
+                    auto_train=auto_train)
 
 
-GLOBAL_VECTOR_STORE = SimpleVectorStore()
+def build_vector_store():
+    """
+    Persistent store when VECTOR_STORE_DIR is set, in-memory otherwise.
+    """
+    directory = getattr(settings, "VECTOR_STORE_DIR", "")
+    ann_min_rows = getattr(settings, "ANN_MIN_ROWS", 20000)
+    if directory:
+        return SegmentVectorStore(
+            directory,
+            dtype=getattr(settings, "VECTOR_STORE_DTYPE", "float32"),
+            quantization=getattr(settings, "VECTOR_STORE_QUANTIZATION",
+                                 "none"),
+            rescore=getattr(settings, "VECTOR_STORE_RESCORE", 200),
+            ann=build_ann_index(directory),
+            ann_min_rows=ann_min_rows)
+    return SimpleVectorStore(ann=build_ann_index(),
+                             ann_min_rows=ann_min_rows)
 
 
-def chunk_text(text, chunk_size=700, overlap=100):
-    words = text.split()
-    chunks = []
-    start = 0
+GLOBAL_VECTOR_STORE = build_vector_store()
 
-    while start < len(words):
-        end = start + chunk_size
-        chunks.append(" ".join(words[start:end]))
-        start += chunk_size - overlap
 
-    return chunks
+def chunk_text(text, max_tokens=None, overlap_tokens=None):
+    """
+    Token-sized, sentence-snapped chunks of one text (see chunker.py).
+    """
+    kwargs = {}
+    if max_tokens is not None:
+        kwargs["max_tokens"] = max_tokens
+    if overlap_tokens is not None:
+        kwargs["overlap_tokens"] = overlap_tokens
+    return [span.text for span in iter_spans([text], **kwargs)]
@@ -0,0 +1,58 @@
+"""
+Rolling conversation summaries.
+
+Every SUMMARY_EVERY_TURNS new turns, the turns older than the last
+SUMMARY_KEEP_RECENT_TURNS are folded into Conversation.summary in the
+background. Prompts then carry the summary plus only the unsummarized
+turns, so input tokens per turn stay roughly flat as a chat grows.
+"""
+
+from django.conf import settings
+
+from .background import run_in_background
+from .gemini import summarize_conversation
+from .models import ChatMessage, Conversation
+
+
+def format_turn(chat):
+    return f"User: {chat.user_message}\nBot: {chat.bot_reply}\n"
+
+
+def format_summary(summary):
+    return f"Summary of earlier conversation:\n{summary}\n"
+
+
+def update_summary(conversation_id):
+    """
+    Fold old turns into the summary if enough have accumulated.
+    Returns True when the summary was updated.
+    """
+    every = getattr(settings, "SUMMARY_EVERY_TURNS", 4)
+    keep = getattr(settings, "SUMMARY_KEEP_RECENT_TURNS", 2)
+
+    conversation = Conversation.objects.get(id=conversation_id)
+
+    turns = ChatMessage.objects.filter(conversation_id=conversation_id,
+                                       message_type="text")
+    if conversation.summary_until:
+        turns = turns.filter(created_at__gt=conversation.summary_until)
+    turns = list(turns.order_by("created_at"))
+
+    if len(turns) < keep + every:
+        return False
+
+    to_fold = turns[:-keep] if keep else turns
+    summary = summarize_conversation(
+        conversation.summary, "".join(format_turn(chat) for chat in to_fold))
+
+    # Optimistic update: skip if another worker already moved the summary on
+    updated = Conversation.objects.filter(
+        id=conversation_id,
+        summary_until=conversation.summary_until).update(
+            summary=summary, summary_until=to_fold[-1].created_at)
+    return bool(updated)
+
+
+def schedule_summary_update(conversation_id):
+    if getattr(settings, "SUMMARY_EVERY_TURNS", 4) > 0:
+        run_in_background(update_summary, conversation_id)
@@ -1,3 +1,1450 @@
-#from django.test import TestCase
+import base64
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import timing
+from .benchmarks import isolated_embedding_cache
+from .document_aliases import (AliasMatcher, get_alias_index,
+                               resolve_document_aliases)
+from .fake_llm import FakeLLMOptions, start_fake_llm_server
+from .gemini import get_ai_reply, reset_clients, summarize_conversation
+from .ingestion import claim_next_job, requeue_stale_jobs, run_job
+from .llm_cache import recent_history, response_cache_key
+from .models import ChatMessage, Conversation, Document, IngestionJob
+from .pagination import decode_cursor, encode_cursor, keyset_page
+from .prompt_packer import (CHARS_PER_TOKEN, MIN_TRUNCATED_TOKENS,
+                            count_tokens, pack_prompt, truncate_to_tokens)
+from .rag import embeddings
+from .rag.ann import TRAIN_POINTS_PER_LIST, IVFIndex
+from .rag.chunker import _TOKEN, estimate_tokens, iter_spans
+from .rag.dedup import DedupIndex, minhash, similarity
+from .rag.embedding_cache import EmbeddingCache
+from .rag.lexical import INDEX_STEP, ensure_indexed
+from .rag.quantization import PQ_CENTROIDS, PQ_TRAIN_ROWS, ProductQuantizer
+from .rag.rag_pipeline import retrieve_context, retrieve_document_hits
+from .rag.reranker import FIRST_PASS_PAIRS, Reranker
+from .rag.vectorstore import (DocumentPartition, SearchHit, SegmentVectorStore,
+                              SimpleVectorStore)
+from .summaries import update_summary
+from .text_cleaner import StreamingCleaner, clean_llm_output
+from .views import history_queryset, messages_queryset, conversations_queryset
+
+
+# ==================================================
+# 🔎 Query plans
+# ==================================================
+def explain(queryset):
+    """
+    Query plan for a queryset. On PostgreSQL sequential scans are disabled
+    first, so a plan without an index scan means no usable index exists
+    (tiny test tables would otherwise always be seq-scanned).
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+    return queryset.explain()
+
+
+def uses_index(plan, table):
+    if connection.vendor == "sqlite":
+        # e.g. "SEARCH chatbotapp_chatmessage USING INDEX ... (conversation_id=?)"
+        return (f"SEARCH {table} USING" in plan
+                and "TEMP B-TREE" not in plan)
+    if connection.vendor == "postgresql":
+        return "Index" in plan and "Seq Scan" not in plan
+    return True
+
+
+@override_settings(SUMMARY_EVERY_TURNS=0)
+class ChatViewQueryTests(TestCase):
+    """
+    Guards the hot chat queries: a fixed number of queries no matter how
+    long the conversation is, and every one served by an index.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("alice", password="x")
+        cls.conversation = Conversation.objects.create(user=cls.user,
+                                                       title="Chat")
+        for index in range(5):
+            Conversation.objects.create(user=cls.user, title=f"Other {index}")
+
+        ChatMessage.objects.bulk_create([
+            ChatMessage(user=cls.user,
+                        conversation=cls.conversation,
+                        user_message=f"question {index}",
+                        bot_reply=f"answer {index}") for index in range(120)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        caches["document_aliases"].clear()
+        self.client.force_login(self.user)
+        self.url = reverse("conversation", args=[self.conversation.id])
+
+    def test_home_get_query_count(self):
+        # session, user, conversation, sidebar page, messages page
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["chat_history"]), 50)
+
+    def test_home_get_query_count_is_constant(self):
+        ChatMessage.objects.bulk_create([
+            ChatMessage(user=self.user,
+                        conversation=self.conversation,
+                        user_message="more",
+                        bot_reply="more") for _ in range(200)
+        ])
+
+        with self.assertNumQueries(5):
+            self.client.get(self.url)
+
+    @mock.patch("chatbotapp.views.retrieve_context",
+                new=mock.Mock(return_value=[]))
+    @mock.patch("chatbotapp.views.get_ai_reply", return_value="Hello!")
+    def test_home_post_query_count(self, get_ai_reply):
+        # session, user, conversation, history, alias index (cache miss),
+        # insert message
+        with self.assertNumQueries(6):
+            response = self.client.post(self.url, {"message": "Hi there"})
+
+        self.assertEqual(response.status_code, 302)
+        get_ai_reply.assert_called_once()
+
+        # The alias index is cached now: one query fewer
+        with self.assertNumQueries(5):
+            self.client.post(self.url, {"message": "And again"})
+
+    def test_message_page_uses_index(self):
+        plan = explain(
+            messages_queryset(self.conversation).order_by(
+                "-created_at", "-id")[:51])
+        self.assertTrue(uses_index(plan, "chatbotapp_chatmessage"), plan)
+
+    def test_history_uses_index(self):
+        plan = explain(history_queryset(self.conversation))
+        self.assertTrue(uses_index(plan, "chatbotapp_chatmessage"), plan)
+
+    def test_conversation_page_uses_index(self):
+        plan = explain(
+            conversations_queryset(self.user).order_by("-created_at",
+                                                       "-id")[:31])
+        self.assertTrue(uses_index(plan, "chatbotapp_conversation"), plan)
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Rows that share a created_at (bulk inserts, coarse clocks) must still
+    page without overlaps or gaps: the id breaks the tie.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("erin", password="x")
+        cls.conversation = Conversation.objects.create(user=cls.user,
+                                                       title="Chat")
+        ChatMessage.objects.bulk_create([
+            ChatMessage(user=cls.user,
+                        conversation=cls.conversation,
+                        user_message=f"question {index}",
+                        bot_reply=f"answer {index}") for index in range(10)
+        ])
+        # Three timestamps shared by runs of 3-4 rows
+        now = timezone.now()
+        for index, chat in enumerate(
+                ChatMessage.objects.order_by("id")):
+            ChatMessage.objects.filter(id=chat.id).update(
+                created_at=now + timedelta(seconds=index // 4))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def walk(self, limit):
+        pages, cursor = [], None
+        while True:
+            rows, cursor = keyset_page(messages_queryset(self.conversation),
+                                       before=cursor,
+                                       limit=limit)
+            pages.append([chat.id for chat in rows])
+            if cursor is None:
+                return pages
+
+    def test_pages_cover_every_row_once(self):
+        expected = list(
+            ChatMessage.objects.order_by("-created_at",
+                                         "-id").values_list("id",
+                                                            flat=True))
+        for limit in (1, 3, 4, 10):
+            with self.subTest(limit=limit):
+                pages = self.walk(limit)
+                self.assertEqual(sum(pages, []), expected)
+                self.assertTrue(all(len(page) <= limit for page in pages))
+
+    @override_settings(CHAT_PAGE_SIZE=3)
+    def test_endpoint_follows_cursor(self):
+        url = reverse("conversation_messages", args=[self.conversation.id])
+        seen, cursor = [], None
+        while True:
+            params = {"before": cursor} if cursor else {}
+            data = self.client.get(url, params).json()
+            seen.extend(chat["id"] for chat in data["messages"])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual(sorted(seen), sorted(
+            ChatMessage.objects.values_list("id", flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_invalid_cursor_is_rejected(self):
+        bad_cursors = [
+            "not-a-cursor",
+            base64.urlsafe_b64encode(b"yesterday|1").decode(),
+            base64.urlsafe_b64encode(b"2024-01-01T00:00:00|x").decode(),
+            base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+        ]
+        for cursor in bad_cursors:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(ValueError):
+                    decode_cursor(cursor)
+
+        urls = [
+            reverse("conversation_messages", args=[self.conversation.id]),
+            reverse("conversation_list"),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, {"before": "not-a-cursor"})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"error": "Invalid cursor"})
+
+    def test_cursor_round_trips(self):
+        chat = ChatMessage.objects.earliest("id")
+        self.assertEqual(decode_cursor(encode_cursor(chat)),
+                         (chat.created_at, chat.id))
+
+
+# ==================================================
+# 📝 Rolling summaries
+# ==================================================
+@override_settings(LLM_BACKEND="fake",
+                   SUMMARY_EVERY_TURNS=4,
+                   SUMMARY_KEEP_RECENT_TURNS=2)
+class RollingSummaryTests(TestCase):
+    """
+    Summaries are generated by the fake LLM server (fake_llm.py), so the
+    whole client path runs without the real API.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = start_fake_llm_server(options=FakeLLMOptions(
+            latency_ms=0, tokens_per_second=1e6, reply_tokens=30))
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("frank",
+                                                        password="x")
+        cls.conversation = Conversation.objects.create(user=cls.user,
+                                                       title="Chat")
+
+    def setUp(self):
+        self.start = timezone.now()
+        self.turns = 0
+
+        settings_override = override_settings(FAKE_LLM_URL=self.server.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_clients()
+        self.addCleanup(reset_clients)
+
+    def add_turns(self, count):
+        for _ in range(count):
+            chat = ChatMessage.objects.create(
+                user=self.user,
+                conversation=self.conversation,
+                user_message=f"question {self.turns}",
+                bot_reply=f"answer {self.turns}")
+            # Distinct, ordered timestamps even on a coarse clock
+            ChatMessage.objects.filter(id=chat.id).update(
+                created_at=self.start + timedelta(seconds=self.turns))
+            self.turns += 1
+
+    def history(self):
+        self.conversation.refresh_from_db()
+        return [chat.user_message
+                for chat in history_queryset(self.conversation)]
+
+    def requests(self):
+        return self.server.stats()["requests"]
+
+    def test_waits_for_enough_turns(self):
+        self.add_turns(5)
+        requests = self.requests()
+
+        self.assertFalse(update_summary(self.conversation.id))
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary, "")
+        self.assertIsNone(self.conversation.summary_until)
+        self.assertEqual(self.requests(), requests)
+
+    def test_folds_all_but_recent_turns(self):
+        self.add_turns(6)
+        requests = self.requests()
+
+        self.assertTrue(update_summary(self.conversation.id))
+
+        self.conversation.refresh_from_db()
+        self.assertTrue(self.conversation.summary)
+        self.assertEqual(self.conversation.summary_until,
+                         self.start + timedelta(seconds=3))
+        self.assertEqual(self.requests(), requests + 1)
+        # Only the two kept turns remain as verbatim history
+        self.assertEqual(self.history(), ["question 5", "question 4"])
+
+    @mock.patch("chatbotapp.summaries.summarize_conversation",
+                wraps=summarize_conversation)
+    def test_next_fold_extends_previous_summary(self, summarize):
+        self.add_turns(6)
+        update_summary(self.conversation.id)
+        self.conversation.refresh_from_db()
+        first_summary = self.conversation.summary
+
+        self.add_turns(3)
+        self.assertFalse(update_summary(self.conversation.id))
+        self.add_turns(1)
+        self.assertTrue(update_summary(self.conversation.id))
+
+        previous_summary, turns_text = summarize.call_args.args
+        self.assertEqual(previous_summary, first_summary)
+        self.assertEqual(turns_text, "".join(
+            f"User: question {index}\nBot: answer {index}\n"
+            for index in range(4, 8)))
+        self.assertEqual(self.history(), ["question 9", "question 8"])
+
+    def test_history_excludes_summarized_and_document_rows(self):
+        self.add_turns(6)
+        ChatMessage.objects.create(user=self.user,
+                                   conversation=self.conversation,
+                                   message_type="document",
+                                   uploaded_file_name="report.pdf")
+        update_summary(self.conversation.id)
+
+        self.assertEqual(self.history(), ["question 5", "question 4"])
+
+    def test_concurrent_fold_is_skipped(self):
+        self.add_turns(6)
+
+        def moved_on(previous_summary, turns_text):
+            # Another worker finished first
+            Conversation.objects.filter(id=self.conversation.id).update(
+                summary="theirs", summary_until=self.start)
+            return "ours"
+
+        with mock.patch("chatbotapp.summaries.summarize_conversation",
+                        side_effect=moved_on):
+            self.assertFalse(update_summary(self.conversation.id))
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary, "theirs")
+
+
+# ==================================================
+# 🔍 Multi-document retrieval
+# ==================================================
+def search_hit(document_id, chunk_id, score, text=""):
+    return SearchHit(chunk_id=chunk_id,
+                     document_id=document_id,
+                     user_id=1,
+                     score=score,
+                     text=text or f"chunk {document_id}/{chunk_id}")
+
+
+class RetrieveDocumentHitsTests(SimpleTestCase):
+
+    @mock.patch("chatbotapp.rag.rag_pipeline.embed_texts")
+    @mock.patch("chatbotapp.rag.rag_pipeline.rerank_hits")
+    @mock.patch("chatbotapp.rag.rag_pipeline.search_hits")
+    def test_rerank_keeps_alias_hits_of_other_documents(
+            self, search_hits, rerank_hits, embed_texts):
+        # Document 2 aliases a chunk stored in document 1 (not searched)
+        rankings = {
+            2: [search_hit(1, 0, 0.9), search_hit(2, 0, 0.5)],
+            3: [search_hit(3, 0, 0.8)],
+        }
+        search_hits.side_effect = (
+            lambda question, document_id, *args: rankings[document_id])
+        rerank_hits.side_effect = (
+            lambda question, hits, top_k, min_hits=None: (hits, True))
+
+        hits = retrieve_document_hits("compare them", [2, 3],
+                                      top_k=3,
+                                      rerank=True)
+
+        self.assertCountEqual([(hit.document_id, hit.chunk_id)
+                               for hit in hits], [(1, 0), (2, 0), (3, 0)])
+
+    @mock.patch("chatbotapp.rag.rag_pipeline.embed_texts")
+    @mock.patch("chatbotapp.rag.rag_pipeline.GLOBAL_VECTOR_STORE")
+    def test_fanout_searches_reach_server_timing(self, store, embed_texts):
+        store.similarity_search.side_effect = (
+            lambda query, top_k, document_id, user_id, nprobe: [
+                search_hit(document_id, 0, 0.5)])
+
+        token = timing.start_request()
+        try:
+            retrieve_document_hits("compare them", [2, 3],
+                                   mode="dense",
+                                   rerank=False)
+        finally:
+            timings = timing.end_request(token)
+
+        self.assertEqual([stage for stage, _ in timings], ["search", "search"])
+
+
+@mock.patch("chatbotapp.rag.rag_pipeline.embed_texts", mock.Mock())
+@mock.patch("chatbotapp.rag.vectorstore.embed_texts",
+            lambda texts: np.tile(
+                np.array([1.0, 0.5, 0.8, 0.0], dtype=np.float32),
+                (len(texts), 1)))
+class AliasedDocumentRetrievalTests(SimpleTestCase):
+
+    def setUp(self):
+        store = SimpleVectorStore(dim=4)
+        store.add_texts(["shared", "only v1"],
+                        document_id=1,
+                        user_id=1,
+                        metadata={"filename": "v1.pdf"},
+                        embeddings=unit_vectors(0, 1))
+        # v2 repeats v1's first chunk, stored as an alias
+        store.add_texts(["only v2"],
+                        document_id=2,
+                        user_id=1,
+                        metadata={"filename": "v2.pdf"},
+                        embeddings=unit_vectors(2),
+                        aliases=[(1, 0)])
+        patcher = mock.patch("chatbotapp.rag.rag_pipeline.GLOBAL_VECTOR_STORE",
+                             store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_each_chunk_is_returned_once(self):
+        for mode in ("dense", "hybrid"):
+            with self.subTest(mode=mode):
+                hits = retrieve_document_hits("q", [1, 2],
+                                              top_k=4,
+                                              mode=mode,
+                                              rerank=False)
+                self.assertCountEqual([(hit.document_id, hit.chunk_id)
+                                       for hit in hits],
+                                      [(1, 0), (1, 1), (2, 0)])
+
+    def test_alias_hits_are_labelled_with_the_document_searched(self):
+        contexts = retrieve_context("q",
+                                    document_ids=[2, 1],
+                                    top_k=4,
+                                    mode="dense")
+        self.assertCountEqual(contexts, [
+            "[v2.pdf]\nshared",
+            "[v2.pdf]\nonly v2",
+            "[v1.pdf]\nonly v1",
+        ])
+
+
+# ==================================================
+# 🗑 Deleting documents with aliased chunks
+# ==================================================
+def unit_vectors(*indexes, dim=4):
+    vectors = np.zeros((len(indexes), dim), dtype=np.float32)
+    vectors[np.arange(len(indexes)), indexes] = 1.0
+    return vectors
+
+
+@mock.patch("chatbotapp.rag.vectorstore.embed_texts",
+            lambda texts: np.ones((len(texts), 4), dtype=np.float32))
+class DeleteAliasedDocumentTests(SimpleTestCase):
+
+    def populate(self, store):
+        store.add_texts(["canonical text", "other text"],
+                        document_id=1,
+                        user_id=1,
+                        embeddings=unit_vectors(0, 1))
+        # Document 2 contains document 1's first chunk as a near-duplicate
+        store.add_texts(["own text"],
+                        document_id=2,
+                        user_id=1,
+                        embeddings=unit_vectors(2),
+                        aliases=[(1, 0)])
+
+    def texts(self, store, document_id):
+        return sorted(hit.text for hit in store.similarity_search(
+            "query", top_k=10, document_id=document_id))
+
+    def assert_rehomed(self, store):
+        self.assertEqual(self.texts(store, 2), ["canonical text", "own text"])
+        store.delete_document(1)
+        self.assertIsNone(store.get_partition(1))
+        self.assertEqual(self.texts(store, 2), ["canonical text", "own text"])
+
+    def test_memory_store_keeps_aliased_chunks(self):
+        store = SimpleVectorStore(dim=4)
+        self.populate(store)
+        self.assert_rehomed(store)
+
+    def test_segment_store_keeps_aliased_chunks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SegmentVectorStore(directory, dim=4)
+            self.populate(store)
+            self.assert_rehomed(store)
+
+            # A process opening the store afterwards sees the same
+            self.assertEqual(
+                self.texts(SegmentVectorStore(directory, dim=4), 2),
+                ["canonical text", "own text"])
+
+
+# ==================================================
+# 🗂️ Document aliases
+# ==================================================
+class AliasMatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        self.matcher = AliasMatcher([("he", 3), ("she", 1), ("his", 4),
+                                     ("hers", 2)])
+
+    def test_match_returns_smallest_value(self):
+        self.assertEqual(self.matcher.match("ushers"), 1)
+        self.assertEqual(self.matcher.match("this"), 4)
+        self.assertIsNone(self.matcher.match("nothing"))
+
+    def test_match_all_includes_overlapping_patterns(self):
+        # "she", "he" and "hers" overlap in "ushers"
+        self.assertEqual(self.matcher.match_all("ushers"), {1, 2, 3})
+        self.assertEqual(self.matcher.match_all(""), set())
+
+    def test_patterns_sharing_an_end_state_keep_every_value(self):
+        matcher = AliasMatcher([("report", 1), ("report", 0)])
+        self.assertEqual(matcher.match("annual report"), 0)
+        self.assertEqual(matcher.match_all("annual report"), {0, 1})
+
+
+class AliasIndexCacheTests(TestCase):
+
+    def setUp(self):
+        caches["document_aliases"].clear()
+        self.user = get_user_model().objects.create_user("bob", password="x")
+        self.conversation = Conversation.objects.create(user=self.user,
+                                                        title="Chat")
+
+    def upload(self, name):
+        document = Document.objects.create(user=self.user,
+                                           file=f"documents/{name}")
+        ChatMessage.objects.create(conversation=self.conversation,
+                                   user=self.user,
+                                   message_type="document",
+                                   uploaded_file_name=name,
+                                   document=document)
+        return document
+
+    def test_entry_of_an_older_active_document_is_rebuilt(self):
+        first = self.upload("budget.pdf")
+        stale = get_alias_index(self.conversation.id, version=first.id)
+
+        # Another worker's upload: this process's entry wasn't invalidated
+        second = self.upload("roadmap.pdf")
+        caches["document_aliases"].set(f"doc-aliases:{self.conversation.id}",
+                                       (first.id, stale))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                get_alias_index(self.conversation.id, version=first.id),
+                stale)
+        aliases = get_alias_index(self.conversation.id, version=second.id)
+        self.assertEqual([document_id for document_id, _ in aliases],
+                         [first.id, second.id])
+
+
+class ResolveDocumentAliasesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("carol",
+                                                        password="x")
+        cls.conversation = Conversation.objects.create(user=cls.user,
+                                                       title="Chat")
+        cls.documents = []
+        for name in ("budget_plan.pdf", "roadmap.docx", "hiring.pdf"):
+            document = Document.objects.create(user=cls.user,
+                                               file=f"documents/{name}")
+            ChatMessage.objects.create(conversation=cls.conversation,
+                                       user=cls.user,
+                                       message_type="document",
+                                       uploaded_file_name=name,
+                                       document=document)
+            cls.documents.append(document.id)
+
+    def setUp(self):
+        caches["document_aliases"].clear()
+
+    def resolve(self, message):
+        ids = resolve_document_aliases(self.conversation.id, message)
+        return [self.documents.index(document_id) for document_id in ids]
+
+    def test_bare_ordinal_is_not_a_document_reference(self):
+        self.assertEqual(
+            self.resolve("What is the first point in the second document?"),
+            [1])
+        self.assertEqual(self.resolve("List the first three risks"), [])
+
+    def test_coordinated_ordinals(self):
+        self.assertEqual(self.resolve("Compare the first and second document"),
+                         [0, 1])
+        self.assertEqual(
+            self.resolve("compare the first and the third documents"),
+            [0, 2])
+        self.assertEqual(
+            self.resolve("Summarize the third, first and second documents"),
+            [0, 1, 2])
+
+    def test_several_ordinal_document_phrases(self):
+        self.assertEqual(
+            self.resolve("Does the first document agree with the third "
+                         "document?"), [0, 2])
+
+    def test_all_documents(self):
+        self.assertEqual(self.resolve("Summarize both documents"), [0, 1, 2])
+        self.assertEqual(self.resolve("Are small documents ok?"), [])
+
+    def test_ordinal_document_beats_filename(self):
+        self.assertEqual(
+            self.resolve("In the second document, what is the budget?"), [1])
+        self.assertEqual(self.resolve("What is the first item of the budget?"),
+                         [0])
+
+    def test_filename(self):
+        self.assertEqual(self.resolve("What does the roadmap say?"), [1])
+
+
+# ==================================================
+# 🔤 Hybrid search lexical budget
+# ==================================================
+@mock.patch("chatbotapp.rag.vectorstore.embed_texts",
+            lambda texts: np.ones((len(texts), 4), dtype=np.float32))
+class LexicalBudgetTests(SimpleTestCase):
+
+    def test_indexing_progresses_past_the_deadline(self):
+        partition = DocumentPartition(1, 1, dim=4)
+        rows = 2 * INDEX_STEP + 1
+        partition.append([f"row {row}" for row in range(rows)],
+                         np.ones((rows, 4), dtype=np.float32))
+
+        expired = time.monotonic() - 1
+        self.assertFalse(ensure_indexed(partition, deadline=expired))
+        self.assertEqual(len(partition.lexical), INDEX_STEP)
+        self.assertFalse(ensure_indexed(partition, deadline=expired))
+        self.assertTrue(ensure_indexed(partition, deadline=expired))
+        self.assertEqual(len(partition.lexical), rows)
+
+    def test_slow_dense_stage_leaves_the_lexical_budget(self):
+        store = SimpleVectorStore(dim=4)
+        store.add_texts(["apples and pears"],
+                        document_id=1,
+                        user_id=1,
+                        embeddings=np.ones((1, 4), dtype=np.float32))
+        # Rows published by another process: not in the postings yet
+        store.get_partition(1).append(["quarterly zebra migration"],
+                                      np.ones((1, 4), dtype=np.float32))
+
+        def slow_dense_hits(*args, **kwargs):
+            time.sleep(0.05)
+            return []
+
+        with mock.patch.object(store, "_dense_hits", slow_dense_hits):
+            hits = store.hybrid_search("zebra", top_k=3, budget=0.01)
+
+        self.assertEqual([hit.text for hit in hits],
+                         ["quarterly zebra migration"])
+
+
+# ==================================================
+# 🧮 PQ codebook training off the query path
+# ==================================================
+@mock.patch("chatbotapp.rag.vectorstore.embed_texts",
+            lambda texts: np.ones((len(texts), 16), dtype=np.float32))
+class CodebookTrainingTests(SimpleTestCase):
+
+    def test_only_train_codebook_trains(self):
+        random_state = np.random.RandomState(0)
+        trained = ProductQuantizer(
+            random_state.randn(2, PQ_CENTROIDS, 8).astype(np.float32))
+
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(
+                ProductQuantizer, "train", return_value=trained) as train:
+            web = SegmentVectorStore(directory, dim=16, quantization="pq")
+            worker = SegmentVectorStore(directory, dim=16, quantization="pq")
+            worker.add_texts([f"row {row}" for row in range(PQ_TRAIN_ROWS)],
+                             document_id=1,
+                             user_id=1,
+                             embeddings=random_state.randn(
+                                 PQ_TRAIN_ROWS, 16))
+
+            # Searching past PQ_TRAIN_ROWS never trains
+            web.similarity_search("query", document_id=1)
+            train.assert_not_called()
+            self.assertIsNone(web.codec.pq)
+
+            self.assertTrue(worker.train_codebook())
+            self.assertFalse(worker.train_codebook())
+            train.assert_called_once()
+
+            # Other processes load the saved codebook
+            web.similarity_search("query", document_id=1)
+            self.assertIsNotNone(web.codec.pq)
+            self.assertIsNotNone(
+                SegmentVectorStore(directory, dim=16,
+                                   quantization="pq").codec.pq)
+            train.assert_called_once()
+
+
+class IVFAutoTrainTests(SimpleTestCase):
+
+    def test_add_trains_only_when_opted_in(self):
+        vectors = np.random.RandomState(0).randn(2 * TRAIN_POINTS_PER_LIST, 8)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        index = IVFIndex(8, nlist=2)
+        index.add(vectors, document_id=1, first_row=0, user_id=1)
+        self.assertFalse(index.trained)
+        index.train()
+        self.assertTrue(index.trained)
+        self.assertEqual(len(index), len(vectors))
+
+        index = IVFIndex(8, nlist=2, auto_train=True)
+        index.add(vectors, document_id=1, first_row=0, user_id=1)
+        self.assertTrue(index.trained)
+
+
+class SearchOnAppend(list):
+    """
+    A list that runs a search right after every append, like a search
+    thread interleaving with add_segment.
+    """
+
+    def __init__(self, items, search):
+        super().__init__(items)
+        self.search = search
+
+    def append(self, item):
+        super().append(item)
+        self.search()
+
+
+class QuantizedRescoringTests(SimpleTestCase):
+
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+        self.query = self.random_state.randn(16).astype(np.float32)
+        self.query /= np.linalg.norm(self.query)
+
+    def add(self, store, rows):
+        vectors = self.random_state.randn(rows, 16).astype(np.float32)
+        store.add_texts([f"row {row}" for row in range(rows)],
+                        document_id=1,
+                        user_id=1,
+                        embeddings=vectors)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def test_int8_rescoring_matches_exact_search(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SegmentVectorStore(directory,
+                                       dim=16,
+                                       quantization="int8",
+                                       rescore=50)
+            vectors = np.concatenate(
+                [self.add(store, 100) for _ in range(3)])
+            partition = store.get_partition(1)
+
+            rows, scores = partition.search(self.query, 5)
+            exact = np.argsort(-(vectors @ self.query))[:5]
+            self.assertEqual(list(rows), list(exact))
+            np.testing.assert_allclose(scores, vectors[exact] @ self.query,
+                                       rtol=1e-5)
+
+    def test_search_during_add_segment_sees_whole_segments(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SegmentVectorStore(directory,
+                                       dim=16,
+                                       quantization="int8",
+                                       rescore=20)
+            self.add(store, 100)
+            partition = store.get_partition(1)
+            results = []
+            partition.code_blocks = SearchOnAppend(
+                partition.code_blocks,
+                lambda: results.append(partition.search(self.query, 5)))
+
+            self.add(store, 100)
+
+            self.assertEqual(len(results), 1)
+            self.assertEqual(len(results[0][0]), 5)
+            self.assertEqual(len(partition), 200)
+
+
+class SingleDocumentANNTests(SimpleTestCase):
+
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        centers = random_state.randn(16, 16)
+        vectors = (centers[random_state.randint(16, size=4000)] +
+                   0.4 * random_state.randn(4000, 16))
+        self.queries = vectors[random_state.choice(4000, 20)] + \
+            0.1 * random_state.randn(20, 16)
+
+        self.store = SimpleVectorStore(dim=16,
+                                       ann=IVFIndex(16, nlist=16),
+                                       ann_min_rows=1000)
+        self.store.add_texts([f"chunk {row}" for row in range(4000)],
+                             document_id=1,
+                             user_id=1,
+                             embeddings=vectors)
+        self.store.ann.train()
+
+    def search(self, query, **kwargs):
+        with mock.patch("chatbotapp.rag.vectorstore.embed_texts",
+                        return_value=query[None, :]):
+            return {
+                hit.chunk_id
+                for hit in self.store.similarity_search(
+                    "query", top_k=10, document_id=1, **kwargs)
+            }
+
+    def test_large_document_uses_ann_with_high_recall(self):
+        found = 0
+        with mock.patch.object(self.store.ann, "search",
+                               wraps=self.store.ann.search) as ann_search:
+            for query in self.queries:
+                approximate = self.search(query, nprobe=4)
+                self.store.ann_min_rows = 10**9
+                exact = self.search(query)
+                self.store.ann_min_rows = 1000
+                found += len(approximate & exact)
+
+        self.assertEqual(ann_search.call_count, len(self.queries))
+        self.assertGreaterEqual(found / (10 * len(self.queries)), 0.9)
+
+    @override_settings(ANN_NPROBE=7)
+    @mock.patch("chatbotapp.rag.rag_pipeline.GLOBAL_VECTOR_STORE")
+    def test_nprobe_setting_reaches_the_store(self, store):
+        retrieve_context("q", document_id=1, mode="dense")
+        self.assertEqual(store.similarity_search.call_args.kwargs["nprobe"], 7)
+        retrieve_context("q", document_id=1, mode="hybrid", nprobe=3)
+        self.assertEqual(store.hybrid_search.call_args.kwargs["nprobe"], 3)
+
+class FakeEncoder:
+
+    def __init__(self, dim=4):
+        self.dim = dim
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return np.array([[len(text)] * self.dim for text in texts],
+                        dtype=np.float32)
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+
+    def test_lru_evicts_least_recently_used(self):
+        embedding_cache = EmbeddingCache("model", dim=4, max_entries=2)
+        encode = FakeEncoder()
+        embedding_cache.embed(["a", "bb"], encode)
+        embedding_cache.embed(["a"], encode)  # "a" is now the most recent
+        embedding_cache.embed(["ccc"], encode)  # evicts "bb"
+        embedding_cache.embed(["a", "bb"], encode)
+
+        self.assertEqual(encode.calls, [["a", "bb"], ["ccc"], ["bb"]])
+        stats = embedding_cache.stats()
+        self.assertEqual(
+            (stats["memory_hits"], stats["misses"], stats["memory_entries"]),
+            (2, 4, 2))
+
+    def test_sqlite_tier_persists_across_instances(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/embeddings.sqlite3"
+            first = EmbeddingCache("model", dim=4, path=path)
+            vectors = first.embed(["alpha", "beta"], FakeEncoder())
+
+            # Another worker (or a restart): same model, same store
+            encode = FakeEncoder()
+            second = EmbeddingCache("model", dim=4, path=path)
+            again = second.embed(["alpha", " beta ", "gamma"], encode)
+
+            np.testing.assert_array_equal(again[:2], vectors)
+            self.assertEqual(encode.calls, [["gamma"]])
+            stats = second.stats()
+            self.assertEqual((stats["disk_hits"], stats["misses"]), (2, 1))
+
+            # Keys include the model name
+            other = FakeEncoder()
+            EmbeddingCache("other-model", dim=4, path=path).embed(["alpha"],
+                                                                  other)
+            self.assertEqual(other.calls, [["alpha"]])
+
+    def test_stats_count_each_text_once_per_call(self):
+        embedding_cache = EmbeddingCache("model", dim=4)
+        encode = FakeEncoder()
+        vectors = embedding_cache.embed(["a", "a", "b"], encode)
+        self.assertEqual(vectors.shape, (3, 4))
+        self.assertEqual(encode.calls, [["a", "b"]])
+
+        embedding_cache.embed(["a", "b", "c"], encode)
+        stats = embedding_cache.stats()
+        self.assertEqual(
+            (stats["memory_hits"], stats["disk_hits"], stats["misses"]),
+            (2, 0, 3))
+        self.assertAlmostEqual(stats["hit_rate"], 2 / 5)
+
+
+class BenchmarkEmbeddingCacheTests(SimpleTestCase):
+
+    def test_isolated_cache_skips_disk_tier(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+                EMBEDDING_CACHE_PATH=f"{directory}/embeddings.sqlite3"):
+            shared = embeddings.get_cache()
+            with mock.patch.object(
+                    embeddings, "encode_texts",
+                    side_effect=lambda texts: np.ones(
+                        (len(texts), embeddings.EMBEDDING_DIM),
+                        dtype=np.float32)) as encode:
+                with isolated_embedding_cache(["q1", "q2"]) as cache:
+                    self.assertIs(embeddings.get_cache(), cache)
+                    self.assertIsNone(cache.path)
+                    embeddings.embed_texts(["q1", "q2"])
+                    self.assertEqual(cache.stats()["memory_hits"], 2)
+                encode.assert_called_once_with(["q1", "q2"])
+            self.assertIs(embeddings.get_cache(), shared)
+
+
+# ==================================================
+# 📦 Prompt packing
+# ==================================================
+def prose(tokens, word="abc"):
+    """
+    Text estimated at exactly `tokens` tokens (4 characters each).
+    """
+    return " ".join([word] * tokens)[:tokens * CHARS_PER_TOKEN - 1] + "."
+
+
+class PromptPackerTests(SimpleTestCase):
+
+    def test_count_tokens_estimate(self):
+        self.assertEqual(count_tokens(""), 0)
+        self.assertEqual(count_tokens("abc"), 1)
+        self.assertEqual(count_tokens("abcd"), 1)
+        self.assertEqual(count_tokens("abcde"), 2)
+        self.assertEqual(count_tokens(prose(100)), 100)
+
+    def test_truncate_cuts_on_word_boundary(self):
+        text = "alpha beta gamma delta"
+        self.assertEqual(truncate_to_tokens(text, 100), text)
+        self.assertEqual(truncate_to_tokens(text, 3), "alpha beta")
+        self.assertEqual(truncate_to_tokens(text, 0), "")
+
+    def test_priority_question_then_chunks_then_history(self):
+        packed = pack_prompt(prose(50),
+                             [prose(100, "one"), prose(100, "two")],
+                             [prose(100, "new"), prose(100, "old")],
+                             budget=300)
+
+        self.assertEqual(packed.message, prose(50))
+        self.assertEqual(packed.chunks_used, 2)
+        self.assertIn("one", packed.document_text)
+        # 50 tokens left: below MIN_TRUNCATED_TOKENS, so no history at all
+        self.assertEqual((packed.turns_used, packed.turns_dropped), (0, 2))
+        self.assertEqual(packed.history_text, "")
+
+    def test_question_is_kept_over_everything_else(self):
+        packed = pack_prompt(prose(500), [prose(100)], [prose(100)],
+                             budget=200)
+
+        self.assertEqual(packed.tokens["question"], 200)
+        self.assertEqual(packed.chunks_used, 0)
+        self.assertEqual(packed.turns_used, 0)
+
+    def test_min_truncated_tokens(self):
+        # Exactly MIN_TRUNCATED_TOKENS left: the second chunk is truncated
+        packed = pack_prompt(prose(10),
+                             [prose(100), prose(200, "two")],
+                             [],
+                             budget=110 + MIN_TRUNCATED_TOKENS)
+        self.assertEqual(packed.chunks_used, 2)
+        self.assertLessEqual(packed.tokens["document"],
+                             100 + MIN_TRUNCATED_TOKENS)
+
+        # One token fewer: it's dropped instead
+        packed = pack_prompt(prose(10),
+                             [prose(100), prose(200, "two")],
+                             [],
+                             budget=109 + MIN_TRUNCATED_TOKENS)
+        self.assertEqual((packed.chunks_used, packed.chunks_dropped), (1, 1))
+        self.assertNotIn("two", packed.document_text)
+
+    def test_history_newest_first_rendered_oldest_first(self):
+        packed = pack_prompt("Hi", [], ["User: newer\n", "User: older\n",
+                                        prose(1000)],
+                             budget=100)
+
+        self.assertEqual((packed.turns_used, packed.turns_dropped), (3, 0))
+        self.assertTrue(packed.history_text.endswith(
+            "User: older\nUser: newer\n"))
+
+    def test_total_never_exceeds_budget(self):
+        for budget in (50, 64, 100, 333, 1000):
+            with self.subTest(budget=budget):
+                packed = pack_prompt(prose(40),
+                                     [prose(90), prose(70), prose(300)],
+                                     [prose(80), prose(120)],
+                                     overhead_text=prose(20),
+                                     budget=budget)
+                self.assertLessEqual(packed.total_tokens, budget)
+                self.assertEqual(packed.tokens["template"], 20)
+
+
+# ==================================================
+# 🏅 Reranking
+# ==================================================
+class FakeCrossEncoder:
+    """
+    Scores a chunk by its number; remembers each batch size.
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, pairs, batch_size, show_progress_bar):
+        self.batches.append(len(pairs))
+        return [float(text.split()[-1]) for _, text in pairs]
+
+
+class RerankerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.model = FakeCrossEncoder()
+        self.reranker = Reranker()
+        self.reranker._model = self.model
+        self.hits = [search_hit(1, index, 1.0, text=f"chunk {index}")
+                     for index in range(50)]
+
+    def test_first_budgeted_pass_is_capped(self):
+        hits, reranked = self.reranker.rerank("question", self.hits, top_k=4,
+                                              budget=0.15)
+
+        self.assertTrue(reranked)
+        self.assertEqual(self.model.batches, [FIRST_PASS_PAIRS])
+        self.assertEqual([hit.chunk_id for hit in hits],
+                         list(range(FIRST_PASS_PAIRS - 1,
+                                    FIRST_PASS_PAIRS - 5, -1)))
+        self.assertIsNotNone(self.reranker.seconds_per_pair)
+
+    def test_first_pass_covers_min_hits(self):
+        self.reranker.rerank("question", self.hits, top_k=4, budget=0.15,
+                             min_hits=FIRST_PASS_PAIRS + 2)
+        self.assertEqual(self.model.batches, [FIRST_PASS_PAIRS + 2])
+
+    def test_measured_rate_sets_the_limit(self):
+        self.reranker.seconds_per_pair = 0.01
+        self.reranker.rerank("question", self.hits, top_k=4, budget=0.2)
+        self.assertEqual(self.model.batches, [20])
+
+    def test_no_budget_scores_everything(self):
+        hits, reranked = self.reranker.rerank("question", self.hits, top_k=4)
+
+        self.assertTrue(reranked)
+        self.assertEqual(self.model.batches, [50])
+        self.assertEqual([hit.chunk_id for hit in hits], [49, 48, 47, 46])
+
+    def test_cached_pairs_dont_count_against_budget(self):
+        self.reranker.rerank("question", self.hits, top_k=4, budget=0.15)
+        self.reranker.seconds_per_pair = 0.01
+        self.reranker.rerank("question", self.hits, top_k=4, budget=0.05)
+
+        # 8 cached + 5 affordable
+        self.assertEqual(self.model.batches, [FIRST_PASS_PAIRS, 5])
+
+
+class StreamingCleanerTests(SimpleTestCase):
+
+    CASES = [
+        "# Title\n\nSome **bold** and *italic* text.\n- item one\n- item two",
+        "Intro\n#\n\n   Body after a bare heading",
+        "**#**\n\nstill a heading\n##\n# nested",
+        "line one<br\n>line two<br />three",
+        "| a | b |\n|---|---|\n| 1 | 2 |\nafter the table",
+        "keep # this\n  # not a heading\n\n\n\nend  ",
+    ]
+
+    def stream(self, text, size):
+        cleaner = StreamingCleaner()
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        return "".join(cleaner.feed(chunk)
+                       for chunk in chunks) + cleaner.flush()
+
+    def test_chunked_output_matches_batch(self):
+        for text in self.CASES:
+            for size in (1, 2, 3, 5, len(text)):
+                with self.subTest(text=text, size=size):
+                    self.assertEqual(self.stream(text, size),
+                                     clean_llm_output(text))
+
+    def test_plain_text_is_released_before_newline(self):
+        cleaner = StreamingCleaner()
+        self.assertEqual(cleaner.feed("Hello wor"), "Hello wor")
+        self.assertEqual(cleaner.feed("ld **bo"), "")
+        self.assertEqual(cleaner.feed("ld**\n"), "ld bold")
+
+
+def history(*turns, summary=""):
+    text = f"Summary of earlier conversation:\n{summary}\n" if summary else ""
+    return text + "".join(f"User: {question}\nBot: {answer}\n"
+                          for question, answer in turns)
+
+
+class ReplyCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        caches["llm_responses"].clear()
+
+    def test_key_uses_only_recent_turns(self):
+        older = history(("hi", "hello"),
+                        ("my name is Ann", "Nice to meet you"),
+                        summary="Small talk")
+        newer = history(("what's up", "not much"),
+                        ("my name is Ann", "Nice to meet you"))
+        self.assertEqual(recent_history(older, 1),
+                         "User: my name is Ann\nBot: Nice to meet you\n")
+        self.assertEqual(recent_history(older, 0), "")
+        self.assertEqual(recent_history(older, 5), older)
+
+        def key(history_text, turns):
+            return response_cache_key("model", "What is my name?",
+                                      history_text=history_text,
+                                      history_turns=turns)
+
+        self.assertEqual(key(older, 1), key(newer, 1))
+        self.assertNotEqual(key(older, 2), key(newer, 2))
+        self.assertNotEqual(key(older, None), key(newer, None))
+
+    @mock.patch("chatbotapp.gemini.get_client")
+    def test_document_question_hits_across_conversations(self, get_client):
+        create = get_client.return_value.chat.completions.create
+        create.return_value.choices = [
+            mock.Mock(message=mock.Mock(content="The budget is $5k."))
+        ]
+        create.return_value.usage = None
+
+        for turns in ([("hi", "hello")], [("summarize", "It is a plan.")]):
+            reply = get_ai_reply("What is the budget?",
+                                 history_text=history(*turns),
+                                 document_text="Budget: $5k")
+            self.assertEqual(reply, "The budget is $5k.")
+        create.assert_called_once()
+
+        # Other document context: a new key
+        get_ai_reply("What is the budget?", document_text="Budget: $9k")
+        self.assertEqual(create.call_count, 2)
+
+
+# ==================================================
+# 📥 Ingestion job failures and recovery
+# ==================================================
+class IngestionRecoveryTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("dave", password="x")
+        self.store = SimpleVectorStore(dim=4)
+        patcher = mock.patch("chatbotapp.ingestion.GLOBAL_VECTOR_STORE",
+                             self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def job(self, **fields):
+        document = Document.objects.create(user=self.user,
+                                           file="documents/report.txt")
+        return IngestionJob.objects.create(document=document, **fields)
+
+    def publish(self, document_id):
+        self.store.add_texts(["first batch"],
+                             document_id=document_id,
+                             user_id=self.user.id,
+                             embeddings=unit_vectors(0))
+
+    def test_failed_job_removes_published_chunks(self):
+        job = self.job()
+
+        def ingest_partly(user, uploaded_file, document_id, progress):
+            self.publish(document_id)
+            raise RuntimeError("extractor crashed")
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+                MEDIA_ROOT=media_root), mock.patch(
+                    "chatbotapp.ingestion.ingest_document", ingest_partly):
+            job.document.file.save("report.txt", ContentFile(b"text"))
+            self.assertEqual(claim_next_job(), job)
+            self.assertFalse(run_job(IngestionJob.objects.get(id=job.id)))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(self.store.get_partition(job.document_id))
+
+    def test_stale_jobs_are_requeued_until_max_attempts(self):
+        long_ago = timezone.now() - timedelta(hours=1)
+        retry = self.job(status="running", started_at=long_ago, attempts=1)
+        give_up = self.job(status="running", started_at=long_ago, attempts=3)
+        fresh = self.job(status="running",
+                         started_at=timezone.now(),
+                         attempts=1)
+        for job in (retry, give_up, fresh):
+            self.publish(job.document_id)
+
+        self.assertEqual(
+            requeue_stale_jobs(timedelta(minutes=30), max_attempts=3), (1, 1))
+
+        statuses = {
+            job.id: job.status
+            for job in IngestionJob.objects.all()
+        }
+        self.assertEqual(statuses, {
+            retry.id: "queued",
+            give_up.id: "failed",
+            fresh.id: "running",
+        })
+        self.assertIsNone(self.store.get_partition(retry.document_id))
+        self.assertIsNone(self.store.get_partition(give_up.document_id))
+        self.assertIsNotNone(self.store.get_partition(fresh.document_id))
+
+        # The requeued job is claimed again
+        self.assertEqual(claim_next_job().attempts, 2)
+
+
+# ==================================================
+# ✂️ Token-aware chunking
+# ==================================================
+class ChunkerTests(SimpleTestCase):
+
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        words = ["budget", "roadmap", "hiring", "quarterly", "infrastructure",
+                 "a", "the", "of", "internationalization", "Q3", "2026"]
+        self.pages = []
+        for _ in range(6):
+            sentences = [
+                " ".join(random_state.choice(words, random_state.randint(
+                    4, 15))) + random_state.choice([".", "!", ",", ""])
+                for _ in range(30)
+            ]
+            self.pages.append(" ".join(sentences))
+        self.document = "\n".join(self.pages)
+
+    def spans(self, **kwargs):
+        return list(iter_spans(iter(self.pages), **kwargs))
+
+    @staticmethod
+    def tokens(text):
+        return sum(estimate_tokens(token) for token in _TOKEN.findall(text))
+
+    def test_spans_map_back_to_the_source_text(self):
+        for span in self.spans(max_tokens=40, overlap_tokens=8):
+            self.assertEqual(span.text, self.document[span.start:span.end])
+
+    def test_spans_cover_the_text_in_order(self):
+        spans = self.spans(max_tokens=40, overlap_tokens=8)
+        covered = np.zeros(len(self.document), dtype=bool)
+        for previous, span in zip(spans, spans[1:]):
+            self.assertLess(previous.start, span.start)
+            self.assertLessEqual(span.start, previous.end + 1)
+        for span in spans:
+            covered[span.start:span.end] = True
+        for token in _TOKEN.finditer(self.document):
+            self.assertTrue(covered[token.start():token.end()].all())
+
+    def test_chunks_stay_within_the_token_limit(self):
+        for max_tokens in (20, 40, 200):
+            with self.subTest(max_tokens=max_tokens):
+                spans = self.spans(max_tokens=max_tokens, overlap_tokens=8)
+                self.assertTrue(spans)
+                for span in spans:
+                    self.assertLessEqual(self.tokens(span.text), max_tokens)
+
+    def test_consecutive_chunks_overlap(self):
+        spans = self.spans(max_tokens=40, overlap_tokens=8)
+        for previous, span in zip(spans, spans[1:]):
+            shared = self.document[span.start:previous.end]
+            self.assertGreater(span.start, previous.start)
+            self.assertLessEqual(self.tokens(shared), 8)
+        self.assertTrue(
+            any(span.start < previous.end
+                for previous, span in zip(spans, spans[1:])))
+        # Without overlap chunks only abut
+        spans = self.spans(max_tokens=40, overlap_tokens=0)
+        for previous, span in zip(spans, spans[1:]):
+            self.assertGreaterEqual(span.start, previous.end)
+
+    def test_overlap_must_be_smaller_than_chunks(self):
+        with self.assertRaises(ValueError):
+            self.spans(max_tokens=8, overlap_tokens=8)
+
+
+# ==================================================
+# ♻️ Near-duplicate chunks
+# ==================================================
+class DedupIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        vocabulary = [f"word{index}" for index in range(500)]
+
+        def text():
+            return " ".join(random_state.choice(vocabulary, 200))
+
+        self.text = text()
+        words = self.text.split()
+        # One word changed: ~97% of the 5-word shingles are shared
+        self.near_duplicate = " ".join(words[:-1] + ["changed"])
+        # A fifth of the words changed: well under the threshold
+        self.revised = " ".join(
+            word if index % 5 else "edited"
+            for index, word in enumerate(words))
+        self.other = text()
+
+    def test_near_duplicates_at_the_threshold(self):
+        signature = minhash(self.text)
+        self.assertGreaterEqual(
+            similarity(signature, minhash(self.near_duplicate)), 0.9)
+        self.assertLess(similarity(signature, minhash(self.revised)), 0.9)
+
+        index = DedupIndex(threshold=0.9)
+        index.add((1, 0), signature)
+        self.assertEqual(index.find(minhash(self.near_duplicate)), (1, 0))
+        self.assertIsNone(index.find(minhash(self.revised)))
+        self.assertIsNone(index.find(minhash(self.other)))
+
+    def test_duplicates_become_aliases_of_canonical_rows(self):
+        index = DedupIndex(threshold=0.9)
+        kept, aliases = index.deduplicate([self.text, self.other],
+                                          document_id=1,
+                                          first_row=0)
+        self.assertEqual((kept, aliases), ([0, 1], []))
+
+        # Against stored rows and earlier chunks of the same batch
+        kept, aliases = index.deduplicate(
+            [self.revised, self.near_duplicate, self.revised, self.other],
+            document_id=2,
+            first_row=5)
+        self.assertEqual(kept, [0])
+        self.assertEqual(aliases, [(1, 0), (2, 5), (1, 1)])
+        self.assertEqual(index.chunks_saved, 3)
+
+    @mock.patch("chatbotapp.rag.vectorstore.embed_texts",
+                lambda texts: np.ones((len(texts), 4), dtype=np.float32))
+    def test_deleting_the_canonical_document_keeps_the_aliases(self):
+        store = SimpleVectorStore(dim=4)
+        index = DedupIndex(threshold=0.9)
+        for document_id, texts in ((1, [self.text, self.other]),
+                                   (2, [self.near_duplicate, self.revised])):
+            kept, aliases = index.deduplicate(texts,
+                                              document_id=document_id,
+                                              first_row=0)
+            store.add_texts([texts[i] for i in kept],
+                            document_id=document_id,
+                            user_id=1,
+                            embeddings=unit_vectors(*range(len(kept))),
+                            aliases=aliases)
+        self.assertEqual(store.get_partition(2).aliases, [(1, 0)])
+
+        store.delete_document(1)
+        self.assertCountEqual(
+            [hit.text for hit in store.similarity_search(
+                "query", top_k=10, document_id=2)],
+            [self.text, self.revised])
+
+        # The index forgets document 1; a new duplicate aliases the copy
+        # document 2 now holds
+        index.catch_up(store.user_partitions(1))
+        canonical = index.find(minhash(self.near_duplicate))
+        self.assertEqual(canonical[0], 2)
+        self.assertEqual(store.get_partition(2).text(canonical[1]), self.text)
+
+
+# ==================================================
+# 💾 Segment store persistence
+# ==================================================
+@mock.patch("chatbotapp.rag.vectorstore.embed_texts",
+            lambda texts: np.tile(np.array([1.0, 0.6, 0.3, 0.1]),
+                                  (len(texts), 1)))
+class SegmentPersistenceTests(SimpleTestCase):
+
+    def add(self, store, document_id, texts, user_id=1):
+        random_state = np.random.RandomState(document_id)
+        store.add_texts(texts,
+                        document_id=document_id,
+                        user_id=user_id,
+                        metadata={"filename": f"doc{document_id}.txt"},
+                        embeddings=random_state.randn(len(texts), 4))
+
+    @staticmethod
+    def results(store, **kwargs):
+        return [(hit.document_id, hit.chunk_id, hit.text,
+                 round(hit.score, 5))
+                for hit in store.similarity_search("query", top_k=5, **kwargs)]
+
+    def test_reopened_store_returns_the_same_results(self):
+        with tempfile.TemporaryDirectory() as directory:
+            writer = SegmentVectorStore(directory, dim=4)
+            self.add(writer, 1, ["alpha", "beta", "gamma"])
+            self.add(writer, 1, ["delta"])
+            self.add(writer, 2, ["epsilon", "zeta"])
+            self.add(writer, 3, ["other user"], user_id=2)
+            writer.delete_document(2)
+
+            reader = SegmentVectorStore(directory, dim=4)
+            for kwargs in ({"document_id": 1}, {"user_id": 1},
+                           {"user_id": 2}):
+                with self.subTest(**kwargs):
+                    self.assertEqual(self.results(reader, **kwargs),
+                                     self.results(writer, **kwargs))
+            self.assertEqual(len(reader.get_partition(1)), 4)
+            self.assertEqual(reader.get_partition(1).metadata["filename"],
+                             "doc1.txt")
+            self.assertIsNone(reader.get_partition(2))
+
+    def test_open_store_picks_up_later_segments(self):
+        with tempfile.TemporaryDirectory() as directory:
+            writer = SegmentVectorStore(directory, dim=4)
+            reader = SegmentVectorStore(directory, dim=4)
+            self.assertEqual(self.results(reader, user_id=1), [])
+
+            self.add(writer, 1, ["alpha", "beta"])
+            self.assertEqual(self.results(reader, user_id=1),
+                             self.results(writer, user_id=1))
+
+            writer.delete_document(1)
+            self.assertEqual(self.results(reader, user_id=1), [])
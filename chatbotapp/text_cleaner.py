@@ -29,3 +29,141 @@ def clean_llm_output(text: str) -> str:
     text = re.sub(r"\n{3,}", "\n\n", text)
 
     return text.strip()
+
+
+# clean_llm_output rules, as used by the streaming cleaner
+_HEADING = re.compile(r"#+\s*")
+_TABLE = re.compile(r"\|.*\|")
+_BREAK = re.compile(r"<br\s*/?>")
+# The start of a <br> tag that more text could still complete
+_PARTIAL_BREAK = re.compile(r"<(b(r\s*/?)?)?\Z")
+_BULLETS = re.compile(r"[-•]+")
+_LEADING_SPACE = re.compile(r"\s*")
+
+
+def _strip_emphasis(text: str) -> str:
+    text = re.sub(r"\*\*(.*?)\*\*", r"\1", text)
+    return re.sub(r"\*(.*?)\*", r"\1", text)
+
+
+class StreamingCleaner:
+    """
+    Incremental version of clean_llm_output for streamed LLM deltas.
+
+    The batch rules run as a chain of stages in the same order, each
+    holding back only the text a later delta could still change:
+    emphasis and headings hold the unfinished line if it has a "*" or
+    starts with "#", tables hold it if it has a "|", and <br> holds a
+    possible unfinished tag. A bare heading marker also swallows the
+    newline and whitespace after it, and <br\\n> spans lines, as in the
+    batch regexes. Leading/trailing whitespace and 3+ newlines are
+    normalized across deltas the same way.
+    """
+
+    def __init__(self):
+        self._line = ""
+        self._at_line_start = True
+        self._skip_space = False
+        self._table_line = ""
+        self._tag = ""
+        self._held_whitespace = ""
+        self._started = False
+
+    def _headings(self, text: str, final=False) -> str:
+        """
+        Emphasis and heading rules (both need the whole line).
+        """
+        self._line += text
+        cleaned = []
+        while True:
+            if "\n" in self._line:
+                line, rest = self._line.split("\n", 1)
+            elif self._line and (final or not (
+                    "*" in self._line or
+                    (self._at_line_start and self._line.startswith("#")))):
+                line, rest = self._line, None
+            else:
+                break
+            self._line = rest or ""
+            line = _strip_emphasis(line)
+
+            if self._skip_space:
+                skipped = _LEADING_SPACE.match(line).end()
+                if skipped:
+                    # `^` only matches again right after a newline
+                    self._at_line_start = False
+                    line = line[skipped:]
+                if not line:
+                    if rest is not None:
+                        self._at_line_start = True
+                    continue
+                self._skip_space = False
+
+            if self._at_line_start:
+                heading = _HEADING.match(line)
+                if heading and heading.end() == len(line) and rest is not None:
+                    # `^#+\s*` runs on through the newline
+                    self._skip_space = True
+                    continue
+                if heading:
+                    line = line[heading.end():]
+
+            if rest is None:
+                cleaned.append(line)
+                self._at_line_start = False
+                break
+            cleaned.append(line + "\n")
+            self._at_line_start = True
+
+        return "".join(cleaned)
+
+    def _tables(self, text: str, final=False) -> str:
+        self._table_line += text
+        head, newline, tail = self._table_line.rpartition("\n")
+        if "|" in tail and not final:
+            ready, self._table_line = head + newline, tail
+        else:
+            ready, self._table_line = self._table_line, ""
+        return _TABLE.sub("", ready)
+
+    def _breaks(self, text: str, final=False) -> str:
+        """
+        <br> tags and bullet symbols.
+        """
+        text = self._tag + text
+        held = None if final else _PARTIAL_BREAK.search(text)
+        if held:
+            text, self._tag = text[:held.start()], text[held.start():]
+        else:
+            self._tag = ""
+        return _BULLETS.sub("", _BREAK.sub("\n", text))
+
+    def _emit(self, cleaned: str) -> str:
+        text = self._held_whitespace + cleaned
+        if not self._started:
+            text = text.lstrip()
+        text = re.sub(r"\n{3,}", "\n\n", text)
+
+        # Hold trailing whitespace back so the final output is stripped
+        visible = text.rstrip()
+        self._held_whitespace = text[len(visible):]
+        if visible:
+            self._started = True
+        return visible
+
+    def feed(self, delta: str) -> str:
+        """
+        Add a raw delta and return the cleaned text that is now final.
+        """
+        return self._emit(
+            self._breaks(self._tables(self._headings(delta or ""))))
+
+    def flush(self) -> str:
+        """
+        Return whatever is left once the stream has ended.
+        """
+        # Trailing whitespace stays held back, i.e. is stripped
+        return self._emit(
+            self._breaks(
+                self._tables(self._headings("", final=True), final=True),
+                final=True))
@@ -0,0 +1,85 @@
+"""
+Per-stage timing of the chat and RAG hot paths.
+
+    with timed("history"):
+        ...
+
+    @timed("retrieve_context")
+    def retrieve_context(...):
+
+Every timed block is observed in the stage_seconds{stage=...} histogram
+(served by the metrics endpoint). Inside a request the stages are also
+collected for ServerTimingMiddleware, which reports them in the
+Server-Timing response header.
+"""
+
+import contextvars
+import functools
+import time
+from contextlib import ContextDecorator
+
+from asgiref.sync import iscoroutinefunction
+
+from . import metrics
+
+# [(stage, seconds)] of the current request; None outside requests
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request():
+    """
+    Collect stages for a new request; returns the token for end_request.
+    """
+    return _request_timings.set([])
+
+
+def end_request(token):
+    """
+    Stop collecting; returns the request's [(stage, seconds)].
+    """
+    timings = _request_timings.get()
+    _request_timings.reset(token)
+    return timings or []
+
+
+class timed(ContextDecorator):  # pylint: disable=invalid-name
+    """
+    Time a block or a function (sync or async) as one stage.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.started = None
+
+    def _recreate_cm(self):
+        # A fresh timer per call, so decorated functions are reentrant
+        return timed(self.stage)
+
+    def __call__(self, func):
+        if not iscoroutinefunction(func):
+            return super().__call__(func)
+
+        @functools.wraps(func)
+        async def inner(*args, **kwargs):
+            with self._recreate_cm():
+                return await func(*args, **kwargs)
+
+        return inner
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+def record(stage, seconds):
+    metrics.observe("stage_seconds",
+                    seconds,
+                    labels={"stage": stage},
+                    help_text="Seconds spent in each chat / RAG stage")
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -11,5 +12,19 @@ urlpatterns = [
     views.delete_conversation,
     name="delete_conversation"
 ),
+    # ASGI servers get the async view; WSGI keeps the sync one
+    path("chat/<int:conversation_id>/stream/",
+         views.achat_stream if settings.ASYNC_CHAT else views.chat_stream,
+         name="chat_stream"),
+    path("chat/<int:conversation_id>/messages/",
+         views.conversation_messages,
+         name="conversation_messages"),
+    path("conversations/",
+         views.conversation_list,
+         name="conversation_list"),
+    path("documents/<int:document_id>/status/",
+         views.document_status,
+         name="document_status"),
+    path("metrics/", views.metrics_endpoint, name="metrics"),
 
 ]
@@ -1,13 +1,28 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
-from django.shortcuts import get_object_or_404, redirect, render
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import (aget_object_or_404, get_object_or_404, redirect,
+                              render)
+from django.urls import reverse
 from django.views.decorators.http import require_POST
-from chatbotapp.text_cleaner import clean_llm_output
-
-from chatbotapp.rag.rag_pipeline import ingest_document, retrieve_context
-from .gemini import get_ai_reply
-from .models import ChatMessage, Conversation, Document
+from chatbotapp.text_cleaner import StreamingCleaner, clean_llm_output
+
+from chatbotapp.rag.rag_pipeline import aretrieve_context, retrieve_context
+from .document_aliases import build_alias_index, resolve_document_aliases
+from .gemini import (astream_ai_reply, build_prompt, get_ai_reply,
+                     stream_ai_reply)
+from .ingestion import enqueue_document
+from .metrics import render_prometheus
+from .models import ChatMessage, Conversation, Document, IngestionJob
+from .pagination import keyset_page
+from .prompt_packer import pack_prompt
+from .summaries import format_summary, format_turn, schedule_summary_update
+from .timing import timed
+import hmac
+import json
 import re
 
 
@@ -27,50 +42,150 @@ def extract_word_limit(message: str):
 # ==================================================
 # 🧠 HELPER — Resolve which document user means
 # ==================================================
-def resolve_target_document_id(conversation, user_msg):
-    user_msg = user_msg.lower()
+@timed("resolve_documents")
+def resolve_target_document_ids(conversation, user_msg):
+    # 1️⃣ Ordinals / 2️⃣ filenames matched against the cached alias index;
+    # "compare the first and second document" names several
+    document_ids = resolve_document_aliases(
+        conversation.id, user_msg, version=conversation.active_document_id)
+    if document_ids:
+        return document_ids
 
-    # Get document messages IN ORDER
-    document_messages = (ChatMessage.objects.filter(
-        conversation=conversation,
-        message_type="document",
-        document__isnull=False).select_related("document").order_by(
-            "created_at"))
+    # 3️⃣ Fallback → active document
+    if conversation.active_document_id is not None:
+        return [conversation.active_document_id]
+    return []
 
-    if not document_messages.exists():
-        return conversation.active_document_id
 
-    documents = [msg.document for msg in document_messages]
+# ==================================================
+# 💬 HELPERS — Build prompt context / save a turn
+# ==================================================
+@timed("pack_prompt")
+def pack_chat_context(conversation, user_msg, history, chunks):
+    """
+    Fit question, chunks (best first) and history (newest first, then the
+    rolling summary) into the prompt token budget. Returns
+    (enforced_prompt, history_text, document_context).
+    """
+    history_turns = [format_turn(chat) for chat in history]
+    if conversation.summary:
+        history_turns.append(format_summary(conversation.summary))
+
+    packed = pack_prompt(message=enforce_prompt(user_msg),
+                         chunks=chunks,
+                         history_turns=history_turns,
+                         overhead_text=build_prompt("", "", "x"))
+    return packed.message, packed.history_text, packed.document_text
+
+
+def enforce_prompt(user_msg):
+    word_limit = extract_word_limit(user_msg)
+
+    # 🔥 FORCE CHATGPT-STYLE EXPLANATION
+    if "explain" in user_msg.lower():
+        return (
+            "You are an expert AI assistant.\n\n"
+            "Explain the document in a clear, detailed, and conversational manner.\n"
+            "- Expand on key ideas\n"
+            "- Add context and reasoning\n"
+            "- Use natural paragraphs (no bullet points, no markdown symbols)\n"
+            "- Write like ChatGPT explaining to a human\n\n"
+            f"User request: {user_msg}")
+
+    if word_limit:
+        return (f"{user_msg}\n\n"
+                f"STRICT INSTRUCTION:\n"
+                f"- Write a complete story\n"
+                f"- Use EXACTLY {word_limit} words\n"
+                f"- Do NOT exceed or fall below the limit\n")
+
+    return user_msg
+
+
+def history_queryset(conversation):
+    # Chat history not yet folded into the summary (no document rows),
+    # newest first
+    history = ChatMessage.objects.filter(conversation=conversation,
+                                         message_type="text")
+    if conversation.summary_until:
+        history = history.filter(created_at__gt=conversation.summary_until)
+    return history.order_by("-created_at")[:8]
+
+
+def build_chat_context(conversation, user, user_msg):
+    """
+    Returns (enforced_prompt, history_text, document_context)
+    for one chat turn.
+    """
+    with timed("history"):
+        history = list(history_queryset(conversation))
 
-    # 1️⃣ Ordinal resolution
-    ordinals = {
-        "first": 0,
-        "second": 1,
-        "third": 2,
-        "fourth": 3,
-    }
+    # 🧠 Resolve document(s) explicitly
+    target_document_ids = resolve_target_document_ids(conversation, user_msg)
 
-    for word, index in ordinals.items():
-        if f"{word} document" in user_msg:
-            if index < len(documents):
-                return documents[index].id
+    chunks = []
+    if target_document_ids:
+        chunks = retrieve_context(question=user_msg,
+                                  document_ids=target_document_ids,
+                                  user_id=user.id,
+                                  top_k=8)
 
-    # 2️⃣ Filename match
-    for doc in documents:
-        filename = doc.file.name.lower().split("/")[-1]
-        name_no_ext = filename.replace(".pdf",
-                                       "").replace(".docx",
-                                                   "").replace("_", " ")
+    return pack_chat_context(conversation, user_msg, history, chunks)
 
-        if name_no_ext in user_msg:
-            return doc.id
 
-        for token in name_no_ext.split():
-            if len(token) > 4 and token in user_msg:
-                return doc.id
+async def abuild_chat_context(conversation, user, user_msg):
+    """
+    Async build_chat_context: async ORM for history, retrieval on the
+    retrieval thread pool.
+    """
+    with timed("history"):
+        history = [chat async for chat in history_queryset(conversation)]
 
-    # 3️⃣ Fallback → active document
-    return conversation.active_document.id if conversation.active_document else None
+    target_document_ids = await sync_to_async(resolve_target_document_ids)(
+        conversation, user_msg)
+
+    chunks = []
+    if target_document_ids:
+        chunks = await aretrieve_context(question=user_msg,
+                                         document_ids=target_document_ids,
+                                         user_id=user.id,
+                                         top_k=8)
+
+    return pack_chat_context(conversation, user_msg, history, chunks)
+
+
+@timed("save_turn")
+def save_chat_turn(conversation, user, user_msg, bot_reply):
+    message = ChatMessage.objects.create(conversation=conversation,
+                                         user=user,
+                                         message_type="text",
+                                         user_message=user_msg,
+                                         bot_reply=bot_reply)
+
+    if conversation.title == "New chat":
+        conversation.title = user_msg[:40]
+        conversation.save(update_fields=["title"])
+
+    schedule_summary_update(conversation.id)
+
+    return message
+
+
+@timed("save_turn")
+async def asave_chat_turn(conversation, user, user_msg, bot_reply):
+    message = await ChatMessage.objects.acreate(conversation=conversation,
+                                                user=user,
+                                                message_type="text",
+                                                user_message=user_msg,
+                                                bot_reply=bot_reply)
+
+    if conversation.title == "New chat":
+        conversation.title = user_msg[:40]
+        await conversation.asave(update_fields=["title"])
+
+    schedule_summary_update(conversation.id)
+
+    return message
 
 
 # ==================================================
@@ -123,15 +238,17 @@ def home(request, conversation_id=None):
             conversation.active_document_id = document.id
             conversation.save(update_fields=["active_document_id"])
 
-            ingest_document(user=user,
-                            uploaded_file=uploaded_file,
-                            document_id=document.id)
+            # Indexed in the background by `process_ingestion_jobs`;
+            # chunks become searchable as they are published
+            enqueue_document(document)
 
             ChatMessage.objects.create(conversation=conversation,
                                        user=user,
                                        message_type="document",
                                        uploaded_file_name=uploaded_file.name,
                                        document=document)
+            build_alias_index(conversation.id,
+                              version=conversation.active_document_id)
 
             return redirect("conversation", conversation_id=conversation.id)
 
@@ -141,89 +258,266 @@ def home(request, conversation_id=None):
         user_msg = request.POST.get("message", "").strip()
 
         if user_msg:
-            # Chat history (no document rows)
-            history_qs = (ChatMessage.objects.filter(
-                conversation=conversation).exclude(
-                    message_type="document").order_by("-created_at")[:8])
-
-            history_text = ""
-            for chat in reversed(history_qs):
-                history_text += f"User: {chat.user_message}\n"
-                history_text += f"Bot: {chat.bot_reply}\n"
-
-            # 🧠 Resolve document explicitly
-            target_document_id = resolve_target_document_id(
-                conversation, user_msg)
-
-            document_context = ""
-            if target_document_id is not None:
-                chunks = retrieve_context(question=user_msg,
-                                          document_id=target_document_id,
-                                          top_k=8)
-                if chunks:
-                    document_context = "\n\n".join(chunks)
-
-            word_limit = extract_word_limit(user_msg)
-
-            word_limit = extract_word_limit(user_msg)
-
-            # 🔥 FORCE CHATGPT-STYLE EXPLANATION
-            if "explain" in user_msg.lower():
-                enforced_prompt = (
-                    "You are an expert AI assistant.\n\n"
-                    "Explain the document in a clear, detailed, and conversational manner.\n"
-                    "- Expand on key ideas\n"
-                    "- Add context and reasoning\n"
-                    "- Use natural paragraphs (no bullet points, no markdown symbols)\n"
-                    "- Write like ChatGPT explaining to a human\n\n"
-                    f"User request: {user_msg}")
-
-            elif word_limit:
-                enforced_prompt = (
-                    f"{user_msg}\n\n"
-                    f"STRICT INSTRUCTION:\n"
-                    f"- Write a complete story\n"
-                    f"- Use EXACTLY {word_limit} words\n"
-                    f"- Do NOT exceed or fall below the limit\n")
-
-            else:
-                enforced_prompt = user_msg
-
-            raw_reply = get_ai_reply(message=enforced_prompt,
-                                     history_text=history_text,
-                                     document_text=document_context)
-
-            bot_reply = clean_llm_output(raw_reply)
+            enforced_prompt, history_text, document_context = (
+                build_chat_context(conversation, user, user_msg))
 
-            ChatMessage.objects.create(conversation=conversation,
-                                       user=user,
-                                       message_type="text",
-                                       user_message=user_msg,
-                                       bot_reply=bot_reply)
+            raw_reply = get_ai_reply(
+                message=enforced_prompt,
+                history_text=history_text,
+                document_text=document_context)
 
-            if conversation.title == "New chat":
-                conversation.title = user_msg[:40]
-                conversation.save(update_fields=["title"])
+            with timed("clean_output"):
+                bot_reply = clean_llm_output(raw_reply)
+
+            save_chat_turn(conversation, user, user_msg, bot_reply)
 
         return redirect("conversation", conversation_id=conversation.id)
 
     # ==================================================
     # Load UI
     # ==================================================
-    conversations = (Conversation.objects.filter(
-        user=user).order_by("-created_at"))
+    # Only the latest page of each; older rows are fetched as the user
+    # scrolls (see conversation_messages / conversation_list)
+    conversations, conversations_cursor = keyset_page(
+        conversations_queryset(user),
+        limit=settings.CONVERSATION_PAGE_SIZE)
 
-    chat_history = (ChatMessage.objects.filter(
-        conversation=conversation).order_by("created_at"))
+    chat_history, history_cursor = keyset_page(
+        messages_queryset(conversation), limit=settings.CHAT_PAGE_SIZE)
+    chat_history.reverse()
 
     return render(
         request, "chatbotapp/index.html", {
             "chat_history": chat_history,
+            "history_cursor": history_cursor,
             "conversations": conversations,
+            "conversations_cursor": conversations_cursor,
             "active_conversation": conversation,
         })
 
 
+# ==================================================
+# 📜 Older messages / conversations (keyset pages)
+# ==================================================
+def messages_queryset(conversation):
+    return ChatMessage.objects.filter(
+        conversation=conversation).select_related("document__ingestion_job")
+
+
+def conversations_queryset(user):
+    return Conversation.objects.filter(user=user)
+
+
+def serialize_message(chat):
+    data = {
+        "id": chat.id,
+        "message_type": chat.message_type,
+        "user_message": chat.user_message,
+        "bot_reply": chat.bot_reply,
+        "uploaded_file_name": chat.uploaded_file_name,
+        "created_at": chat.created_at.isoformat(),
+        "ingestion": None,
+    }
+
+    job = getattr(chat.document, "ingestion_job", None) if chat.document else None
+    if job is not None:
+        data["ingestion"] = {
+            "status": job.status,
+            "chunks_indexed": job.chunks_indexed,
+            "status_url": reverse("document_status", args=[chat.document_id]),
+        }
+    return data
+
+
+@login_required
+def conversation_messages(request, conversation_id):
+    """
+    Page of messages older than ?before=<cursor>, oldest first.
+    """
+    conversation = get_object_or_404(Conversation,
+                                     id=conversation_id,
+                                     user=request.user)
+    try:
+        messages, cursor = keyset_page(messages_queryset(conversation),
+                                       before=request.GET.get("before"),
+                                       limit=settings.CHAT_PAGE_SIZE)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
+    return JsonResponse({
+        "messages": [serialize_message(chat) for chat in reversed(messages)],
+        "next_cursor": cursor,
+    })
+
+
+@login_required
+def conversation_list(request):
+    """
+    Page of conversations older than ?before=<cursor>, newest first.
+    """
+    try:
+        conversations, cursor = keyset_page(
+            conversations_queryset(request.user),
+            before=request.GET.get("before"),
+            limit=settings.CONVERSATION_PAGE_SIZE)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
+    return JsonResponse({
+        "conversations": [{
+            "id": conv.id,
+            "title": conv.title,
+            "url": reverse("conversation", args=[conv.id]),
+            "delete_url": reverse("delete_conversation", args=[conv.id]),
+        } for conv in conversations],
+        "next_cursor": cursor,
+    })
+
+
+# ==================================================
+# ⚡ Streaming Chat (Server-Sent Events)
+# ==================================================
+def _sse(data, event=None):
+    payload = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+
+@login_required
+@require_POST
+def chat_stream(request, conversation_id):
+    user = request.user
+    conversation = get_object_or_404(Conversation,
+                                     id=conversation_id,
+                                     user=user)
+
+    user_msg = request.POST.get("message", "").strip()
+    if not user_msg:
+        return JsonResponse({"error": "Empty message"}, status=400)
+
+    enforced_prompt, history_text, document_context = build_chat_context(
+        conversation, user, user_msg)
+
+    def events():
+        cleaner = StreamingCleaner()
+        parts = []
+        try:
+            for delta in stream_ai_reply(
+                    message=enforced_prompt,
+                    history_text=history_text,
+                    document_text=document_context):
+                text = cleaner.feed(delta)
+                if text:
+                    parts.append(text)
+                    yield _sse({"delta": text})
+            text = cleaner.flush()
+            if text:
+                parts.append(text)
+                yield _sse({"delta": text})
+        except Exception as exc:  # pylint: disable=broad-except
+            yield _sse({"error": str(exc)}, event="error")
+            return
+
+        # ✅ Persist only a completed reply
+        message = save_chat_turn(conversation, user, user_msg,
+                                 "".join(parts))
+        yield _sse({"message_id": message.id}, event="done")
+
+    response = StreamingHttpResponse(events(),
+                                     content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@login_required
+@require_POST
+async def achat_stream(request, conversation_id):
+    """
+    ASGI version of chat_stream: nothing blocks the event loop while the
+    reply is generated, so one worker can hold many conversations.
+    """
+    user = await request.auser()
+    conversation = await aget_object_or_404(Conversation,
+                                            id=conversation_id,
+                                            user=user)
+
+    user_msg = request.POST.get("message", "").strip()
+    if not user_msg:
+        return JsonResponse({"error": "Empty message"}, status=400)
+
+    enforced_prompt, history_text, document_context = (
+        await abuild_chat_context(conversation, user, user_msg))
+
+    async def events():
+        cleaner = StreamingCleaner()
+        parts = []
+        try:
+            async for delta in astream_ai_reply(
+                    message=enforced_prompt,
+                    history_text=history_text,
+                    document_text=document_context):
+                text = cleaner.feed(delta)
+                if text:
+                    parts.append(text)
+                    yield _sse({"delta": text})
+            text = cleaner.flush()
+            if text:
+                parts.append(text)
+                yield _sse({"delta": text})
+        except Exception as exc:  # pylint: disable=broad-except
+            yield _sse({"error": str(exc)}, event="error")
+            return
+
+        # ✅ Persist only a completed reply
+        message = await asave_chat_turn(conversation, user, user_msg,
+                                        "".join(parts))
+        yield _sse({"message_id": message.id}, event="done")
+
+    response = StreamingHttpResponse(events(),
+                                     content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+# ==================================================
+# ⏳ Document ingestion status
+# ==================================================
+@login_required
+def document_status(request, document_id):
+    job = get_object_or_404(IngestionJob,
+                            document_id=document_id,
+                            document__user=request.user)
+    return JsonResponse({
+        "status": job.status,
+        "pages_processed": job.pages_processed,
+        "chunks_indexed": job.chunks_indexed,
+        "error": job.error,
+    })
+
+
+# ==================================================
+# 📈 Metrics (Prometheus text format)
+# ==================================================
+def metrics_endpoint(request):
+    """
+    This worker's metrics; needs the METRICS_TOKEN bearer token, or a
+    staff login when no token is configured.
+    """
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token:
+        authorized = hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {token}")
+    else:
+        authorized = request.user.is_staff
+    if not authorized:
+        return HttpResponse(status=403)
+
+    return HttpResponse(render_prometheus(),
+                        content_type="text/plain; version=0.0.4; "
+                        "charset=utf-8")
+
+
 # ==================================================
 # ➕ New Chat
 # ==================================================